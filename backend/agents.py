@@ -7,51 +7,55 @@ Defines specialized agents for:
 - Narrative generation
 """
 
-import os
 import json
+import asyncio
 import logging
-from typing import Optional
+from typing import Awaitable, Callable, Optional
 from crewai import Agent, Task, Crew, Process
 from crewai.tools import BaseTool
 from data_tools import get_all_tools, QueryAdsCampaignsTool, CalculateMetricsTool
-import google.generativeai as genai
+from intent_cache import research_suggestions, DATA_ANALYSIS_SUGGESTIONS
+from research_cache import research_cache
+from router import route, heuristic_route
+from deadline import deadline_scope, run_stage
+from scheduler import request_scheduler
+from llm_gateway import LLMUnavailable
+from cancellation import CANCELLED_WORK
+from tracing import current_trace, span, traced
+from request_metrics import set_intent
+from stage_graph import StageGraph
+from llm_client import generate_text, generate_text_sync
+from narrative_templates import narrative_policy, build_narrative
+from session_store import Session
 from dotenv import load_dotenv
 
 load_dotenv()
 
-# Configure logging for debug visibility
-logging.basicConfig(level=logging.INFO)
+# Output, sampling and per-request DEBUG lines are configured by log_pipeline
 logger = logging.getLogger("AI_AGENT")
-logger.setLevel(logging.DEBUG)
-
-# Create console handler with formatting
-if not logger.handlers:
-    ch = logging.StreamHandler()
-    ch.setLevel(logging.DEBUG)
-    formatter = logging.Formatter('[%(name)s] %(message)s')
-    ch.setFormatter(formatter)
-    logger.addHandler(ch)
-
-# Configure Gemini
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-genai.configure(api_key=GOOGLE_API_KEY)
 
 
 class GeminiLLM:
     """Simple wrapper to use Gemini as the LLM for crewAI agents."""
     
     def __init__(self, model_name: str = "gemini-3-flash-preview"):
-        self.model = genai.GenerativeModel(model_name)
         self.model_name = model_name
     
     def __call__(self, prompt: str) -> str:
-        response = self.model.generate_content(prompt)
-        return response.text
+        return generate_text_sync(prompt, self.model_name, site="crewai")
 
 
 # Initialize Gemini LLM
 gemini_llm = GeminiLLM()
 
+# Progressive streaming: crews call `emit(event)` as parts of the answer become ready
+EmitFn = Callable[[dict], Awaitable[None]]
+
+
+async def emit_section(emit: EmitFn, section_id: str, order: int, section: dict) -> None:
+    """Emit one response section; `order` is its position in the final message."""
+    await emit({"event": "section", "id": section_id, "order": order, "section": section})
+
 
 def create_router_agent() -> Agent:
     """Create the Router Agent that classifies user intent."""
@@ -96,144 +100,19 @@ def create_narrative_agent() -> Agent:
     )
 
 
-def classify_intent(query: str, conversation_history: str = "") -> dict:
-    """Classify user query intent using Gemini."""
-    
-    logger.info(f"🔍 CLASSIFYING INTENT for query: '{query}'")
-    
-    prompt = f"""Bạn là một bộ phân loại intent cho một ứng dụng quản lý quảng cáo affiliate.
-
-Phân loại câu hỏi của người dùng vào MỘT trong các loại sau:
-
-1. **data_analysis** - Người dùng muốn xem dữ liệu, biểu đồ, metrics về quảng cáo. BAO GỒM CẢ PHÂN TÍCH THEO GROUP.
-   Ví dụ: "Chi phí tháng 11", "Hiển thị clicks tuần này", "ROAS của tôi thế nào?", "CPC", "Cost per click"
-   Ví dụ Grouping: "Chi phí theo tài khoản", "Doanh thu theo chiến dịch", "Hiệu quả từng account" -> Intent này.
-   
-2. **data_query** - Người dùng muốn danh sách, bảng dữ liệu cụ thể về campaigns/accounts (CHỈ LIST/TABLE)
-   Ví dụ: "Liệt kê các chiến dịch", "Tài khoản nào đang active?", "Danh sách tài khoản"
-
-3. **comparison** - Người dùng muốn so sánh dữ liệu giữa các khoảng thời gian hoặc đối tượng
-   Ví dụ: "So sánh tháng 10 và 11", "Campaign nào tốt hơn?", "Tuần này vs tuần trước"
-   
-4. **explanation** - Người dùng cần giải thích, hướng dẫn, hoặc hiểu một khái niệm
-   Ví dụ: "CPC là gì?", "Tại sao chi phí tăng?", "Giải thích ROAS"
-
-5. **followup** - Người dùng hỏi tiếp về response trước đó
-   Ví dụ: "Chi tiết hơn", "Tại sao ngày 15 lại cao?", "Giải thích thêm"
-
-6. **research** - Người dùng muốn TÌM KIẾM chương trình affiliate, niche, hoặc cơ hội kiếm tiền
-   Ví dụ: "Crypto", "Forex", "Finance", "Gaming", "Tìm affiliate program", "Ngách nào tốt?"
-
-Câu hỏi: "{query}"
-
-Lịch sử hội thoại: {conversation_history if conversation_history else "Chưa có"}
-
-Trả lời CHÍNH XÁC theo format JSON:
-{{
-    "intent": "<loại>", 
-    "entities": {{
-        "time_range": "<khoảng thời gian nếu có>", 
-        "metrics": ["<metrics được nhắc đến>"], 
-        "campaigns": ["<campaigns nếu có>"], 
-        "niche": "<ngách/lĩnh vực nếu có>",
-        "program": "<tên chương trình affiliate nếu có, v.d. Shopee, Binance>",
-        "keywords": ["<từ khóa cần lọc nều có, v.d. crypto, forex>"],
-        "group_by": "<account|campaign|day|week|month>",
-        "breakdown": "<account|campaign|none>",
-        "visual_type": "<line|bar|area|none>"
-    }}
-}}
-"""
-    
-    model = genai.GenerativeModel("gemini-3-flash-preview")
-    response = model.generate_content(prompt)
-    
-    try:
-        # Clean up response
-        text = response.text.strip()
-        if text.startswith("```"):
-            text = text.split("```")[1]
-            if text.startswith("json"):
-                text = text[4:]
-        text = text.strip()
-        
-        result = json.loads(text)
-        logger.info(f"✅ INTENT CLASSIFIED: {result.get('intent')} | Entities: {result.get('entities')}")
-        return result
-    except (json.JSONDecodeError, IndexError) as e:
-        logger.warning(f"⚠️ Failed to parse intent response: {e}, defaulting to data_analysis")
-        return {"intent": "data_analysis", "entities": {}}
+async def classify_intent(query: str, conversation_history: str = "", previous_context: Optional[dict] = None) -> dict:
+    """Classify user query intent (router.route result as a dict)."""
+    result = await route(query, conversation_history, previous_context)
+    return result.to_dict()
 
 
-async def execute_data_analysis_crew(query: str, entities: dict) -> dict:
-    """Execute the data analysis crew for data visualization requests."""
-    
-    logger.info(f"📊 EXECUTING DATA ANALYSIS for: '{query}'")
-    logger.debug(f"   Entities: {entities}")
-    
-    # Step 1: Query the data
-    query_tool = QueryAdsCampaignsTool()
-    calc_tool = CalculateMetricsTool()
-    
-    time_range = entities.get("time_range") or "last 30 days"
-    breakdown = entities.get("breakdown")
-    visual_type = entities.get("visual_type") # Explicit user request: line, bar, etc.
-    
-    logger.info(f"📅 Time range: {time_range} | Breakdown: {breakdown} | Visual: {visual_type}")
-    
-    # Get campaign data
-    query_params = {
-        "date_range": time_range,
-        "group_by": entities.get("group_by", "day")
-    }
-    
-    # If granular breakdown requested (e.g. "compare accounts over time")
-    if breakdown in ["account", "campaign"] and "theo" in query.lower() and ("ngày" in query.lower() or "tháng" in query.lower() or "over time" in query.lower() or "biểu đồ" in query.lower()):
-        query_params["breakdown"] = breakdown
-    
-    # Add optional filters
-    if entities.get("program"):
-        query_params["program"] = entities["program"]
-    if entities.get("keywords"):
-        query_params["keywords"] = entities["keywords"]
-    
-    data_result = query_tool._run(json.dumps(query_params))
-    data_parsed = json.loads(data_result)
+@traced("chart.build")
+def build_chart_section(query: str, data_parsed: dict, time_range: str, breakdown: Optional[str], visual_type: Optional[str]) -> dict:
+    """Build the chart section (series selection and pivoting) from query results.
     
+    Pure CPU work with no dependency on the narrative.
+    """
     is_granular = data_parsed.get("is_granular", False)
-    logger.debug(f"   Data points retrieved: {len(data_parsed['data'])} | Granular: {is_granular}")
-    
-    # Calculate metrics
-    metrics_result = calc_tool._run(json.dumps({
-        "data": data_parsed["data"],
-        "metrics": ["cpc", "roas", "ctr"]
-    }))
-    metrics_parsed = json.loads(metrics_result)
-    
-    # Step 2: Generate narrative
-    narrative_prompt = f"""Bạn là một chuyên gia phân tích quảng cáo.
-Người dùng đang hỏi: "{query}"
-
-Dữ liệu tổng hợp ({time_range}):
-- Clicks: {data_parsed['summary']['totalClicks']:,}
-- Cost: {data_parsed['summary']['totalCost']:,.0f}
-- Revenue: {data_parsed['summary']['totalRevenue']:,.0f}
-- CPC: {metrics_parsed['metrics'].get('cpc', 0):,.0f}
-- ROAS: {metrics_parsed['metrics'].get('roas', 0):.2f}
-- CTR: {metrics_parsed['metrics'].get('ctr', 0):.2f}%
-
-Yêu cầu logic:
-1. Đọc kỹ câu hỏi người dùng để biết họ quan tâm chỉ số nào.
-2. Viết nhận định tập trung vào câu hỏi đó. 
-3. Nếu là so sánh (breakdown), hãy nhận xét xu hướng của các entities.
-4. Ngắn gọn (2-3 câu). Tiếng Việt.
-"""
-
-    model = genai.GenerativeModel("gemini-3-flash-preview")
-    narrative_response = model.generate_content(narrative_prompt)
-    narrative = narrative_response.text.strip()
-    
-    # Step 3: Prepare Visualization Data
     chart_data = data_parsed["data"]
     series = []
     chart_title = "Hiệu suất quảng cáo"
@@ -312,30 +191,162 @@ Yêu cầu logic:
             ]
              if not visual_type: chart_type = "area"
 
-    logger.info(f"📈 CHART: {chart_type} | SERIES: {len(series)} | DATA: {len(chart_data)}")
+    logger.info("📈 CHART: %s | SERIES: %d | DATA: %d", chart_type, len(series), len(chart_data))
     
+    return {
+        "type": "chart",
+        "content": {
+            "chartType": chart_type,
+            "title": f"{chart_title}",
+            "data": chart_data,
+            "config": {
+                "xAxis": x_axis_key,
+                "series": series
+            }
+        }
+    }
+
+
+@traced("crew.data_analysis")
+async def execute_data_analysis_crew(
+    query: str, entities: dict, emit: Optional[EmitFn] = None, session: Optional[Session] = None
+) -> dict:
+    """Execute the data analysis crew for data visualization requests.
+    
+    Runs as a small stage graph:
+    
+        data ─┬─> chart ──────────────> (emitted)
+              └─> metrics ─> narrative ─> (emitted)
+    
+    Chart building does not depend on the narrative, so the chart section is
+    ready and streamed while the narrative is still generating. With a
+    session, follow-ups run on the rows the previous data query matched when
+    those cover the new filters (see data_tools.RowSelection).
+    """
+    
+    logger.info("📊 EXECUTING DATA ANALYSIS for: '%s'", query)
+    logger.debug("   Entities: %s", entities)
+    
+    time_range = entities.get("time_range") or "last 30 days"
+    breakdown = entities.get("breakdown")
+    visual_type = entities.get("visual_type") # Explicit user request: line, bar, etc.
+    
+    logger.info("📅 Time range: %s | Breakdown: %s | Visual: %s", time_range, breakdown, visual_type)
+    
+    # Get campaign data
+    query_params = {
+        "date_range": time_range,
+        "group_by": entities.get("group_by", "day")
+    }
+    
+    # If granular breakdown requested (e.g. "compare accounts over time")
+    if breakdown in ["account", "campaign"] and "theo" in query.lower() and ("ngày" in query.lower() or "tháng" in query.lower() or "over time" in query.lower() or "biểu đồ" in query.lower()):
+        query_params["breakdown"] = breakdown
+    
+    # Add optional filters
+    if entities.get("program"):
+        query_params["program"] = entities["program"]
+    if entities.get("keywords"):
+        query_params["keywords"] = entities["keywords"]
+    
+    # Stage: Query the data
+    def run_query() -> dict:
+        if session is not None:
+            data_result, selection = QueryAdsCampaignsTool().run_on(query_params, session.rows)
+            session.keep_rows(selection)
+        else:
+            data_result = QueryAdsCampaignsTool()._run(json.dumps(query_params))
+        data_parsed = json.loads(data_result)
+        logger.debug("   Data points retrieved: %d | Granular: %s", len(data_parsed["data"]), data_parsed.get("is_granular", False))
+        return data_parsed
+    
+    # Stage: Calculate metrics
+    def calculate_metrics(data: dict) -> dict:
+        metrics_result = CalculateMetricsTool()._run(json.dumps({
+            "data": data["data"],
+            "metrics": ["cpc", "roas", "ctr"]
+        }))
+        return json.loads(metrics_result)
+    
+    # Stage: Prepare Visualization Data
+    async def chart(data: dict) -> dict:
+        section = await asyncio.to_thread(build_chart_section, query, data, time_range, breakdown, visual_type)
+        if emit:
+            await emit_section(emit, "chart", 1, section)
+        return section
+    
+    # Stage: Generate narrative
+    async def narrative(data: dict, metrics: dict) -> dict:
+        narrative_prompt = f"""Bạn là một chuyên gia phân tích quảng cáo.
+Người dùng đang hỏi: "{query}"
+
+Dữ liệu tổng hợp ({time_range}):
+- Clicks: {data['summary']['totalClicks']:,}
+- Cost: {data['summary']['totalCost']:,.0f}
+- Revenue: {data['summary']['totalRevenue']:,.0f}
+- CPC: {metrics['metrics'].get('cpc', 0):,.0f}
+- ROAS: {metrics['metrics'].get('roas', 0):.2f}
+- CTR: {metrics['metrics'].get('ctr', 0):.2f}%
+
+Yêu cầu logic:
+1. Đọc kỹ câu hỏi người dùng để biết họ quan tâm chỉ số nào.
+2. Viết nhận định tập trung vào câu hỏi đó. 
+3. Nếu là so sánh (breakdown), hãy nhận xét xu hướng của các entities.
+4. Ngắn gọn (2-3 câu). Tiếng Việt.
+"""
+
+        mode = narrative_policy.choose(query)
+        content = None
+        if mode == "llm":
+            try:
+                with narrative_policy.track_llm():
+                    content = await run_stage("narrative", lambda: generate_text(narrative_prompt, site="narrative"), fallback=lambda: None)
+                if content is None:
+                    logger.warning("⏱️ Narrative out of time budget, using template")
+                    mode = "template"
+                else:
+                    content = content.strip()
+            except Exception as e:
+                logger.warning("⚠️ Narrative generation failed (%s), using template", e)
+                mode = "template"
+        if content is None:
+            # Only the templates use the previous period: its extra dataset scan is made here
+            previous = None
+            if data["data"]:
+                previous = await run_stage(
+                    "query", lambda: asyncio.to_thread(QueryAdsCampaignsTool().previous_period, query_params),
+                    fallback=lambda: None
+                )
+            content = build_narrative(query, {**data, "previousPeriod": previous} if previous else data, time_range)
+        narrative_policy.record(mode)
+        logger.info("📝 NARRATIVE: %s", mode)
+        section = {
+            "type": "narrative",
+            "content": content
+        }
+        if emit:
+            await emit_section(emit, "narrative", 0, section)
+        return section
+    
+    # The query stage is bounded by its share of the request deadline
+    async def query_data() -> dict:
+        return await run_stage("query", lambda: asyncio.to_thread(run_query))
+    
+    graph = StageGraph("data_analysis")
+    graph.add("data", query_data)
+    graph.add("metrics", calculate_metrics, deps=["data"], offload=True)
+    graph.add("chart", chart, deps=["data"])
+    graph.add("narrative", narrative, deps=["data", "metrics"])
+    results = await graph.run()
+    
+    logger.info("⏱️ STAGES: %s", graph.describe())
+    
+    data_parsed = results["data"]
     return {
         "type": "composite",
         "content": {
-            "sections": [
-                {
-                    "type": "narrative",
-                    "content": narrative
-                },
-                {
-                    "type": "chart",
-                    "content": {
-                        "chartType": chart_type,
-                        "title": f"{chart_title}",
-                        "data": chart_data,
-                        "config": {
-                            "xAxis": x_axis_key,
-                            "series": series
-                        }
-                    }
-                }
-            ],
-            "summary": metrics_parsed
+            "sections": [results["narrative"], results["chart"]],
+            "summary": results["metrics"]
         },
         "context": {
             "filters": {
@@ -344,16 +355,13 @@ Yêu cầu logic:
                 "program": entities.get("program"),
                 "keywords": entities.get("keywords")
             },
-            "followupSuggestions": [
-                "So sánh với tháng trước",
-                "Phân tích theo chiến dịch", 
-                "Chi tiết hơn về dữ liệu này"
-            ]
+            "followupSuggestions": list(DATA_ANALYSIS_SUGGESTIONS)
         }
     }
 
 
 
+@traced("crew.explanation")
 async def execute_explanation_crew(query: str, conversation_history: str = "") -> dict:
     """Execute explanation response for conceptual questions."""
     
@@ -371,15 +379,15 @@ Yêu cầu:
 - Format với markdown khi phù hợp
 - Thân thiện nhưng chuyên nghiệp"""
 
-    model = genai.GenerativeModel("gemini-3-flash-preview")
-    response = model.generate_content(prompt)
+    text = await generate_text(prompt, site="explanation")
     
     return {
         "type": "text",
-        "content": response.text.strip()
+        "content": text.strip()
     }
 
 
+@traced("crew.data_query")
 async def execute_data_query_crew(query: str, entities: dict) -> dict:
     """Execute data query for table/list requests."""
     
@@ -455,13 +463,32 @@ async def execute_data_query_crew(query: str, entities: dict) -> dict:
     }
 
 
-async def execute_research_crew(query: str, entities: dict, conversation_history: str = "") -> dict:
+@traced("crew.research")
+async def execute_research_crew(query: str, entities: dict, conversation_history: str = "", emit: Optional[EmitFn] = None) -> dict:
     """Execute affiliate program research - returns table of program recommendations.
     
     This reuses the old research functionality to find affiliate programs in a niche.
+    The narrative introduction is emitted before the program lookup starts.
+    An `expand` request ("Thêm programs ...") asks for programs other than the
+    cached ones and bypasses the cache.
     """
     
     niche = entities.get("niche", query)  # Use query as niche if not extracted
+    expand = bool(entities.get("expand"))
+    shown_brands = []
+    if expand:
+        shown = research_cache.get(niche, allow_expired=True)
+        shown_brands = [row.get("brand") for row in (shown or {}).get("table", []) if isinstance(row, dict) and row.get("brand")]
+    
+    # Generate a brief narrative introduction
+    narrative_section = {
+        "type": "narrative",
+        "content": f"Đây là các chương trình affiliate trong lĩnh vực **{niche}** mà tôi tìm được cho bạn:"
+    }
+    if emit:
+        await emit_section(emit, "narrative", 0, narrative_section)
+    
+    exclusion = f"Do NOT repeat these programs already shown to the user: {', '.join(shown_brands)}.\n" if shown_brands else ""
     
     # Research prompt template (same as old generator.py)
     prompt = f"""Research Niche: {niche}
@@ -470,7 +497,7 @@ Context from previous conversation (if any):
 
 Generate 5-10 high-quality affiliate programs (native or network) relevant to this niche in Vietnam (or global programs popular in Vietnam).
 If the niche is vague (e.g. "more", "others"), use the Context to determine the actual topic.
-
+{exclusion}
 For each program, provide:
 - brand: Name of the brand.
 - program_url: Direct link to affiliate page.
@@ -483,73 +510,98 @@ For each program, provide:
 Return ONLY the JSON array.
 """
     
-    model = genai.GenerativeModel("gemini-3-flash-preview")
-    response = model.generate_content(prompt)
-    
-    # Parse the response
-    buffer = response.text.strip()
-    
-    # Post-process: Strip markdown wrappers if present
-    if buffer.startswith('```'):
-        lines = buffer.split('\n')
-        if lines[0].startswith('```'):
-            lines = lines[1:]
-        if lines and lines[-1].strip() == '```':
-            lines = lines[:-1]
-        buffer = '\n'.join(lines).strip()
-    
-    try:
-        parsed = json.loads(buffer)
-        if isinstance(parsed, dict) and 'content' in parsed:
-            table_data = parsed['content']
-        elif isinstance(parsed, list):
-            table_data = parsed
-        else:
-            table_data = []
-    except json.JSONDecodeError:
-        table_data = [{"error": "Không thể parse kết quả từ AI"}]
+    async def fetch_programs() -> list:
+        # Parse the response
+        buffer = (await generate_text(prompt, site="research")).strip()
+        
+        # Post-process: Strip markdown wrappers if present
+        if buffer.startswith('```'):
+            lines = buffer.split('\n')
+            if lines[0].startswith('```'):
+                lines = lines[1:]
+            if lines and lines[-1].strip() == '```':
+                lines = lines[:-1]
+            buffer = '\n'.join(lines).strip()
+        
+        try:
+            parsed = json.loads(buffer)
+            if isinstance(parsed, dict) and 'content' in parsed:
+                return parsed['content']
+            elif isinstance(parsed, list):
+                return parsed
+            return []
+        except json.JSONDecodeError:
+            return [{"error": "Không thể parse kết quả từ AI"}]
+    
+    # A vague query without an extracted niche depends on the conversation,
+    # so only niche-keyed lookups go through the shared cache
+    def out_of_time() -> tuple:
+        table, info = research_cache.serve_degraded(niche)
+        if table is None:
+            raise LLMUnavailable("deadline")
+        return table, info
+    
+    if (entities.get("niche") or not conversation_history) and not expand:
+        table_data, cache_info = await run_stage(
+            "research", lambda: research_cache.get_or_fetch(niche, fetch_programs), fallback=out_of_time
+        )
+        logger.info("🗄️ RESEARCH CACHE: hit=%s | age=%ss", cache_info["hit"], cache_info["ageSeconds"])
+    else:
+        async def fetch_uncached() -> tuple:
+            return await fetch_programs(), research_cache.describe(None)
+        table_data, cache_info = await run_stage("research", fetch_uncached, fallback=out_of_time)
     
-    # Generate a brief narrative introduction
-    narrative = f"Đây là các chương trình affiliate trong lĩnh vực **{niche}** mà tôi tìm được cho bạn:"
+    table_section = {
+        "type": "table",
+        "content": table_data
+    }
+    if emit:
+        await emit_section(emit, "table", 1, table_section)
     
     return {
         "type": "composite",
         "content": {
-            "sections": [
-                {
-                    "type": "narrative",
-                    "content": narrative
-                },
-                {
-                    "type": "table",
-                    "content": table_data
-                }
-            ]
+            "sections": [narrative_section, table_section]
         },
         "context": {
             "niche": niche,
-            "followupSuggestions": [
-                f"Thêm programs trong lĩnh vực {niche}",
-                "So sánh commission rates",
-                "Ngách liên quan khác"
-            ]
+            "cache": cache_info,
+            "followupSuggestions": research_suggestions(niche)
         }
     }
 
 
-async def run_agent_workflow(messages: list) -> dict:
+def describe_answer(result: dict) -> str:
+    """Text of an answer as kept in the conversation history."""
+    content = result.get("content")
+    if isinstance(content, str):
+        return content
+    if isinstance(content, dict):
+        for section in content.get("sections", []):
+            if section.get("type") == "narrative" and isinstance(section.get("content"), str):
+                return section["content"]
+    return "[Previous data/chart response]"
+
+
+async def run_agent_workflow(
+    messages: list, emit: Optional[EmitFn] = None, user_id: str = "anonymous", session: Optional[Session] = None
+) -> dict:
     """Main entry point for the agent workflow.
     
     Args:
         messages: List of message dicts with 'role' and 'content'
+        emit: Optional async callback receiving progressive events
+              (route decision, then sections as they become ready)
+        user_id: Caller identity used for fair queuing between users
+        session: Server-side conversation (see session_store.py). Its history
+                 replaces the one rebuilt from `messages`, and the exchange
+                 is recorded in it.
     
     Returns:
         Response dict with type and content
     """
     
-    logger.info("=" * 60)
     logger.info("🤖 AI AGENT WORKFLOW STARTED")
-    logger.info("=" * 60)
     
     # Get the latest user message
     user_messages = [m for m in messages if m.get('role') == 'user']
@@ -557,43 +609,137 @@ async def run_agent_workflow(messages: list) -> dict:
         return {"type": "text", "content": "Không tìm thấy tin nhắn từ người dùng."}
     
     query = user_messages[-1].get('content', '')
-    logger.info(f"📝 USER QUERY: '{query}'")
-    logger.debug(f"   Total messages in context: {len(messages)}")
+    logger.info("📝 USER QUERY: '%s'", query)
+    logger.debug("   Total messages in context: %d", len(messages))
     
     # Build conversation history for context
     conversation_history = ""
-    for msg in messages[:-1]:
-        role = msg.get('role', 'user')
-        content = msg.get('content', '')
-        if isinstance(content, str):
-            conversation_history += f"{role}: {content}\n"
-        elif isinstance(content, dict):
-            # Summarize previous response
-            conversation_history += f"{role}: [Previous data/chart response]\n"
-    
-    # Step 1: Classify intent
-    intent_result = classify_intent(query, conversation_history)
-    intent = intent_result.get("intent", "data_analysis")
-    entities = intent_result.get("entities", {})
-    
-    logger.info(f"🎯 ROUTING TO: {intent.upper()}")
-    
-    # Step 2: Route to appropriate crew
+    previous_context = None
+    if session is not None:
+        conversation_history = session.history()
+        previous_context = session.previous_context
+    else:
+        for msg in messages[:-1]:
+            role = msg.get('role', 'user')
+            content = msg.get('content', '')
+            if isinstance(content, str):
+                conversation_history += f"{role}: {content}\n"
+            elif isinstance(content, dict):
+                # Summarize previous response
+                conversation_history += f"{role}: [Previous data/chart response]\n"
+            if role == 'assistant' and isinstance(msg.get('context'), dict):
+                previous_context = msg['context']
+    
+    with deadline_scope(), span("agent.workflow", messages=len(messages)):
+        result = await _route_and_execute(query, conversation_history, previous_context, emit, user_id, session)
+    if session is not None:
+        session.add_exchange(query, describe_answer(result), result.get("context"))
+    return result
+
+
+async def _route_and_execute(
+    query: str, conversation_history: str, previous_context: Optional[dict], emit: Optional[EmitFn], user_id: str,
+    session: Optional[Session] = None
+) -> dict:
+    """Route the query and run the matching crew (inside the request deadline)."""
+    # Step 1: Route (single structured call, or seeded/cached; keyword fallback when out of time)
+    with span("agent.classify") as classify_span:
+        routed = await run_stage(
+            "routing", lambda: route(query, conversation_history, previous_context), fallback=lambda: heuristic_route(query)
+        )
+        if classify_span:
+            classify_span.set(intent=routed.intent, source=routed.source)
+    intent = routed.intent
+    entities = routed.entities.to_dict()
+    set_intent(intent)
+    
+    logger.info("🎯 ROUTING TO: %s (%s, confidence %.2f)", intent.upper(), routed.source, routed.confidence)
+    if emit:
+        await emit({"event": "route", "intent": intent, "entities": entities, "confidence": routed.confidence})
+    
+    # Step 2: Run the matching crew once the scheduler admits its priority class
+    async with request_scheduler.slot(intent, user_id):
+        return await _execute(intent, query, entities, conversation_history, emit, session)
+
+
+async def _execute(
+    intent: str, query: str, entities: dict, conversation_history: str, emit: Optional[EmitFn],
+    session: Optional[Session] = None
+) -> dict:
+    """Run the crew for a routed intent."""
     if intent == "data_analysis" or intent == "comparison":
-        return await execute_data_analysis_crew(query, entities)
+        return await execute_data_analysis_crew(query, entities, emit, session)
     elif intent == "data_query":
         return await execute_data_query_crew(query, entities)
     elif intent == "explanation":
         return await execute_explanation_crew(query, conversation_history)
     elif intent == "research":
-        return await execute_research_crew(query, entities, conversation_history)
+        return await execute_research_crew(query, entities, conversation_history, emit)
     elif intent == "followup":
         # For followup, try to understand what type of followup
         if any(word in query.lower() for word in ["tại sao", "why", "giải thích", "explain"]):
             return await execute_explanation_crew(query, conversation_history)
         else:
-            return await execute_data_analysis_crew(query, entities)
+            return await execute_data_analysis_crew(query, entities, emit, session)
     
     # Default fallback
     return await execute_explanation_crew(query, conversation_history)
 
+
+
+async def stream_agent_workflow(
+    messages: list, user_id: str = "anonymous", timings: bool = False, session: Optional[Session] = None
+):
+    """Run the agent workflow and yield progressive events.
+    
+    Event order: `route` (intent known), `section` events as each part of the
+    answer is ready (any order, each with an `id` and final `order`), then
+    `context` (filters, follow-up suggestions) and `done`. Non-composite
+    answers are sent as a single `message` event.
+    
+    With `timings=True` the context also carries the span timings of the
+    current request trace (see tracing.py). With a `session` the history
+    comes from (and the answer is recorded in) the server-side session.
+    """
+    queue = asyncio.Queue()
+    
+    async def emit(event: dict) -> None:
+        await queue.put(event)
+    
+    task = asyncio.create_task(run_agent_workflow(messages, emit, user_id, session))
+    task.add_done_callback(lambda _: queue.put_nowait(None))
+    
+    emitted_sections = set()
+    try:
+        while True:
+            event = await queue.get()
+            if event is None:
+                break
+            if event.get("event") == "section":
+                emitted_sections.add(event["id"])
+            yield event
+        
+        result = task.result()
+    finally:
+        if not task.done():
+            task.cancel()
+            CANCELLED_WORK.labels("agent_workflow").inc()
+    
+    if result.get("type") != "composite":
+        yield {"event": "message", "type": result.get("type"), "content": result.get("content")}
+    else:
+        # Sections the crew did not stream are sent now, in their final order
+        for order, section in enumerate(result["content"].get("sections", [])):
+            section_id = section.get("type", str(order))
+            if section_id not in emitted_sections:
+                yield {"event": "section", "id": section_id, "order": order, "section": section}
+    context = result.get("context")
+    if timings and current_trace():
+        context = {**(context or {}), "timings": current_trace().timings()}
+    if context:
+        yield {"event": "context", "context": context}
+    
+    done = {"event": "done", "type": result.get("type")}
+    if isinstance(result.get("content"), dict) and "summary" in result["content"]:
+        done["summary"] = result["content"]["summary"]
+    yield done
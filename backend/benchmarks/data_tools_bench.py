@@ -0,0 +1,284 @@
+"""
+data_tools Microbenchmarks
+
+Times QueryAdsCampaignsTool (every group_by x breakdown x filter
+combination), QueryCampaignListTool, CalculateMetricsTool and
+parse_date_range over seeded MockDatabase datasets of 5 / 500 / 5,000
+accounts and 90 / 365 / 1,095 days. Each case records the best wall time,
+the daily rows scanned and the peak traced memory.
+
+Datasets above --max-rows (estimated daily rows) are skipped and listed in
+the results: the in-memory mock store needs ~0.5 KiB per row and every
+query scans all rows, so 5,000 accounts x 1,095 days (~44M rows) does not
+fit a laptop. Raise the limit on a bigger machine.
+
+    python benchmarks/data_tools_bench.py                     # run, write results
+    python benchmarks/data_tools_bench.py --save-baseline     # store as baseline
+    python benchmarks/data_tools_bench.py --check             # fail on regressions
+
+--check exits with status 1 when a case is slower (or uses more memory)
+than the stored baseline by more than --threshold.
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import data_tools
+from data_tools import (
+    ROWS_SCANNED,
+    CalculateMetricsTool,
+    QueryAdsCampaignsTool,
+    QueryCampaignListTool,
+    parse_date_range,
+)
+from mock_data_generator import MockDatabase
+
+RESULTS_DIR = os.path.join(BACKEND_DIR, "benchmarks", "results")
+BASELINE_PATH = os.path.join(BACKEND_DIR, "benchmarks", "baselines", "data_tools.json")
+
+ACCOUNT_SCALES = (5, 500, 5000)
+DAY_SCALES = (90, 365, 1095)
+CAMPAIGNS_PER_ACCOUNT = 8
+CASE_BUDGET_SECONDS = 3.0
+DATE_PARSE_BATCH = 2000
+# Suspected regressions are re-measured this many times (shared machines are noisy)
+RECHECKS = 2
+
+GROUP_BY = ("day", "week", "month", "account", "campaign")
+BREAKDOWNS = (None, "account", "campaign")
+FILTERS = ("none", "account", "campaigns", "program", "keywords")
+
+DATE_QUERIES = (
+    "7 ngày qua", "last 30 days", "tháng 11", "tháng này", "tuần này", "this month", "Chi phí quảng cáo",
+)
+
+
+def estimated_rows(accounts: int, days: int) -> int:
+    return accounts * CAMPAIGNS_PER_ACCOUNT * (days + 1)
+
+
+def build_dataset(accounts: int, days: int, seed: int) -> MockDatabase:
+    random.seed(seed)
+    db = MockDatabase()
+    db.generate_data(num_accounts=accounts, campaigns_per_account=CAMPAIGNS_PER_ACCOUNT, days_history=days)
+    return db
+
+
+def filter_params(db: MockDatabase, name: str) -> dict:
+    if name == "account":
+        return {"account_ids": [db.accounts[0]["id"]]}
+    if name == "campaigns":
+        return {"campaign_ids": [c["id"] for c in db.campaigns[:3]]}
+    if name == "program":
+        return {"program": "Shopee"}
+    if name == "keywords":
+        return {"keywords": ["crypto"]}
+    return {}
+
+
+def rows_scanned_total() -> float:
+    return sum(child.value for _, child in ROWS_SCANNED.children())
+
+
+def measure(fn, repeat: int, budget: float = CASE_BUDGET_SECONDS) -> dict:
+    """Best wall time of up to `repeat` runs, rows scanned per run and peak traced memory.
+
+    The minimum is the least noisy estimate on a shared machine; slow cases
+    stop repeating once `budget` seconds have been spent.
+    """
+    fn()  # warm-up
+    timings = []
+    scanned_before = rows_scanned_total()
+    while len(timings) < repeat and (not timings or sum(timings) < budget):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    rows_scanned = (rows_scanned_total() - scanned_before) / len(timings)
+
+    # Tracing slows execution, so memory is measured on a separate run
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "wallMs": round(min(timings) * 1000, 3),
+        "runs": len(timings),
+        "rowsScanned": int(rows_scanned),
+        "peakKiB": round(peak / 1024, 1),
+        "resultBytes": len(result) if isinstance(result, str) else None,
+    }
+
+
+def dataset_cases(db: MockDatabase, days: int) -> dict:
+    """Case name -> zero-argument callable running it against `db`."""
+    data_tools.db = db
+    ads = QueryAdsCampaignsTool()
+    campaign_list = QueryCampaignListTool()
+    calculate = CalculateMetricsTool()
+    cases = {}
+
+    def call(tool, params: dict):
+        query = json.dumps(params, ensure_ascii=False)
+        return lambda: tool._run(query)
+
+    for group_by in GROUP_BY:
+        for breakdown in BREAKDOWNS:
+            for filter_name in FILTERS:
+                params = {"date_range": f"last {days} days", "group_by": group_by, **filter_params(db, filter_name)}
+                if breakdown:
+                    params["breakdown"] = breakdown
+                cases[f"ads/{group_by}/{breakdown or 'none'}/{filter_name}"] = call(ads, params)
+
+    list_filters = {
+        "none": {},
+        "account": {"account_id": db.accounts[0]["id"]},
+        "program": {"program": "Shopee"},
+        "keyword": {"keyword": "crypto"},
+    }
+    for name, params in list_filters.items():
+        cases[f"campaign_list/{name}"] = call(campaign_list, params)
+
+    day_rows = json.loads(ads._run(json.dumps({"date_range": f"last {days} days"})))["data"]
+    for name, data in {"daily_series": day_rows, "raw_rows": db.daily_data[:100_000]}.items():
+        cases[f"calculate_metrics/{name}"] = call(calculate, {"data": data, "metrics": ["cpc", "ctr", "roas", "cpa", "roi"]})
+    return cases
+
+
+def date_parsing_cases() -> dict:
+    def batch(query: str):
+        def run():
+            for _ in range(DATE_PARSE_BATCH):
+                parse_date_range(query)
+        return run
+
+    return {f"parse_date_range/{query} x{DATE_PARSE_BATCH}": batch(query) for query in DATE_QUERIES}
+
+
+def run_cases(dataset: str, cases: dict, repeat: int, baseline: dict, threshold: float, min_ms: float) -> dict:
+    """Measure every case; cases that look regressed are measured again before being reported."""
+    results = {case: measure(fn, repeat) for case, fn in cases.items()}
+    for _ in range(RECHECKS):
+        suspects = [r["case"] for r in check_regressions({"datasets": {dataset: results}}, baseline, threshold, min_ms)]
+        for case in suspects:
+            again = measure(cases[case], repeat)
+            results[case]["wallMs"] = min(results[case]["wallMs"], again["wallMs"])
+            results[case]["peakKiB"] = min(results[case]["peakKiB"], again["peakKiB"])
+    return results
+
+
+def check_regressions(results: dict, baseline: dict, threshold: float, min_ms: float) -> list:
+    """Cases slower or hungrier than the baseline by more than `threshold` (relative)."""
+    regressions = []
+    for dataset, cases in results["datasets"].items():
+        for case, now in cases.items():
+            before = baseline.get("datasets", {}).get(dataset, {}).get(case)
+            if not before:
+                continue
+            slower = now["wallMs"] > before["wallMs"] * (1 + threshold) and now["wallMs"] - before["wallMs"] >= min_ms
+            bigger = now["peakKiB"] > before["peakKiB"] * (1 + threshold) and now["peakKiB"] - before["peakKiB"] >= 64
+            if slower or bigger:
+                regressions.append({
+                    "dataset": dataset,
+                    "case": case,
+                    "wallMs": [before["wallMs"], now["wallMs"]],
+                    "peakKiB": [before["peakKiB"], now["peakKiB"]],
+                })
+    return regressions
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark data_tools across dataset scales")
+    parser.add_argument("--accounts", default=",".join(map(str, ACCOUNT_SCALES)))
+    parser.add_argument("--days", default=",".join(map(str, DAY_SCALES)))
+    parser.add_argument("--max-rows", type=int, default=500_000, help="Skip datasets with more estimated daily rows")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Results file (default benchmarks/results/data_tools-<commit>.json)")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the baseline")
+    parser.add_argument("--check", action="store_true", help="Exit 1 when a case regressed against the baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed relative slowdown (0.2 = 20%%)")
+    parser.add_argument("--min-ms", type=float, default=2.0, help="Ignore slowdowns smaller than this")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.check:
+        if not os.path.exists(args.baseline):
+            print(f"No baseline at {args.baseline}; run with --save-baseline first")
+            sys.exit(1)
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    def run(dataset: str, cases: dict) -> dict:
+        return run_cases(dataset, cases, args.repeat, baseline, args.threshold, args.min_ms)
+
+    commit = git_commit()
+    results = {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "config": {"repeat": args.repeat, "seed": args.seed, "maxRows": args.max_rows},
+        "datasets": {"date_parsing": run("date_parsing", date_parsing_cases())},
+        "skipped": [],
+    }
+
+    for accounts in (int(a) for a in args.accounts.split(",")):
+        for days in (int(d) for d in args.days.split(",")):
+            name = f"{accounts}acc-{days}d"
+            if estimated_rows(accounts, days) > args.max_rows:
+                results["skipped"].append({"dataset": name, "estimatedRows": estimated_rows(accounts, days)})
+                print(f"{name}: skipped (~{estimated_rows(accounts, days):,} rows > --max-rows)")
+                continue
+            started = time.perf_counter()
+            db = build_dataset(accounts, days, args.seed)
+            print(f"{name}: {len(db.daily_data):,} rows generated in {time.perf_counter() - started:.1f}s")
+            cases = run(name, dataset_cases(db, days))
+            results["datasets"][name] = cases
+            slowest = max(cases.items(), key=lambda item: item[1]["wallMs"])
+            print(f"  {len(cases)} cases, slowest {slowest[0]} {slowest[1]['wallMs']:.1f} ms")
+            del db
+
+    output = args.output or os.path.join(RESULTS_DIR, f"data_tools-{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"\nResults written to {output}")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"Baseline saved to {args.baseline}")
+
+    if args.check:
+        regressions = check_regressions(results, baseline, args.threshold, args.min_ms)
+        for r in regressions:
+            print(
+                f"❌ {r['dataset']} {r['case']}: {r['wallMs'][0]} -> {r['wallMs'][1]} ms, "
+                f"{r['peakKiB'][0]} -> {r['peakKiB'][1]} KiB"
+            )
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%} against {baseline.get('commit')}")
+            sys.exit(1)
+        print(f"✅ No regressions beyond {args.threshold:.0%} against {baseline.get('commit')}")
+
+
+if __name__ == "__main__":
+    main()
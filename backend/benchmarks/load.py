@@ -0,0 +1,332 @@
+"""
+Load Test
+
+Drives /api/agent/chat, /api/chat/stream and /api/research/stream with a
+seeded mix of Vietnamese queries at increasing concurrency (closed loop:
+each virtual user sends its next request as soon as the previous one has
+been fully read) and reports throughput, latency, time to first byte and
+error rate per step and endpoint.
+
+By default a backend is started on a free port with LLM_BACKEND=fake and
+an empty research cache, so runs are reproducible and need no API key:
+
+    python benchmarks/load.py --concurrency 1,5,10,25 --duration 20
+    python benchmarks/load.py --url http://localhost:8000   # running server
+    python benchmarks/load.py --compare benchmarks/results/load-<commit>.json
+
+Results are written as JSON (default benchmarks/results/load-<commit>.json).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(BACKEND_DIR, "benchmarks", "results")
+
+AGENT_QUERIES = [
+    "Chi phí tuần này",
+    "Chi phí tháng 11",
+    "Hiển thị clicks 7 ngày qua",
+    "ROAS của tôi thế nào?",
+    "Chi phí theo tài khoản tháng này",
+    "Doanh thu theo chiến dịch tuần trước",
+    "So sánh tuần này và tuần trước",
+    "Liệt kê các chiến dịch",
+    "Tài khoản nào đang active?",
+    "CPC là gì?",
+    "Tại sao chi phí tăng?",
+    "Tìm chương trình affiliate crypto",
+    "Ngách làm đẹp có affiliate nào tốt?",
+]
+CHAT_QUERIES = [
+    "Crypto",
+    "Forex",
+    "Mỹ phẩm",
+    "Du lịch",
+    "Affiliate marketing là gì?",
+    "Khóa học online",
+]
+RESEARCH_NICHES = ["Crypto", "Forex", "Mỹ phẩm", "Du lịch", "Thời trang", "Khóa học online", "Bảo hiểm", "Hosting"]
+
+DEFAULT_MIX = {"agent": 0.6, "chat": 0.2, "research": 0.2}
+
+ENDPOINTS = {
+    "agent": "/api/agent/chat",
+    "chat": "/api/chat/stream",
+    "research": "/api/research/stream",
+}
+
+
+def build_body(endpoint: str, rng: random.Random) -> dict:
+    if endpoint == "research":
+        return {"niche": rng.choice(RESEARCH_NICHES)}
+    queries = AGENT_QUERIES if endpoint == "agent" else CHAT_QUERIES
+    return {"messages": [{"role": "user", "type": "text", "content": rng.choice(queries)}]}
+
+
+def is_error_line(event: dict) -> bool:
+    """NDJSON lines that report a failed answer (the HTTP status is still 200)."""
+    content = event.get("content")
+    return isinstance(content, dict) and "error" in content
+
+
+async def post_ndjson(host: str, port: int, path: str, body: dict, user_id: str, timeout: float) -> dict:
+    """POST and read a (chunked) NDJSON response; returns status, ttfb, latency and parsed events."""
+    started = time.perf_counter()
+    payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        writer.write(
+            f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\nX-User-Id: {user_id}\r\nConnection: close\r\n\r\n".encode("ascii")
+            + payload
+        )
+        await writer.drain()
+
+        async def read_response():
+            status = int((await reader.readline()).split()[1])
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                headers[name.lower()] = value.strip()
+
+            ttfb = None
+            body = b""
+            if headers.get("transfer-encoding") == "chunked":
+                while True:
+                    size = int((await reader.readline()).split(b";")[0], 16)
+                    if size == 0:
+                        break
+                    chunk = await reader.readexactly(size + 2)
+                    if ttfb is None:
+                        ttfb = time.perf_counter() - started
+                    body += chunk[:-2]
+            else:
+                body = await reader.read()
+                ttfb = time.perf_counter() - started
+            return status, ttfb, body
+
+        status, ttfb, raw = await asyncio.wait_for(read_response(), timeout)
+    finally:
+        writer.close()
+
+    events = [json.loads(line) for line in raw.decode("utf-8").splitlines() if line.strip()]
+    return {
+        "status": status,
+        "ttfb": ttfb,
+        "latency": time.perf_counter() - started,
+        "events": events,
+    }
+
+
+def percentile(values: list, q: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(samples: list, duration: float) -> dict:
+    latencies = [s["latency"] for s in samples if not s["error"]]
+    ttfbs = [s["ttfb"] for s in samples if s["ttfb"] is not None]
+    errors = sum(1 for s in samples if s["error"])
+
+    def ms(value):
+        return round(value * 1000, 1) if value is not None else None
+
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "errorRate": round(errors / len(samples), 4) if samples else 0.0,
+        "throughputRps": round((len(samples) - errors) / duration, 2) if duration else 0.0,
+        "latencyMs": {f"p{int(q * 100)}": ms(percentile(latencies, q)) for q in (0.5, 0.95, 0.99)},
+        "ttfbMs": {f"p{int(q * 100)}": ms(percentile(ttfbs, q)) for q in (0.5, 0.95, 0.99)},
+    }
+
+
+async def run_step(base_url: str, concurrency: int, duration: float, mix: dict, seed: int, timeout: float) -> dict:
+    url = urlsplit(base_url)
+    host, port = url.hostname, url.port or 80
+    endpoints, weights = zip(*mix.items())
+    samples = []
+    deadline = time.perf_counter() + duration
+
+    async def user(index: int):
+        rng = random.Random(seed * 1000 + index)
+        while time.perf_counter() < deadline:
+            endpoint = rng.choices(endpoints, weights)[0]
+            sample = {"endpoint": endpoint, "ttfb": None, "error": None}
+            try:
+                response = await post_ndjson(
+                    host, port, ENDPOINTS[endpoint], build_body(endpoint, rng), f"load-{index}", timeout
+                )
+                sample.update(latency=response["latency"], ttfb=response["ttfb"])
+                if response["status"] != 200:
+                    sample["error"] = f"HTTP {response['status']}"
+                elif not response["events"]:
+                    sample["error"] = "empty response"
+                elif any(is_error_line(event) for event in response["events"]):
+                    sample["error"] = "error line"
+            except Exception as e:
+                sample.update(latency=None, error=type(e).__name__)
+            samples.append(sample)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    by_endpoint = {
+        endpoint: summarize([s for s in samples if s["endpoint"] == endpoint], elapsed) for endpoint in mix
+    }
+    error_kinds = {}
+    for s in samples:
+        if s["error"]:
+            error_kinds[s["error"]] = error_kinds.get(s["error"], 0) + 1
+    return {
+        "concurrency": concurrency,
+        "durationSeconds": round(elapsed, 2),
+        "overall": summarize(samples, elapsed),
+        "endpoints": by_endpoint,
+        "errorKinds": error_kinds,
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_healthy(base_url: str, timeout: float = 30) -> None:
+    give_up = time.time() + timeout
+    while time.time() < give_up:
+        try:
+            with urllib.request.urlopen(base_url + "/", timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Backend at {base_url} did not become healthy")
+
+
+def start_backend(port: int, seed: int, cache_path: str) -> subprocess.Popen:
+    """Start main:app with the fake LLM backend and an empty research cache."""
+    env = {
+        **os.environ,
+        "LLM_BACKEND": "fake",
+        "FAKE_LLM_SEED": str(seed),
+        "RESEARCH_CACHE_PATH": cache_path,
+    }
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env,
+    )
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(current: dict, baseline_path: str) -> None:
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    previous = {step["concurrency"]: step["overall"] for step in baseline["steps"]}
+    print(f"\nCompared with {baseline.get('commit')} ({baseline_path}):")
+    for step in current["steps"]:
+        before = previous.get(step["concurrency"])
+        if not before:
+            continue
+        now = step["overall"]
+        print(
+            f"  c={step['concurrency']:>3}  rps {before['throughputRps']} -> {now['throughputRps']}  "
+            f"p95 {before['latencyMs']['p95']} -> {now['latencyMs']['p95']} ms  "
+            f"errors {before['errorRate']:.2%} -> {now['errorRate']:.2%}"
+        )
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"Unknown endpoint {name!r}")
+        mix[name] = float(weight)
+    return mix
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load-test the streaming endpoints")
+    parser.add_argument("--url", help="Target a running backend instead of starting one with the fake LLM")
+    parser.add_argument("--concurrency", default="1,5,10,25", help="Comma-separated concurrency steps")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds per step")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="e.g. agent=0.6,chat=0.2,research=0.2")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--timeout", type=float, default=60, help="Per-request timeout in seconds")
+    parser.add_argument("--output", help="Results file (default benchmarks/results/load-<commit>.json)")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    server = None
+    cache_dir = tempfile.TemporaryDirectory()
+    base_url = args.url
+    if not base_url:
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        server = start_backend(port, args.seed, os.path.join(cache_dir.name, "research_cache.json"))
+
+    try:
+        wait_healthy(base_url)
+        steps = []
+        for concurrency in (int(c) for c in args.concurrency.split(",")):
+            step = asyncio.run(run_step(base_url, concurrency, args.duration, args.mix, args.seed, args.timeout))
+            overall = step["overall"]
+            print(
+                f"c={concurrency:>3}  {overall['throughputRps']:>7} req/s  "
+                f"p50 {overall['latencyMs']['p50']} ms  p95 {overall['latencyMs']['p95']} ms  "
+                f"p99 {overall['latencyMs']['p99']} ms  ttfb p95 {overall['ttfbMs']['p95']} ms  "
+                f"errors {overall['errorRate']:.2%}"
+            )
+            steps.append(step)
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+        cache_dir.cleanup()
+
+    results = {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "target": args.url or "spawned (LLM_BACKEND=fake)",
+        "config": {"duration": args.duration, "mix": args.mix, "seed": args.seed, "timeout": args.timeout},
+        "steps": steps,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"load-{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
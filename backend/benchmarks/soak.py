@@ -0,0 +1,284 @@
+"""
+Soak Test
+
+Replays mixed agent / chat / research traffic in-process for a long time
+against the fake LLM backend (LLM_BACKEND=fake), so memory can be traced
+inside the process that serves the requests. Conversations grow turn by
+turn like real sessions and a share of requests disconnect early.
+
+Every --sample-every requests it records RSS, tracemalloc's traced memory,
+the number of logging handlers and the allocation growth per module since
+the warm-up baseline. The run fails (exit 1) when memory grows faster than
+--budget-kib per 1,000 requests (least-squares slope over the samples
+taken after warm-up, so caches filling up to their bounds do not count).
+
+    python benchmarks/soak.py --duration 7200            # two hours
+    python benchmarks/soak.py --requests 20000 --budget-kib 256
+
+Results go to benchmarks/results/soak-<commit>.json.
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("FAKE_LLM_LATENCY", "lognormal:20:0.5")
+os.environ.setdefault("FAKE_LLM_CHUNK_MS", "2")
+os.environ.setdefault("RESEARCH_CACHE_PATH", os.path.join(tempfile.mkdtemp(), "research_cache.json"))
+
+from load import AGENT_QUERIES, CHAT_QUERIES, DEFAULT_MIX, RESEARCH_NICHES
+
+RESULTS_DIR = os.path.join(BACKEND_DIR, "benchmarks", "results")
+
+# Conversations are restarted after this many turns (the frontend keeps the whole history)
+MAX_TURNS = 12
+
+
+def rss_kib() -> int:
+    """Current resident set size (Linux /proc; peak RSS elsewhere)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def logging_handlers() -> int:
+    loggers = [logging.getLogger()] + [
+        logger for logger in logging.Logger.manager.loggerDict.values() if isinstance(logger, logging.Logger)
+    ]
+    return sum(len(logger.handlers) for logger in loggers)
+
+
+def module_of(filename: str) -> str:
+    """Attribute an allocation site to a backend module, a third-party package or the stdlib."""
+    if filename.startswith(BACKEND_DIR):
+        return os.path.relpath(filename, BACKEND_DIR)
+    parts = filename.replace("\\", "/").split("/")
+    for marker in ("site-packages", "dist-packages"):
+        if marker in parts:
+            return parts[parts.index(marker) + 1]
+    return f"stdlib:{parts[-1]}" if filename.endswith(".py") else filename
+
+
+def growth_by_module(baseline: tracemalloc.Snapshot, top: int = 10) -> list:
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),  # the samples themselves
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ])
+    by_module = {}
+    for stat in snapshot.compare_to(baseline, "filename"):
+        module = module_of(stat.traceback[0].filename)
+        entry = by_module.setdefault(module, {"module": module, "sizeDiffKiB": 0.0, "countDiff": 0})
+        entry["sizeDiffKiB"] += stat.size_diff / 1024
+        entry["countDiff"] += stat.count_diff
+    ranked = sorted(by_module.values(), key=lambda e: e["sizeDiffKiB"], reverse=True)[:top]
+    for entry in ranked:
+        entry["sizeDiffKiB"] = round(entry["sizeDiffKiB"], 1)
+    return ranked
+
+
+def slope_per_1k(samples: list, key: str):
+    """Least-squares growth of `key` (KiB) per 1,000 requests."""
+    if len(samples) < 2:
+        return None
+    xs = [s["requests"] for s in samples]
+    ys = [s[key] for s in samples]
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    var = sum((x - mean_x) ** 2 for x in xs)
+    if var == 0:
+        return None
+    return round(sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / var * 1000, 2)
+
+
+async def consume(stream, disconnect_after) -> None:
+    """Read a response stream, optionally closing it early like a disconnecting client."""
+    from cancellation import cancel_on_disconnect
+
+    wrapped = cancel_on_disconnect(stream, "soak")
+    received = 0
+    try:
+        async for _ in wrapped:
+            received += 1
+            if disconnect_after is not None and received >= disconnect_after:
+                break
+    finally:
+        await wrapped.aclose()
+
+
+class Session:
+    """A conversation whose history grows like the frontend's."""
+
+    def __init__(self, user_id: str, rng: random.Random):
+        self.user_id = user_id
+        self.rng = rng
+        self.messages = []
+
+    def next_turn(self, queries: list) -> list:
+        if len(self.messages) >= MAX_TURNS * 2:
+            self.messages = []
+        self.messages.append({"role": "user", "type": "text", "content": self.rng.choice(queries)})
+        return list(self.messages)
+
+    def record_answer(self) -> None:
+        self.messages.append({"role": "assistant", "type": "text", "content": "..."})
+
+
+async def soak(args) -> dict:
+    from generator import generate_agent_stream, generate_chat_stream, generate_research_stream
+
+    endpoints, weights = zip(*DEFAULT_MIX.items())
+    state = {"requests": 0, "errors": 0, "stop": False}
+    deadline = time.monotonic() + args.duration if args.duration else None
+
+    async def user(index: int):
+        rng = random.Random(args.seed * 1000 + index)
+        session = Session(f"soak-{index}", rng)
+        while not state["stop"]:
+            endpoint = rng.choices(endpoints, weights)[0]
+            disconnect_after = rng.randint(1, 3) if rng.random() < args.disconnect_rate else None
+            try:
+                if endpoint == "agent":
+                    stream = generate_agent_stream(session.next_turn(AGENT_QUERIES), session.user_id)
+                elif endpoint == "chat":
+                    stream = generate_chat_stream(session.next_turn(CHAT_QUERIES))
+                else:
+                    stream = generate_research_stream(rng.choice(RESEARCH_NICHES), session.user_id)
+                await consume(stream, disconnect_after)
+                if endpoint != "research":
+                    session.record_answer()
+            except Exception as e:
+                state["errors"] += 1
+                if state["errors"] <= 5:
+                    print(f"  request error: {type(e).__name__}: {e}")
+            state["requests"] += 1
+            if args.requests and state["requests"] >= args.requests:
+                state["stop"] = True
+            if deadline and time.monotonic() >= deadline:
+                state["stop"] = True
+
+    async def sampler():
+        baseline = None
+        samples = []
+        next_sample = args.warmup
+        started = time.monotonic()
+        while not state["stop"]:
+            await asyncio.sleep(0.05)
+            if state["requests"] < next_sample:
+                continue
+            gc.collect()
+            if baseline is None:
+                baseline = tracemalloc.take_snapshot()
+            traced, _ = tracemalloc.get_traced_memory()
+            sample = {
+                "requests": state["requests"],
+                "elapsedSeconds": round(time.monotonic() - started, 1),
+                "rssKiB": rss_kib(),
+                "tracedKiB": round(traced / 1024, 1),
+                "loggingHandlers": logging_handlers(),
+                "errors": state["errors"],
+                "topGrowth": growth_by_module(baseline, args.top),
+            }
+            samples.append(sample)
+            print(
+                f"{sample['requests']:>7} req  rss {sample['rssKiB'] / 1024:7.1f} MiB  "
+                f"traced {sample['tracedKiB'] / 1024:7.1f} MiB  handlers {sample['loggingHandlers']}  "
+                f"top {sample['topGrowth'][0]['module'] if sample['topGrowth'] else '-'}"
+            )
+            next_sample = state["requests"] + args.sample_every
+        return samples
+
+    sampler_task = asyncio.create_task(sampler())
+    await asyncio.gather(*(user(i) for i in range(args.concurrency)))
+    return {"requests": state["requests"], "errors": state["errors"], "samples": await sampler_task}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Soak-test the request paths and check memory growth")
+    parser.add_argument("--duration", type=float, default=3600, help="Seconds to run (0 = until --requests)")
+    parser.add_argument("--requests", type=int, default=0, help="Stop after this many requests (0 = no limit)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=2000, help="Requests before the baseline snapshot")
+    parser.add_argument("--sample-every", type=int, default=1000)
+    parser.add_argument("--budget-kib", type=float, default=256, help="Allowed growth in KiB per 1,000 requests")
+    parser.add_argument("--disconnect-rate", type=float, default=0.05, help="Share of requests closed early")
+    parser.add_argument("--top", type=int, default=10, help="Modules listed per sample")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Results file (default benchmarks/results/soak-<commit>.json)")
+    parser.add_argument("--verbose", action="store_true", help="Keep application INFO logging")
+    args = parser.parse_args()
+    if not args.duration and not args.requests:
+        parser.error("set --duration or --requests")
+
+    if not args.verbose:
+        logging.disable(logging.INFO)
+    tracemalloc.start()
+    run = asyncio.run(soak(args))
+
+    samples = run["samples"]
+    rss_slope = slope_per_1k(samples, "rssKiB")
+    traced_slope = slope_per_1k(samples, "tracedKiB")
+    over_budget = [
+        name for name, slope in (("rss", rss_slope), ("traced", traced_slope))
+        if slope is not None and slope > args.budget_kib
+    ]
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "requests": run["requests"],
+        "errors": run["errors"],
+        "growthKiBPer1kRequests": {"rss": rss_slope, "traced": traced_slope},
+        "budgetKiBPer1kRequests": args.budget_kib,
+        "passed": not over_budget,
+        "topGrowth": samples[-1]["topGrowth"] if samples else [],
+        "samples": samples,
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f"soak-{results['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+
+    print(f"\n{run['requests']} requests, {run['errors']} errors; results written to {output}")
+    print(f"Growth per 1k requests: rss {rss_slope} KiB, traced {traced_slope} KiB (budget {args.budget_kib} KiB)")
+    for entry in results["topGrowth"][:5]:
+        print(f"  {entry['module']:<40} {entry['sizeDiffKiB']:>10} KiB  {entry['countDiff']:>8} objects")
+    if len(samples) < 2:
+        print("⚠️  Not enough samples after warm-up to estimate growth")
+    if over_budget:
+        print(f"❌ Memory growth over budget: {', '.join(over_budget)}")
+        sys.exit(1)
+    print("✅ Memory growth within budget")
+
+
+if __name__ == "__main__":
+    main()
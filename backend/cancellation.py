@@ -0,0 +1,80 @@
+"""
+Request Cancellation
+
+When a client disconnects (tab closed, new message sent), Starlette stops
+iterating the StreamingResponse generator. `cancel_on_disconnect` turns that
+into a cancelled CancelToken held in a context variable, which is inherited
+by every task and worker thread started for the request (asyncio.to_thread
+copies the context). Async work is cancelled by asyncio itself; blocking
+tool work checks the token cooperatively with `check_cancelled()`.
+"""
+
+import asyncio
+import contextvars
+import threading
+import time
+from typing import AsyncIterator
+
+from metrics import Counter, Histogram
+
+CANCELLED_WORK = Counter(
+    "cancelled_work_total", "Work stopped early because the client went away", ["kind"]
+)
+CANCELLED_REQUEST_SECONDS = Histogram(
+    "cancelled_request_seconds", "How long a request had been running when its client disconnected", ["endpoint"]
+)
+
+_token = contextvars.ContextVar("cancel_token", default=None)
+
+
+class OperationCancelled(Exception):
+    """Raised by `check_cancelled()` once the request has been cancelled."""
+
+
+class CancelToken:
+    def __init__(self):
+        self._event = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self) -> None:
+        self._event.set()
+
+
+def current_token():
+    return _token.get()
+
+
+def is_cancelled() -> bool:
+    token = _token.get()
+    return token is not None and token.cancelled
+
+
+def check_cancelled(kind: str = "tool") -> None:
+    """Raise OperationCancelled if the current request was cancelled."""
+    if is_cancelled():
+        CANCELLED_WORK.labels(kind).inc()
+        raise OperationCancelled()
+
+
+async def cancel_on_disconnect(stream: AsyncIterator[str], endpoint: str) -> AsyncIterator[str]:
+    """Wrap a response stream so a client disconnect cancels the request's work."""
+    token = CancelToken()
+    _token.set(token)
+    started = time.perf_counter()
+    try:
+        async for chunk in stream:
+            yield chunk
+    except (GeneratorExit, asyncio.CancelledError):
+        token.cancel()
+        CANCELLED_WORK.labels("request").inc()
+        CANCELLED_REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - started)
+        raise
+    finally:
+        await stream.aclose()
+
+
+def stats() -> dict:
+    return {kind: int(child.value) for (kind,), child in CANCELLED_WORK.children()}
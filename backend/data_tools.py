@@ -7,15 +7,73 @@ Provides tools for querying application data sources:
 - Projects
 """
 
+import functools
 import json
+import time
 from datetime import datetime, timedelta
 from typing import Any, Optional
 from crewai.tools import BaseTool
 from mock_data_generator import get_db
+from singleflight import SyncSingleFlight, flight_key
+from cancellation import check_cancelled
+from metrics import Counter, Gauge, Histogram
+from tracing import traced
+from query_plan import FILTERS, QueryPlan
 
 # Initialize mock database
 db = get_db()
 
+query_flight = SyncSingleFlight("ads_query")
+
+# Rows scanned between cooperative cancellation checks
+CANCEL_CHECK_INTERVAL = 5000
+
+ROWS_SCANNED = Counter("ads_rows_scanned_total", "Daily rows iterated by the ads query tools", ["tool"])
+TOOL_SECONDS = Histogram("tool_run_seconds", "data_tools tool execution time", ["tool"])
+ROW_CACHE = Counter(
+    "ads_query_row_cache_total", "Ads queries given a session's cached rows, by whether the rows covered them", ["result"]
+)
+DATASET_VERSION = Gauge("dataset_version", "Generation number of the loaded ads dataset")
+DATASET_AGE = Gauge("dataset_age_seconds", "Seconds since the loaded ads dataset was generated")
+DATASET_ROWS = Gauge("dataset_daily_rows", "Daily rows in the loaded ads dataset")
+# Read at scrape time from whichever dataset is loaded (benchmarks swap `db`)
+DATASET_VERSION.set_function(lambda: db.version)
+DATASET_AGE.set_function(lambda: (datetime.now() - db.generated_at).total_seconds() if db.generated_at else float("nan"))
+DATASET_ROWS.set_function(lambda: len(db.daily_data))
+
+
+def _scan(rows, tool: str = "query_ads_campaigns", plan: Optional[QueryPlan] = None):
+    """Iterate rows, stopping early if the request was cancelled."""
+    scanned = 0
+    try:
+        for row in rows:
+            if scanned % CANCEL_CHECK_INTERVAL == 0:
+                check_cancelled()
+            scanned += 1
+            yield row
+    finally:
+        ROWS_SCANNED.labels(tool).inc(scanned)
+        if plan is not None:
+            plan.scanned(scanned)
+
+
+def _instrumented(tool: str):
+    """Trace a tool's `_run` and record its execution time under `tool`."""
+    seconds = TOOL_SECONDS.labels(tool)
+
+    def decorate(fn):
+        run = traced(f"tool.{tool}")(fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return run(*args, **kwargs)
+            finally:
+                seconds.observe(time.perf_counter() - started)
+        return wrapper
+    return decorate
+
 import re
 
 def parse_date_range(query: str) -> tuple[str, str]:
@@ -80,6 +138,39 @@ def parse_date_range(query: str) -> tuple[str, str]:
     return start.strftime("%Y-%m-%d"), today.strftime("%Y-%m-%d")
 
 
+class RowSelection:
+    """Daily rows matched by a query's campaign filters and date range.
+    
+    Kept in the conversation session (see session_store.py) so follow-ups that
+    narrow, regroup or re-break down the same data skip the full scan.
+    """
+    
+    def __init__(self, params: dict, start_date: str, end_date: str, rows: list):
+        self.dataset = (id(db), db.version)
+        self.start_date = start_date
+        self.end_date = end_date
+        self.filters = {name: params[name] for name in FILTERS if params.get(name)}
+        self.rows = rows
+    
+    def covers(self, params: dict, start_date: str, end_date: str) -> bool:
+        """Whether every row a query matches is in this selection (same data, narrower or equal filters)."""
+        if self.dataset != (id(db), db.version):
+            return False
+        if start_date < self.start_date or end_date > self.end_date:
+            return False
+        for name, value in self.filters.items():
+            requested = params.get(name)
+            if not requested:
+                return False
+            if isinstance(value, list):
+                # List filters match any of their values, so a subset is narrower
+                if not isinstance(requested, list) or not set(requested) <= set(value):
+                    return False
+            elif requested != value:
+                return False
+        return True
+
+
 class QueryAdsCampaignsTool(BaseTool):
     """Tool for querying ads campaign data."""
     
@@ -92,59 +183,72 @@ class QueryAdsCampaignsTool(BaseTool):
     - program: affiliate program name (e.g. "Shopee", "Binance")
     - keywords: list of keywords to filter campaigns by (partial match)
     - group_by: "day", "week", or "month"
+    - explain: true to add an "explain" block (date range, filter plan, access path,
+      rows scanned vs. returned, time per phase)
+    - compare_previous: true to add "previousPeriod", the summary of the equally
+      long range right before the requested one (same filters)
     
     Returns aggregated performance data suitable for charts."""
     
+    @_instrumented("query_ads_campaigns")
     def _run(self, query: str) -> str:
         try:
             params = json.loads(query) if query.strip().startswith("{") else {"date_range": query}
         except json.JSONDecodeError:
             params = {"date_range": query}
         
+        # Identical concurrent queries share one computation (date ranges are relative to today)
+        key = flight_key(datetime.now().strftime("%Y-%m-%d"), params)
+        return query_flight.do(key, lambda: self._query(params))
+    
+    @_instrumented("query_ads_campaigns")
+    def run_on(self, params: dict, selection: Optional[RowSelection] = None) -> tuple[str, RowSelection]:
+        """Run a query on `selection`'s rows when they cover it, else on the dataset.
+        
+        Returns the result and the rows to keep for follow-ups: `selection`
+        itself when it was used (it covers this query and possibly more),
+        otherwise the rows this query matched.
+        """
+        return self._execute(params, selection)
+    
+    def _query(self, params: dict) -> str:
+        return self._execute(params)[0]
+    
+    def _execute(self, params: dict, selection: Optional[RowSelection] = None) -> tuple[str, RowSelection]:
         date_range = params.get("date_range", "last 30 days")
-        account_ids = params.get("account_ids", [])
-        campaign_ids = params.get("campaign_ids", [])
-        program_filter = params.get("program")
-        keyword_filters = params.get("keywords", [])
         group_by = params.get("group_by", "day")
+        plan = QueryPlan(params)
         
         start_date, end_date = parse_date_range(date_range)
+        plan.mark("parseDateRange")
         
-        # Get all campaigns first to filter
-        filtered_campaigns = db.campaigns
-        
-        if account_ids:
-            filtered_campaigns = [c for c in filtered_campaigns if c["accountId"] in account_ids]
+        filtered_camp_ids = self._campaign_ids(params, plan)
+        plan.mark("filterCampaigns")
         
-        if campaign_ids:
-            filtered_campaigns = [c for c in filtered_campaigns if c["id"] in campaign_ids]
-            
-        if program_filter:
-            filtered_campaigns = [c for c in filtered_campaigns if program_filter.lower() in c["program"].lower()]
-            
-        if keyword_filters:
-            # Campaign matches if ANY of its keywords match ANY of the filter keywords
-            filtered_campaigns = [
-                c for c in filtered_campaigns 
-                if any(
-                    k_filter.lower() in k_camp.lower() 
-                    for k_camp in c["keywords"] 
-                    for k_filter in keyword_filters
-                ) or any(k_filter.lower() in c["name"].lower() for k_filter in keyword_filters)
-            ]
-            
-        filtered_camp_ids = set(c["id"] for c in filtered_campaigns)
-        
-        # Filter daily data
+        # Filter daily data (only the previous result's rows when they cover this query)
+        source = db.daily_data
+        if selection is not None:
+            if selection.covers(params, start_date, end_date):
+                ROW_CACHE.labels("hit").inc()
+                source, plan.access_path = selection.rows, "session_cache"
+            else:
+                ROW_CACHE.labels("miss").inc()
+                selection = None
         relevant_data = [
-            d for d in db.daily_data 
+            d for d in _scan(source, plan=plan) 
             if d["campaignId"] in filtered_camp_ids 
             and start_date <= d["date"] <= end_date
         ]
+        plan.rows_matched = len(relevant_data)
+        matched = selection or RowSelection(params, start_date, end_date, relevant_data)
+        plan.mark("scan")
+        previous_period = None
+        if params.get("compare_previous"):
+            previous_period = self._previous_period(plan, filtered_camp_ids, start_date, end_date)
         
         # Aggregate by date
         aggregated = {}
-        for record in relevant_data:
+        for record in _scan(relevant_data, plan=plan):
             date_key = record["date"]
             if date_key not in aggregated:
                 aggregated[date_key] = {
@@ -176,6 +280,7 @@ class QueryAdsCampaignsTool(BaseTool):
             day["cpa"] = round(cost / conversions, 0) if conversions > 0 else 0
         
         result = sorted(aggregated.values(), key=lambda x: x["date"])
+        plan.mark("aggregateByDate")
         
         # Group by week/month if needed
         # Group by week/month/account/campaign if needed
@@ -217,7 +322,7 @@ class QueryAdsCampaignsTool(BaseTool):
             # We need to map campaign IDs back to account names
             camp_to_acc = {c["id"]: next((a["name"] for a in db.accounts if a["id"] == c["accountId"]), "Unknown") for c in db.campaigns}
             
-            for record in relevant_data:
+            for record in _scan(relevant_data, plan=plan):
                 acc_name = camp_to_acc.get(record["campaignId"], "Unknown")
                 if acc_name not in by_account:
                     by_account[acc_name] = {"date": acc_name, "clicks": 0, "impressions": 0, "cost": 0, "conversions": 0, "revenue": 0}
@@ -236,7 +341,7 @@ class QueryAdsCampaignsTool(BaseTool):
             by_campaign = {}
             camp_map = {c["id"]: c["name"] for c in db.campaigns}
             
-            for record in relevant_data:
+            for record in _scan(relevant_data, plan=plan):
                 camp_name = camp_map.get(record["campaignId"], "Unknown")
                 if camp_name not in by_campaign:
                     by_campaign[camp_name] = {"date": camp_name, "clicks": 0, "impressions": 0, "cost": 0, "conversions": 0, "revenue": 0}
@@ -251,7 +356,8 @@ class QueryAdsCampaignsTool(BaseTool):
             
             # Sort by spend (cost) desc to show top campaigns
             result = sorted(by_campaign.values(), key=lambda x: x["cost"], reverse=True)[:10]
-
+        if group_by != "day":
+            plan.mark("groupBy")
         
         # Helper to get entity name
         def get_entity_name(camp_id, breakdown_type):
@@ -270,7 +376,7 @@ class QueryAdsCampaignsTool(BaseTool):
             
             granular_data = {} # Key: date_entity
             
-            for record in relevant_data:
+            for record in _scan(relevant_data, plan=plan):
                 date_key = record["date"]
                 entity_name = get_entity_name(record["campaignId"], breakdown_by)
                 key = f"{date_key}_{entity_name}"
@@ -295,6 +401,7 @@ class QueryAdsCampaignsTool(BaseTool):
                 result.append(item)
             
             result.sort(key=lambda x: x["date"])
+            plan.mark("breakdown")
             
             # Return granular data directly
             # Summary calculation remains the same
@@ -304,7 +411,7 @@ class QueryAdsCampaignsTool(BaseTool):
             total_conversions = sum(d["conversions"] for d in result)
             total_impressions = sum(d["impressions"] for d in result)
             
-            return json.dumps({
+            return self._finish(plan, start_date, end_date, {
                 "data": result,
                 "dateRange": {"start": start_date, "end": end_date},
                 "totalRecords": len(result),
@@ -321,7 +428,7 @@ class QueryAdsCampaignsTool(BaseTool):
                     "avgROAS": round(total_revenue / total_cost, 2) if total_cost > 0 else 0,
                     "avgCPA": round(total_cost / total_conversions, 0) if total_conversions > 0 else 0
                 }
-            }, ensure_ascii=False)
+            }, previous_period), matched
 
         
         # Calculate summary
@@ -331,7 +438,7 @@ class QueryAdsCampaignsTool(BaseTool):
         total_conversions = sum(d["conversions"] for d in result)
         total_impressions = sum(d["impressions"] for d in result)
         
-        return json.dumps({
+        return self._finish(plan, start_date, end_date, {
             "data": result,
             "dateRange": {"start": start_date, "end": end_date},
             "totalRecords": len(result),
@@ -346,7 +453,102 @@ class QueryAdsCampaignsTool(BaseTool):
                 "avgROAS": round(total_revenue / total_cost, 2) if total_cost > 0 else 0,
                 "avgCPA": round(total_cost / total_conversions, 0) if total_conversions > 0 else 0
             }
-        }, ensure_ascii=False)
+        }, previous_period), matched
+
+    @staticmethod
+    def _campaign_ids(params: dict, plan: QueryPlan) -> set:
+        """Ids of the campaigns the query's filters keep."""
+        account_ids = params.get("account_ids", [])
+        campaign_ids = params.get("campaign_ids", [])
+        program_filter = params.get("program")
+        keyword_filters = params.get("keywords", [])
+        
+        # Get all campaigns first to filter
+        filtered_campaigns = db.campaigns
+        
+        if account_ids:
+            before = len(filtered_campaigns)
+            filtered_campaigns = [c for c in filtered_campaigns if c["accountId"] in account_ids]
+            plan.filter("account_ids", account_ids, before, len(filtered_campaigns))
+        
+        if campaign_ids:
+            before = len(filtered_campaigns)
+            filtered_campaigns = [c for c in filtered_campaigns if c["id"] in campaign_ids]
+            plan.filter("campaign_ids", campaign_ids, before, len(filtered_campaigns))
+            
+        if program_filter:
+            before = len(filtered_campaigns)
+            filtered_campaigns = [c for c in filtered_campaigns if program_filter.lower() in c["program"].lower()]
+            plan.filter("program", program_filter, before, len(filtered_campaigns))
+            
+        if keyword_filters:
+            before = len(filtered_campaigns)
+            # Campaign matches if ANY of its keywords match ANY of the filter keywords
+            filtered_campaigns = [
+                c for c in filtered_campaigns 
+                if any(
+                    k_filter.lower() in k_camp.lower() 
+                    for k_camp in c["keywords"] 
+                    for k_filter in keyword_filters
+                ) or any(k_filter.lower() in c["name"].lower() for k_filter in keyword_filters)
+            ]
+            plan.filter("keywords", keyword_filters, before, len(filtered_campaigns))
+        
+        return set(c["id"] for c in filtered_campaigns)
+
+    def previous_period(self, params: dict) -> dict:
+        """The `previousPeriod` of a query (as with `compare_previous`), computed on its own.
+
+        Lets callers that only sometimes need it skip the extra dataset scan.
+        """
+        plan = QueryPlan(params)
+        start_date, end_date = parse_date_range(params.get("date_range", "last 30 days"))
+        return self._previous_period(plan, self._campaign_ids(params, plan), start_date, end_date)
+
+    @staticmethod
+    def _previous_period(plan: QueryPlan, camp_ids: set, start_date: str, end_date: str) -> dict:
+        """Totals of the equally long range ending the day before `start_date`.
+
+        Always a scan of the whole dataset: the session's rows only cover the requested range.
+        """
+        if plan.access_path == "session_cache":
+            plan.access_path = "session_cache+scan"
+        start = datetime.strptime(start_date, "%Y-%m-%d")
+        span = datetime.strptime(end_date, "%Y-%m-%d") - start
+        previous_end = start - timedelta(days=1)
+        previous_start = (previous_end - span).strftime("%Y-%m-%d")
+        previous_end = previous_end.strftime("%Y-%m-%d")
+        totals = {metric: 0 for metric in ["clicks", "impressions", "cost", "conversions", "revenue"]}
+        for record in _scan(db.daily_data, plan=plan):
+            if record["campaignId"] in camp_ids and previous_start <= record["date"] <= previous_end:
+                for metric in totals:
+                    totals[metric] += record[metric]
+        plan.mark("previousPeriod")
+        return {
+            "start": previous_start,
+            "end": previous_end,
+            "summary": {
+                "totalClicks": totals["clicks"],
+                "totalCost": totals["cost"],
+                "totalRevenue": totals["revenue"],
+                "totalConversions": totals["conversions"],
+                "totalImpressions": totals["impressions"],
+            },
+        }
+
+    @staticmethod
+    def _finish(plan: QueryPlan, start_date: str, end_date: str, response: dict, previous_period: dict = None) -> str:
+        """Serialize the response, adding the query plan when asked and logging slow queries."""
+        if previous_period is not None:
+            response["previousPeriod"] = previous_period
+        plan.mark("summary")
+        rows_returned = len(response["data"])
+        if plan.params.get("explain"):
+            response["explain"] = plan.explain(start_date, end_date, len(db.daily_data), rows_returned)
+        payload = json.dumps(response, ensure_ascii=False)
+        plan.mark("serialize")
+        plan.log_if_slow(start_date, end_date, rows_returned)
+        return payload
 
 
 class QueryAccountsTool(BaseTool):
@@ -356,6 +558,7 @@ class QueryAccountsTool(BaseTool):
     description: str = """Query ad account information.
     Returns list of connected ad accounts with their status and platform."""
     
+    @_instrumented("query_accounts")
     def _run(self, query: str = "") -> str:
         accounts = db.accounts
         return json.dumps({
@@ -377,6 +580,7 @@ class QueryCampaignListTool(BaseTool):
     
     Returns campaign list with names, programs, and keywords."""
     
+    @_instrumented("query_campaign_list")
     def _run(self, query: str = "") -> str:
         try:
             params = json.loads(query) if query.strip().startswith("{") else {}
@@ -419,6 +623,7 @@ class CalculateMetricsTool(BaseTool):
     
     Returns calculated metrics."""
     
+    @_instrumented("calculate_metrics")
     def _run(self, query: str) -> str:
         try:
             params = json.loads(query)
@@ -0,0 +1,115 @@
+"""
+Request Deadlines
+
+Each /api/agent/chat turn carries a deadline budget (AGENT_DEADLINE_SECONDS)
+in a context variable, so every stage and task started for the request sees
+it. The budget is split across the stages of the turn; a stage that runs
+out of its share falls back to cached or templated output instead of
+making the whole turn slow.
+
+Usage:
+    with deadline_scope(20):
+        routed = await run_stage("routing", lambda: route(query), fallback=lambda: heuristic_route(query))
+"""
+
+import asyncio
+import contextvars
+import inspect
+import os
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Optional
+
+from hedging import llm_hedger
+from metrics import Counter, Histogram
+
+AGENT_DEADLINE_SECONDS = float(os.getenv("AGENT_DEADLINE_SECONDS", "20"))
+
+# Share of the total budget each stage may use (also capped by what is left)
+STAGE_SHARES = {
+    "routing": 0.2,
+    "query": 0.3,
+    "narrative": 0.5,
+    "research": 0.8,
+}
+
+STAGE_LATENCY = Histogram("agent_stage_latency_seconds", "Agent stage latency by hedging mode", ["stage", "hedging"])
+STAGE_FALLBACKS = Counter(
+    "agent_stage_fallbacks_total", "Stages that ran out of budget (fallback served or error)", ["stage", "hedging"]
+)
+
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """A stage ran out of budget and has no fallback."""
+
+
+class Deadline:
+    def __init__(self, budget_seconds: float):
+        self.budget = budget_seconds
+        self.expires_at = time.monotonic() + budget_seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def stage_budget(self, stage: str) -> float:
+        return min(self.budget * STAGE_SHARES.get(stage, 1.0), self.remaining())
+
+
+@contextmanager
+def deadline_scope(budget_seconds: float = AGENT_DEADLINE_SECONDS):
+    token = _deadline.set(Deadline(budget_seconds))
+    try:
+        yield _deadline.get()
+    finally:
+        _deadline.reset(token)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _deadline.get()
+
+
+def remaining(default: Optional[float] = None) -> Optional[float]:
+    """Seconds left in the current request, or `default` outside a deadline scope."""
+    deadline = _deadline.get()
+    return deadline.remaining() if deadline else default
+
+
+async def run_stage(stage: str, fn: Callable[[], Awaitable], fallback: Optional[Callable] = None):
+    """Run `fn` within the stage's share of the request budget.
+
+    On timeout the stage returns `fallback()` (sync or async); without a
+    fallback DeadlineExceeded is raised.
+    """
+    deadline = _deadline.get()
+    budget = deadline.stage_budget(stage) if deadline else None
+    hedging = "on" if llm_hedger.enabled else "off"
+    started = time.perf_counter()
+    try:
+        if budget is not None and budget <= 0:
+            raise asyncio.TimeoutError
+        return await asyncio.wait_for(fn(), budget)
+    except asyncio.TimeoutError:
+        STAGE_FALLBACKS.labels(stage, hedging).inc()
+        if fallback is None:
+            raise DeadlineExceeded(f"Stage '{stage}' exceeded its {budget:.1f}s budget") from None
+        result = fallback()
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+    finally:
+        STAGE_LATENCY.labels(stage, hedging).observe(time.perf_counter() - started)
+
+
+def stage_report() -> dict:
+    """p50/p99 per stage, split by hedging on/off."""
+    report = {}
+    for (stage, hedging), child in STAGE_LATENCY.children():
+        report.setdefault(stage, {})[f"hedging_{hedging}"] = {
+            "count": child.count,
+            "fallbacks": int(STAGE_FALLBACKS.labels(stage, hedging).value),
+            "p50Ms": round(child.quantile(0.5) * 1000),
+            "p99Ms": round(child.quantile(0.99) * 1000),
+        }
+    return report
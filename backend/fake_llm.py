@@ -0,0 +1,186 @@
+"""
+Fake LLM
+
+Offline stand-in for Gemini used by LLM_BACKEND=fake (in-process) and
+fake_llm_server.py (HTTP). It recognizes the prompts this backend sends and
+answers in the shape each caller parses:
+
+- Router prompts: intent JSON in the ROUTER_PROMPT schema
+- Research prompts: a JSON array of 5-10 affiliate programs
+- Ad narratives: 2-3 Vietnamese sentences quoting the prompt's numbers
+- Anything else: a short markdown explanation
+
+Timing and failures are configurable so benchmarks and load tests see
+realistic behaviour:
+
+    FAKE_LLM_LATENCY=lognormal:600:0.4   time to first token (fixed:MS,
+                                         uniform:MIN_MS:MAX_MS or
+                                         lognormal:MEDIAN_MS:SIGMA)
+    FAKE_LLM_CHUNK_MS=40                 delay between streamed chunks
+    FAKE_LLM_CHUNK_CHARS=80              characters per streamed chunk
+    FAKE_LLM_ERROR_RATE=0                share of calls failing with a 500
+    FAKE_LLM_RATE_LIMIT_RATE=0           share of calls failing with a 429
+    FAKE_LLM_SEED=                       seed for reproducible runs
+"""
+
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import time
+import zlib
+from dataclasses import asdict
+from typing import AsyncIterator, Callable
+
+FAKE_LLM_LATENCY = os.getenv("FAKE_LLM_LATENCY", "lognormal:600:0.4")
+FAKE_LLM_CHUNK_MS = float(os.getenv("FAKE_LLM_CHUNK_MS", "40"))
+FAKE_LLM_CHUNK_CHARS = int(os.getenv("FAKE_LLM_CHUNK_CHARS", "80"))
+FAKE_LLM_ERROR_RATE = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))
+FAKE_LLM_RATE_LIMIT_RATE = float(os.getenv("FAKE_LLM_RATE_LIMIT_RATE", "0"))
+FAKE_LLM_SEED = os.getenv("FAKE_LLM_SEED")
+
+PROGRAMS = [
+    ("Shopee", "percentage"), ("Lazada", "percentage"), ("Tiki", "percentage"), ("TikTok Shop", "percentage"),
+    ("AccessTrade", "hybrid"), ("Ecomobi", "hybrid"), ("Binance", "percentage"), ("Exness", "cpa"),
+    ("Agoda", "percentage"), ("Traveloka", "percentage"), ("Amazon Associates", "percentage"),
+    ("Hostinger", "percentage"), ("Coursera", "percentage"), ("Udemy", "percentage"), ("Canva", "cpa"),
+]
+
+
+class FakeLLMError(Exception):
+    """Injected upstream failure (message starts with the HTTP status)."""
+
+    status = 500
+
+
+class FakeRateLimitError(FakeLLMError):
+    status = 429
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """Latency sampler in seconds from 'fixed:MS', 'uniform:MIN_MS:MAX_MS' or 'lognormal:MEDIAN_MS:SIGMA'."""
+    kind, *args = spec.split(":")
+    values = [float(arg) for arg in args]
+    if kind == "fixed" and len(values) == 1:
+        return lambda rng: values[0] / 1000
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1]) / 1000
+    if kind == "lognormal" and len(values) == 2:
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1]) / 1000
+    raise ValueError(f"Invalid latency spec {spec!r}")
+
+
+def _find(pattern: str, text: str, default: str = "") -> str:
+    match = re.search(pattern, text)
+    return match.group(1).strip() if match else default
+
+
+def route_response(prompt: str) -> str:
+    from router import heuristic_route
+
+    query = _find(r'Câu hỏi: "(.*)"', prompt)
+    routed = heuristic_route(query)
+    return json.dumps(
+        {"intent": routed.intent, "confidence": 0.9, "entities": asdict(routed.entities)}, ensure_ascii=False
+    )
+
+
+def research_response(prompt: str) -> str:
+    niche = _find(r"Research Niche: (.*)", prompt, "affiliate")
+    # The same niche always yields the same programs
+    rng = random.Random(zlib.crc32(niche.lower().encode("utf-8")))
+    rows = []
+    for brand, commission_type in rng.sample(PROGRAMS, rng.randint(5, 10)):
+        slug = re.sub(r"[^a-z0-9]+", "", brand.lower())
+        rows.append({
+            "brand": brand,
+            "program_url": f"https://{slug}.com/affiliate",
+            "commission_percent": 0 if commission_type == "cpa" else rng.choice([3, 5, 8, 10, 15, 20, 30]),
+            "commission_type": commission_type,
+            "can_use_brand": rng.random() < 0.5,
+            "traffic_3m": rng.choice(["500k/tháng", "2M/tháng", "12M+", "80M+", "Tăng 15%"]),
+            "legitimacy_score": rng.randint(6, 10),
+        })
+    return json.dumps(rows, ensure_ascii=False, indent=2)
+
+
+def narrative_response(prompt: str) -> str:
+    time_range = _find(r"Dữ liệu tổng hợp \((.*)\)", prompt, "kỳ này")
+    clicks = _find(r"- Clicks: (.*)", prompt, "0")
+    cost = _find(r"- Cost: (.*)", prompt, "0")
+    roas = _find(r"- ROAS: (.*)", prompt, "0")
+    return (
+        f"Trong {time_range}, các chiến dịch ghi nhận {clicks} clicks với tổng chi phí {cost}. "
+        f"ROAS đạt {roas}, nên ưu tiên ngân sách cho các chiến dịch có hiệu quả cao nhất."
+    )
+
+
+def explanation_response(prompt: str) -> str:
+    question = _find(r"Câu hỏi: (.*)", prompt) or _find(r"Current user request: (.*)", prompt, "câu hỏi của bạn")
+    return (
+        f"**{question}**\n\n"
+        "Đây là câu trả lời mô phỏng từ máy chủ thử nghiệm:\n\n"
+        "- Khái niệm được giải thích ngắn gọn\n"
+        "- Một ví dụ thực tế trong affiliate marketing\n"
+        "- Gợi ý bước tiếp theo"
+    )
+
+
+def respond(prompt: str) -> str:
+    """Response text for one of the prompts sent by this backend."""
+    if "bộ định tuyến intent" in prompt:
+        return route_response(prompt)
+    if "Research Niche:" in prompt:
+        return research_response(prompt)
+    if "chuyên gia phân tích quảng cáo" in prompt:
+        return narrative_response(prompt)
+    return explanation_response(prompt)
+
+
+class FakeLLM:
+    def __init__(
+        self,
+        latency: str = FAKE_LLM_LATENCY,
+        chunk_ms: float = FAKE_LLM_CHUNK_MS,
+        chunk_chars: int = FAKE_LLM_CHUNK_CHARS,
+        error_rate: float = FAKE_LLM_ERROR_RATE,
+        rate_limit_rate: float = FAKE_LLM_RATE_LIMIT_RATE,
+        seed=FAKE_LLM_SEED,
+    ):
+        self.sample_latency = parse_latency(latency)
+        self.chunk_seconds = chunk_ms / 1000
+        self.chunk_chars = chunk_chars
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self._rng = random.Random(seed)
+        self.calls = 0
+
+    def _start(self) -> float:
+        """Count the call, inject a failure if one is due, and return the first-token latency."""
+        self.calls += 1
+        roll = self._rng.random()
+        if roll < self.rate_limit_rate:
+            raise FakeRateLimitError("429 ResourceExhausted: quota exceeded (injected)")
+        if roll < self.rate_limit_rate + self.error_rate:
+            raise FakeLLMError("500 Internal error (injected)")
+        return self.sample_latency(self._rng)
+
+    def chunks(self, text: str) -> list:
+        return [text[i:i + self.chunk_chars] for i in range(0, len(text), self.chunk_chars)]
+
+    async def generate(self, prompt: str, json_mode: bool = False) -> str:
+        await asyncio.sleep(self._start())
+        return respond(prompt)
+
+    def generate_sync(self, prompt: str) -> str:
+        time.sleep(self._start())
+        return respond(prompt)
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        await asyncio.sleep(self._start())
+        for i, chunk in enumerate(self.chunks(respond(prompt))):
+            if i:
+                await asyncio.sleep(self.chunk_seconds)
+            yield chunk
@@ -0,0 +1,76 @@
+"""
+Fake LLM Server
+
+HTTP stand-in for Gemini used by LLM_BACKEND=http, so load tests can run the
+backend against a separate process with realistic timing (see fake_llm.py
+for the FAKE_LLM_* settings).
+
+    python fake_llm_server.py              # listens on FAKE_LLM_PORT (8090)
+    LLM_BACKEND=http python main.py
+
+POST /v1/generate  {"prompt", "model", "json_mode"} -> {"text": ...}
+POST /v1/stream    {"prompt", "model"} -> NDJSON {"text": ...} lines
+Injected failures are returned as HTTP 429 / 500 with {"error": ...}.
+"""
+
+import json
+import os
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+
+from fake_llm import FakeLLM, FakeLLMError
+
+FAKE_LLM_PORT = int(os.getenv("FAKE_LLM_PORT", "8090"))
+
+app = FastAPI(title="Fake LLM")
+fake = FakeLLM()
+
+
+class GenerateRequest(BaseModel):
+    prompt: str
+    model: str = ""
+    json_mode: bool = False
+
+
+def _error(e: FakeLLMError) -> JSONResponse:
+    return JSONResponse({"error": str(e)}, status_code=e.status)
+
+
+@app.post("/v1/generate")
+async def generate(request: GenerateRequest):
+    try:
+        return {"text": await fake.generate(request.prompt, request.json_mode)}
+    except FakeLLMError as e:
+        return _error(e)
+
+
+@app.post("/v1/stream")
+async def stream(request: GenerateRequest):
+    chunks = fake.stream(request.prompt)
+    try:
+        # Failures happen before the first chunk, so they can still set the status code
+        first = await chunks.__anext__()
+    except FakeLLMError as e:
+        return _error(e)
+    except StopAsyncIteration:
+        first = None
+
+    async def lines():
+        if first is not None:
+            yield json.dumps({"text": first}, ensure_ascii=False) + "\n"
+            async for chunk in chunks:
+                yield json.dumps({"text": chunk}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.get("/")
+async def health_check():
+    return {"status": "ok", "service": "Fake LLM", "calls": fake.calls}
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="127.0.0.1", port=FAKE_LLM_PORT)
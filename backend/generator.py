@@ -1,18 +1,35 @@
 import os
 import json
-import google.generativeai as genai
+import time
+from typing import Optional
 from dotenv import load_dotenv
+from router import route, route_forced, lookup_known_route, record_known_route
+from research_cache import research_cache, is_cacheable_table
+from stream_parser import IncrementalArrayParser
+from metrics import Histogram
+from llm_client import generate_text, stream_text
+from llm_backend import LLM_BACKEND
+from llm_gateway import LLMUnavailable
+from cancellation import CANCELLED_WORK
+from speculation import SpeculativeStream, speculation_policy
+from scheduler import RequestShed, request_scheduler
+from tracing import span, trace_scope
+from request_metrics import set_intent
+from log_pipeline import verbose_scope
+from session_store import Session
+
+TIME_TO_FIRST_ROW = Histogram(
+    "research_time_to_first_row_seconds", "Time from request to the first streamed research row", ["endpoint"]
+)
 
 # Load environment variables
 load_dotenv()
 
-# Configure Gemini API
+# Require the Gemini API key (the offline LLM_BACKEND stand-ins need none)
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-if not GOOGLE_API_KEY:
+if LLM_BACKEND == "gemini" and not GOOGLE_API_KEY:
     raise ValueError("GOOGLE_API_KEY environment variable is not set")
 
-genai.configure(api_key=GOOGLE_API_KEY)
-model = genai.GenerativeModel("gemini-3-flash-preview")
 
 CHAT_SYSTEM_INSTRUCTION = """You are an expert affiliate marketing consultant with deep knowledge of Vietnamese and global markets.
 You provide accurate, data-driven recommendations.
@@ -39,52 +56,136 @@ Return ONLY the JSON array.
 """
 
 
-async def generate_research_stream(niche: str):
-    """Generate affiliate program research for a niche."""
-    """Generate affiliate program research for a niche."""
-    prompt = PROMPT_TEMPLATE.format(niche=niche, context="")
+def parse_research_buffer(buffer: str) -> list:
+    """Parse a Gemini research response into a list of program dicts.
+    
+    Raises:
+        json.JSONDecodeError: If the response is not valid JSON
+    """
+    # Post-process: Strip markdown wrappers if present
+    cleaned_buffer = buffer.strip()
+    if cleaned_buffer.startswith('```'):
+        # Remove markdown code block
+        lines = cleaned_buffer.split('\n')
+        if lines[0].startswith('```'):
+            lines = lines[1:]
+        if lines and lines[-1].strip() == '```':
+            lines = lines[:-1]
+        cleaned_buffer = '\n'.join(lines).strip()
+    
+    parsed = json.loads(cleaned_buffer)
+    # If it's already structured with "type" and "content", extract content
+    if isinstance(parsed, dict) and 'content' in parsed:
+        return parsed['content']
+    # If it's just the array, use it directly
+    if isinstance(parsed, list):
+        return parsed
+    return []
+
+
+async def fetch_research_table(niche: str, context: str = "") -> list:
+    """Ask Gemini for affiliate programs in a niche and return the parsed table."""
+    prompt = PROMPT_TEMPLATE.format(niche=niche, context=context)
+    return [row async for row in stream_research_rows(prompt)]
+
+
+async def stream_research_rows(prompt: str):
+    """Stream program dicts from Gemini as soon as each one is complete.
     
+    Falls back to a full parse of the response when the model does not
+    return a JSON array of objects.
+    
+    Raises:
+        json.JSONDecodeError: If nothing could be parsed from the response
+    """
+    parser = IncrementalArrayParser()
+    async for text in stream_text(prompt, site="research"):
+        for row in parser.feed(text):
+            yield row
+    
+    if parser.rows_emitted == 0:
+        for row in parse_research_buffer(parser.buffer):
+            yield row
+
+
+async def generate_table_rows(rows, started_at: float, endpoint: str, context: dict = None, on_complete=None):
+    """Format research rows as NDJSON lines followed by a `table_end` line.
+    
+    `on_complete(table)` is called with the full table when the stream
+    finished without errors.
+    
+    Yields:
+        '{"type": "table_row", "index": i, "content": {...}}' per program, then
+        '{"type": "table_end", "count": n, "context": {...}}'
+    """
+    table = []
+    first_row_ms = None
     try:
-        response = await model.generate_content_async(prompt, stream=True)
-        buffer = ""
-        async for chunk in response:
-            if chunk.text:
-                buffer += chunk.text
-        
-        # Post-process: Strip markdown wrappers if present
-        cleaned_buffer = buffer.strip()
-        if cleaned_buffer.startswith('```'):
-            # Remove markdown code block
-            lines = cleaned_buffer.split('\n')
-            if lines[0].startswith('```'):
-                lines = lines[1:]
-            if lines and lines[-1].strip() == '```':
-                lines = lines[:-1]
-            cleaned_buffer = '\n'.join(lines).strip()
-        
-        # Check if AI returned the full structured response or just the array
-        try:
-            parsed = json.loads(cleaned_buffer)
-            # If it's already structured with "type" and "content", extract content
-            if isinstance(parsed, dict) and 'content' in parsed:
-                content_array = parsed['content']
-                yield f'{{"type": "table", "content": {json.dumps(content_array)}}}'
-            # If it's just the array, wrap it
-            elif isinstance(parsed, list):
-                yield f'{{"type": "table", "content": {json.dumps(parsed)}}}'
-            else:
-                # Fallback: return as-is
-                yield f'{{"type": "table", "content": {cleaned_buffer}}}'
-        except json.JSONDecodeError:
-            # If JSON is invalid, return error
-            yield f'{{"type": "table", "content": [{{"error": "Invalid JSON from AI"}}]}}'
-            
+        async for row in rows:
+            if first_row_ms is None:
+                first_row_seconds = time.perf_counter() - started_at
+                TIME_TO_FIRST_ROW.labels(endpoint).observe(first_row_seconds)
+                first_row_ms = round(first_row_seconds * 1000)
+            yield json.dumps({"type": "table_row", "index": len(table), "content": row}, ensure_ascii=False) + "\n"
+            table.append(row)
+        if on_complete:
+            on_complete(table)
+    except json.JSONDecodeError:
+        # If JSON is invalid, return error
+        yield json.dumps({"type": "table_row", "index": len(table), "content": {"error": "Invalid JSON from AI"}}) + "\n"
+    except LLMUnavailable as e:
+        context = {**(context or {}), "degraded": True}
+        yield json.dumps({"type": "table_row", "index": len(table), "content": {"error": e.user_message}}, ensure_ascii=False) + "\n"
     except Exception as e:
         print(f"Error in research generation: {e}")
-        yield f'{{"type": "table", "content": [{{"error": "Generation failed: {str(e)}"}}]}}'
+        yield json.dumps({"type": "table_row", "index": len(table), "content": {"error": f"Generation failed: {str(e)}"}}) + "\n"
+    
+    end_context = dict(context or {})
+    end_context["timeToFirstRowMs"] = first_row_ms
+    yield json.dumps({"type": "table_end", "count": len(table), "context": end_context}, ensure_ascii=False) + "\n"
+
+
+async def _iterate(table: list):
+    for row in table:
+        yield row
+
 
+async def generate_research_stream(niche: str, user_id: str = "anonymous"):
+    """Generate affiliate program research for a niche as NDJSON rows.
+    
+    Results are served from the persistent research cache when available;
+    the cache freshness is exposed under `context.cache` of the final
+    `table_end` line.
+    """
+    started_at = time.perf_counter()
+    # The endpoint already knows the intent: no routing call is made
+    niche = route_forced("research", niche).entities.niche or niche
+    try:
+        async with request_scheduler.slot("research", user_id):
+            async for line in _research_lines(niche, started_at):
+                yield line
+    except RequestShed as e:
+        # Shed before any row was produced
+        yield json.dumps({"type": "table_row", "index": 0, "content": {"error": e.user_message}}, ensure_ascii=False) + "\n"
+        yield json.dumps({"type": "table_end", "count": 0, "context": {"degraded": True}}) + "\n"
+
+
+async def _research_lines(niche: str, started_at: float):
+    table, cache_info = research_cache.serve_cached(niche, lambda: fetch_research_table(niche))
+    if table is not None:
+        rows = _iterate(table)
+    else:
+        rows = stream_research_rows(PROMPT_TEMPLATE.format(niche=niche, context=""))
+    
+    def store(streamed: list):
+        if not cache_info["hit"] and is_cacheable_table(streamed):
+            research_cache.put(niche, streamed)
+    
+    async for line in generate_table_rows(rows, started_at, "research", {"cache": cache_info}, on_complete=store):
+        yield line
 
-async def generate_chat_stream(messages: list):
+
+async def generate_chat_stream(messages: list, session: Optional[Session] = None, user_id: str = "anonymous"):
     """Generate streaming chat response based on conversation history.
     
     This is the LEGACY endpoint that routes to the old simple intent system.
@@ -92,6 +193,9 @@ async def generate_chat_stream(messages: list):
     
     Args:
         messages: List of message dicts with 'role' and 'content'
+        session: Server-side conversation whose history replaces the one
+                 rebuilt from `messages`; the exchange is recorded in it
+        user_id: Caller identity used for fair queuing between users
     
     Yields:
         JSON-formatted response chunks
@@ -99,63 +203,80 @@ async def generate_chat_stream(messages: list):
     # Get last user message
     user_messages = [m for m in messages if m.get('role') == 'user']
     if not user_messages:
-        yield json.dumps({"type": "text", "content": "No user message found"})
+        yield json.dumps({"type": "text", "content": "No user message found"}) + "\n"
         return
     
     user_query = user_messages[-1].get('content', '')
     
     # Build conversation history for context
     conversation_history = ""
-    for msg in messages[:-1]:  # Exclude current message
-        role = msg.get('role', 'user')
-        content = msg.get('content', '')
-        if isinstance(content, str):
-            conversation_history += f"{role}: {content}\n"
+    if session is not None:
+        conversation_history = session.history()
+    else:
+        for msg in messages[:-1]:  # Exclude current message
+            role = msg.get('role', 'user')
+            content = msg.get('content', '')
+            if isinstance(content, str):
+                conversation_history += f"{role}: {content}\n"
+    
+    started_at = time.perf_counter()
+    # Every answer of this endpoint streams an LLM generation (a research table
+    # or an explanation, also for data intents), so the request queues and is
+    # shed as generative work. The slot is taken before routing so that the
+    # speculative research generation is admitted like any other work.
+    try:
+        async with request_scheduler.slot("research", user_id):
+            async for line in _chat_lines(user_query, conversation_history, session, started_at):
+                yield line
+    except RequestShed as e:
+        yield json.dumps({"type": "text", "content": e.user_message}, ensure_ascii=False) + "\n"
+
+
+async def _chat_lines(user_query: str, conversation_history: str, session: Optional[Session], started_at: float):
+    prompt = PROMPT_TEMPLATE.format(niche=user_query, context=conversation_history)
     
-    # Classify intent using simple AI
-    intent = await classify_intent_ai(user_query, conversation_history)
+    # Speculatively start the research generation while the query is being
+    # routed (only when routing actually needs an LLM call)
+    routed = lookup_known_route(user_query, conversation_history)
+    if routed is not None:
+        record_known_route(routed)
+    speculation = None
+    if routed is None and speculation_policy.should_speculate():
+        speculation = SpeculativeStream(
+            generate_table_rows(stream_research_rows(prompt), started_at, "chat")
+        )
     
-    # Route based on intent
-    if intent in ['research', 'followup']:
+    if routed is None:
         try:
-            prompt = PROMPT_TEMPLATE.format(niche=user_query, context=conversation_history)
-            
-            response = await model.generate_content_async(prompt, stream=True)
-            buffer = ""
-            async for chunk in response:
-                if chunk.text:
-                    buffer += chunk.text
-            
-            # Post-process: Strip markdown wrappers if present
-            cleaned_buffer = buffer.strip()
-            if cleaned_buffer.startswith('```'):
-                # Remove markdown code block
-                lines = cleaned_buffer.split('\n')
-                if lines[0].startswith('```'):
-                    lines = lines[1:]
-                if lines and lines[-1].strip() == '```':
-                    lines = lines[:-1]
-                cleaned_buffer = '\n'.join(lines).strip()
-            
-            # Parse and return JSON
-            try:
-                parsed = json.loads(cleaned_buffer)
-                # If it's already structured with "type" and "content", extract content
-                if isinstance(parsed, dict) and 'content' in parsed:
-                    content_array = parsed['content']
-                    yield json.dumps({"type": "table", "content": content_array})
-                # If it's just the array, wrap it
-                elif isinstance(parsed, list):
-                    yield json.dumps({"type": "table", "content": parsed})
-                else:
-                    # Fallback: return as-is
-                    yield json.dumps({"type": "table", "content": cleaned_buffer})
-            except json.JSONDecodeError:
-                # If JSON is invalid, return error
-                yield json.dumps({"type": "table", "content": [{"error": "Invalid JSON from AI"}]})
-                
-        except Exception as e:
-            yield json.dumps({"type": "table", "content": [{"error": f"Generation failed: {str(e)}"}]})
+            routed = await route(user_query, conversation_history)
+        except BaseException:
+            if speculation:
+                speculation.cancel()
+                CANCELLED_WORK.labels("speculation").inc()
+            raise
+    classify_seconds = time.perf_counter() - started_at
+    set_intent(routed.intent)
+    intent = routed.legacy_intent
+    is_research = intent in ['research', 'followup']
+    speculation_policy.record_intent(is_research)
+    
+    if speculation and not is_research:
+        speculation_policy.record_wasted(speculation.cancel())
+        speculation = None
+    
+    if is_research:
+        if speculation:
+            speculation_policy.record_committed(classify_seconds)
+            lines = speculation.commit()
+        else:
+            # Without speculation the extracted niche can sharpen the prompt
+            niche = routed.entities.niche or user_query
+            prompt = PROMPT_TEMPLATE.format(niche=niche, context=conversation_history)
+            lines = generate_table_rows(stream_research_rows(prompt), started_at, "chat")
+        async for line in lines:
+            yield line
+        if session is not None:
+            session.add_exchange(user_query, "[Previous data/chart response]")
     else:
         # Generate text response (explanation)
         prompt = f"""{CHAT_SYSTEM_INSTRUCTION}
@@ -167,61 +288,26 @@ Current user request: {user_query}
 
 Provide a helpful explanation in Vietnamese.
 """
-        
-        try:
-            response = await model.generate_content_async(prompt, stream=True)
-            buffer = ""
-            async for chunk in response:
-                if chunk.text:
-                    buffer += chunk.text
-            
-            # Send complete JSON response (same pattern as table)
-            yield json.dumps({"type": "text", "content": buffer})
-                
-        except Exception as e:
-            print(f"Error in chat generation: {e}")
-            yield json.dumps({"type": "text", "content": f"Xin lỗi, có lỗi xảy ra: {str(e)}"})
-
-
-async def classify_intent_ai(user_query: str, conversation_history: str = "") -> str:
-    """AI-based intent classification using Gemini."""
-    
-    classifier_prompt = f"""You are an intent classifier for an affiliate marketing research assistant.
 
-Analyze the user's query and classify their intent into ONE of these categories:
-
-1. **research** - User wants to find affiliate programs, search for opportunities, or get program recommendations
-   Examples: "Forex", "crypto programs", "beauty ecommerce", "find finance affiliates", "gaming niche"
-   
-2. **explanation** - User wants to understand, learn about, or get clarification on something
-   Examples: "What is affiliate marketing?", "Why is this score high?", "How does this work?", "Explain row 1", "giải thích"
-   
-3. **followup** - User is asking about a previous response or wants more details on something already discussed
-   Examples: "tell me more", "expand on that", "the first one", "details about that program"
-
-User Query: "{user_query}"
-
-Previous Context: {conversation_history if conversation_history else "None (first message)"}
-
-Respond ONLY with ONE word: research, explanation, or followup
-"""
+        try:
+            buffer = await generate_text(prompt, site="chat")
+            if session is not None:
+                session.add_exchange(user_query, buffer)
     
-    try:
-        response = await model.generate_content_async(classifier_prompt)
-        intent = response.text.strip().lower()
-        
-        # Validate and default to research if invalid
-        if intent not in ['research', 'explanation', 'followup']:
-            return 'research'
+            # Send complete JSON response (one NDJSON line)
+            yield json.dumps({"type": "text", "content": buffer}) + "\n"
         
-        return intent
-    except Exception as e:
-        # Default to research on error
-        print(f"Intent classification error: {e}")
-        return 'research'
+        except LLMUnavailable as e:
+            yield json.dumps({"type": "text", "content": e.user_message}, ensure_ascii=False) + "\n"
+        except Exception as e:
+            print(f"Error in chat generation: {e}")
+            yield json.dumps({"type": "text", "content": f"Xin lỗi, có lỗi xảy ra: {str(e)}"}) + "\n"
 
 
-async def generate_agent_stream(messages: list):
+async def generate_agent_stream(
+    messages: list, user_id: str = "anonymous", request_id: str = None, timings: bool = False,
+    verbose: bool = False, session: Optional[Session] = None
+):
     """Generate AI Agent response using crewAI workflow.
     
     This is the NEW endpoint for the AI Agent feature with:
@@ -232,26 +318,39 @@ async def generate_agent_stream(messages: list):
     
     Args:
         messages: List of message dicts with 'role' and 'content'
+        user_id: Caller identity used for fair queuing between users
+        request_id: Id of the request trace (generated when missing)
+        timings: Add the trace's span timings to the context event
+        verbose: Keep the DEBUG log lines of this request (see log_pipeline.py)
+        session: Server-side conversation (see session_store.py); `messages`
+                 then only carries the new user message
     
     Yields:
-        JSON-formatted response with type (composite, chart, table, text)
+        NDJSON events: route, section (id + order), context, message, done
     """
-    try:
-        from agents import run_agent_workflow
+    with trace_scope("agent.chat", request_id, user_id=user_id), verbose_scope(verbose):
+        try:
+            from agents import stream_agent_workflow
         
-        # Run the agent workflow
-        result = await run_agent_workflow(messages)
+            # Forward each workflow event as soon as it is ready
+            async for event in stream_agent_workflow(messages, user_id, timings, session):
+                with span("serialize", event=event.get("event", "")):
+                    line = json.dumps(event, ensure_ascii=False) + "\n"
+                yield line
         
-        # Yield the result as JSON
-        yield json.dumps(result, ensure_ascii=False)
+        except (LLMUnavailable, RequestShed) as e:
+            yield json.dumps({"event": "message", "type": "text", "content": e.user_message}, ensure_ascii=False) + "\n"
+            yield json.dumps({"event": "done", "type": "text"}) + "\n"
         
-    except Exception as e:
-        print(f"Error in agent workflow: {e}")
-        import traceback
-        traceback.print_exc()
+        except Exception as e:
+            print(f"Error in agent workflow: {e}")
+            import traceback
+            traceback.print_exc()
         
-        # Fallback to simple text response
-        yield json.dumps({
-            "type": "text",
-            "content": f"Xin lỗi, có lỗi xảy ra trong quá trình xử lý. Vui lòng thử lại.\n\nChi tiết: {str(e)}"
-        }, ensure_ascii=False)
+            # Fallback to simple text response
+            yield json.dumps({
+                "event": "message",
+                "type": "text",
+                "content": f"Xin lỗi, có lỗi xảy ra trong quá trình xử lý. Vui lòng thử lại.\n\nChi tiết: {str(e)}"
+            }, ensure_ascii=False) + "\n"
+            yield json.dumps({"event": "done", "type": "text"}) + "\n"
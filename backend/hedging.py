@@ -0,0 +1,150 @@
+"""
+Hedged Requests
+
+When an LLM call takes longer than the recent p95 latency of its call site
+(router, narrative, research, chat...), a duplicate is sent and whichever
+finishes first wins; the other is cancelled. Latencies are kept per site so
+long generations are not hedged against the p95 of short calls. Hedges are
+capped at LLM_HEDGE_MAX_RATIO of all calls so a global slowdown does not
+double the upstream load.
+
+Latency is measured from admission, when the gateway hands the call an
+upstream slot (see llm_gateway.py), not from submission: time spent queued
+behind the concurrency limit would otherwise raise the p95 and delay hedges
+exactly when the service is loaded.
+
+LLM_HEDGING=on|off (default on).
+"""
+
+import asyncio
+import os
+import threading
+from collections import deque
+from typing import Awaitable, Callable, TypeVar
+
+from metrics import Counter
+
+T = TypeVar("T")
+
+LLM_HEDGING = os.getenv("LLM_HEDGING", "on").lower() == "on"
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+LLM_HEDGE_MAX_RATIO = float(os.getenv("LLM_HEDGE_MAX_RATIO", "0.1"))
+# No hedging until enough latencies are known to estimate the quantile
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_WINDOW = 500
+
+HEDGES = Counter("llm_hedges_total", "Hedged LLM calls by which attempt won", ["winner"])
+
+
+class Hedger:
+    def __init__(
+        self,
+        enabled: bool = LLM_HEDGING,
+        quantile: float = LLM_HEDGE_QUANTILE,
+        max_ratio: float = LLM_HEDGE_MAX_RATIO,
+        min_samples: int = LLM_HEDGE_MIN_SAMPLES,
+        window: int = LLM_HEDGE_WINDOW,
+    ):
+        self.enabled = enabled
+        self.quantile = quantile
+        self.max_ratio = max_ratio
+        self.min_samples = min_samples
+        self.window = window
+        self._latencies = {}  # site -> deque of recent latencies
+        self._calls = 0
+        self._hedges = 0
+        self._lock = threading.Lock()
+
+    def hedge_delay(self, site: str = "other"):
+        """Seconds to wait before hedging a call from `site`, or None when no hedge should be sent."""
+        with self._lock:
+            latencies = self._latencies.get(site, ())
+            if not self.enabled or len(latencies) < self.min_samples:
+                return None
+            if self._hedges >= self.max_ratio * max(self._calls, 1):
+                return None
+            ordered = sorted(latencies)
+        return ordered[min(len(ordered) - 1, int(self.quantile * len(ordered)))]
+
+    def record(self, latency: float, site: str = "other") -> None:
+        with self._lock:
+            if site not in self._latencies:
+                self._latencies[site] = deque(maxlen=self.window)
+            self._latencies[site].append(latency)
+
+    async def run(self, fn: Callable[[Callable[[], None]], Awaitable[T]], site: str = "other") -> T:
+        """Run `fn(admitted)`, sending one duplicate if it is slower than `site`'s hedge delay.
+
+        `fn` calls `admitted()` once its call holds an upstream slot; both the hedge
+        delay and the recorded latency count from then (from submission if it never does).
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._calls += 1
+        delay = self.hedge_delay(site)
+        submitted = loop.time()
+        admitted_at = {}  # attempt -> loop time it was admitted
+        primary_admitted = asyncio.Event()
+
+        def attempt(name: str) -> asyncio.Future:
+            def admitted() -> None:
+                admitted_at.setdefault(name, loop.time())
+                if name == "primary":
+                    primary_admitted.set()
+            return asyncio.ensure_future(fn(admitted))
+
+        def record(name: str) -> None:
+            self.record(loop.time() - admitted_at.get(name, submitted), site)
+
+        primary = attempt("primary")
+        hedge = admission = None
+        if delay is None:
+            result = await primary
+            record("primary")
+            return result
+
+        try:
+            # The hedge timer starts once the primary is admitted, not while it queues
+            admission = asyncio.ensure_future(primary_admitted.wait())
+            await asyncio.wait({primary, admission}, return_when=asyncio.FIRST_COMPLETED)
+            if not primary.done():
+                waited = loop.time() - admitted_at.get("primary", submitted)
+                await asyncio.wait({primary}, timeout=max(0.0, delay - waited))
+            if primary.done():
+                result = primary.result()
+                record("primary")
+                return result
+
+            with self._lock:
+                self._hedges += 1
+            hedge = attempt("hedge")
+            attempts = {primary: "primary", hedge: "hedge"}
+            pending = set(attempts)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        HEDGES.labels(attempts[task]).inc()
+                        record(attempts[task])
+                        return task.result()
+            # Both attempts failed: surface the primary's error
+            return primary.result()
+        finally:
+            for task in (primary, hedge, admission):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    def stats(self) -> dict:
+        with self._lock:
+            calls, hedges, sites = self._calls, self._hedges, sorted(self._latencies)
+        delays = {site: self.hedge_delay(site) for site in sites}
+        return {
+            "enabled": self.enabled,
+            "hedgeDelayMs": {site: round(delay * 1000) if delay is not None else None for site, delay in delays.items()},
+            "calls": calls,
+            "hedges": hedges,
+            "hedgeWins": int(HEDGES.labels("hedge").value),
+        }
+
+
+llm_hedger = Hedger()
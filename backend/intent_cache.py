@@ -0,0 +1,158 @@
+"""
+Intent Classification Cache
+
+Memoizes router results so repeated queries and follow-up suggestion clicks
+do not go back to Gemini.
+
+- Keys are the normalized query plus a short hash of the recent context
+- Entries expire after a TTL and the least recently used ones are evicted
+  once the cache is full
+- Follow-up suggestions emitted by the agent workflow are pre-seeded with
+  known classifications and never reach the LLM
+"""
+
+import copy
+import hashlib
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+
+INTENT_CACHE_TTL_SECONDS = float(os.getenv("INTENT_CACHE_TTL_SECONDS", "1800"))
+INTENT_CACHE_MAX_ENTRIES = int(os.getenv("INTENT_CACHE_MAX_ENTRIES", "1024"))
+
+# Only the last few context lines influence routing
+CONTEXT_WINDOW = 3
+
+# Follow-up suggestions emitted by the agent workflow (agents.py)
+SUGGESTION_COMPARE_PREVIOUS = "So sánh với tháng trước"
+SUGGESTION_BY_CAMPAIGN = "Phân tích theo chiến dịch"
+SUGGESTION_MORE_DETAIL = "Chi tiết hơn về dữ liệu này"
+SUGGESTION_MORE_PROGRAMS = "Thêm programs trong lĩnh vực {niche}"
+SUGGESTION_COMPARE_COMMISSION = "So sánh commission rates"
+SUGGESTION_RELATED_NICHES = "Ngách liên quan khác"
+
+DATA_ANALYSIS_SUGGESTIONS = [
+    SUGGESTION_COMPARE_PREVIOUS,
+    SUGGESTION_BY_CAMPAIGN,
+    SUGGESTION_MORE_DETAIL,
+]
+
+
+def research_suggestions(niche: str) -> list:
+    """Follow-up suggestions shown under a research table."""
+    return [
+        SUGGESTION_MORE_PROGRAMS.format(niche=niche),
+        SUGGESTION_COMPARE_COMMISSION,
+        SUGGESTION_RELATED_NICHES,
+    ]
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after `ttl_seconds`."""
+
+    def __init__(self, max_entries: int = INTENT_CACHE_MAX_ENTRIES, ttl_seconds: float = INTENT_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        """Return a copy of the cached value, or None if missing/expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return copy.deepcopy(value)
+
+    def set(self, key: str, value) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase, NFC-normalize and collapse whitespace/trailing punctuation."""
+    text = unicodedata.normalize("NFC", query or "").lower().strip()
+    text = re.sub(r"\s+", " ", text)
+    return text.rstrip(" ?!.…")
+
+
+def context_fingerprint(context_lines: list) -> str:
+    """Short hash of the most recent context lines."""
+    recent = [line.strip() for line in context_lines if line and line.strip()][-CONTEXT_WINDOW:]
+    if not recent:
+        return "none"
+    return hashlib.sha1("\n".join(recent).encode("utf-8")).hexdigest()[:16]
+
+
+def make_cache_key(query: str, context_lines: list) -> str:
+    return f"{normalize_query(query)}|{context_fingerprint(context_lines)}"
+
+
+def lookup_seeded_intent(query: str, previous_context: Optional[dict] = None) -> Optional[dict]:
+    """Return a known classification for a workflow-emitted follow-up suggestion.
+
+    Entities are carried over from the previous response context (filters for
+    data answers, niche for research answers) so the follow-up stays on topic.
+    """
+    normalized = normalize_query(query)
+    previous_context = previous_context or {}
+    filters = previous_context.get("filters") or {}
+    previous_niche = previous_context.get("niche")
+
+    carried = {
+        "time_range": filters.get("timeRange"),
+        "program": filters.get("program"),
+        "keywords": filters.get("keywords"),
+    }
+
+    result = None
+    if normalized == normalize_query(SUGGESTION_COMPARE_PREVIOUS):
+        result = {"intent": "comparison", "entities": {**carried, "time_range": "last 60 days", "group_by": "day"}}
+    elif normalized == normalize_query(SUGGESTION_BY_CAMPAIGN):
+        result = {"intent": "data_analysis", "entities": {**carried, "group_by": "campaign", "breakdown": "campaign", "visual_type": "bar"}}
+    elif normalized == normalize_query(SUGGESTION_MORE_DETAIL):
+        result = {"intent": "followup", "entities": {**carried, "group_by": "day"}}
+    elif normalized == normalize_query(SUGGESTION_COMPARE_COMMISSION):
+        result = {"intent": "explanation", "entities": {}}
+    elif normalized == normalize_query(SUGGESTION_RELATED_NICHES):
+        niche = f"Ngách liên quan đến {previous_niche}" if previous_niche else query
+        result = {"intent": "research", "entities": {"niche": niche}}
+    elif normalized.startswith(normalize_query(SUGGESTION_MORE_PROGRAMS.format(niche=""))):
+        prefix = SUGGESTION_MORE_PROGRAMS.format(niche="").strip()
+        match = re.match(rf"{re.escape(prefix)}\s+(.+)", unicodedata.normalize("NFC", query.strip()), re.IGNORECASE)
+        if match:
+            result = {"intent": "research", "entities": {"niche": match.group(1).strip(), "expand": True}}
+
+    if result is None:
+        return None
+    result["entities"] = {k: v for k, v in result["entities"].items() if v is not None}
+    result["confidence"] = 1.0
+    result["source"] = "seed"
+    return result
+
+
+def to_legacy_intent(intent: str) -> str:
+    """Map an agent intent onto the legacy research/explanation/followup set."""
+    if intent in ("research", "explanation"):
+        return intent
+    return "followup"
+
@@ -0,0 +1,173 @@
+"""
+LLM Backends
+
+The upstream model behind llm_client.py is selected with LLM_BACKEND:
+
+- gemini (default): Google Gemini, requires GOOGLE_API_KEY
+- fake: in-process stand-in (see fake_llm.py), no key or network needed
+- http: the same stand-in served by fake_llm_server.py at LLM_FAKE_URL,
+  so load tests exercise real sockets and a separate process
+
+Every backend exposes the same three calls; gateway, hedging and
+single-flight handling stay in llm_client.py.
+"""
+
+import asyncio
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+from abc import ABC, abstractmethod
+from typing import AsyncIterator
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini").lower()
+LLM_FAKE_URL = os.getenv("LLM_FAKE_URL", "http://127.0.0.1:8090")
+LLM_HTTP_TIMEOUT_SECONDS = float(os.getenv("LLM_HTTP_TIMEOUT_SECONDS", "60"))
+
+
+class LLMBackendError(Exception):
+    """An upstream error reported by a non-Gemini backend (message keeps the HTTP status)."""
+
+
+class LLMBackend(ABC):
+    """The calls every backend implements."""
+
+    name = "base"
+
+    @abstractmethod
+    async def generate(self, prompt: str, model: str, json_mode: bool = False) -> str:
+        """Complete `prompt` (as JSON with `json_mode`)."""
+
+    @abstractmethod
+    def generate_sync(self, prompt: str, model: str) -> str:
+        """Blocking completion, for callers outside the event loop."""
+
+    @abstractmethod
+    def stream(self, prompt: str, model: str) -> AsyncIterator[str]:
+        """Yield the completion as text chunks."""
+
+
+class GeminiBackend(LLMBackend):
+    name = "gemini"
+
+    def __init__(self, api_key: str = None):
+        import google.generativeai as genai
+
+        api_key = api_key or os.getenv("GOOGLE_API_KEY")
+        if not api_key:
+            raise ValueError("GOOGLE_API_KEY environment variable is not set")
+        genai.configure(api_key=api_key)
+        self._genai = genai
+
+    async def generate(self, prompt: str, model: str, json_mode: bool = False) -> str:
+        config = {"response_mime_type": "application/json"} if json_mode else None
+        response = await self._genai.GenerativeModel(model).generate_content_async(prompt, generation_config=config)
+        return response.text
+
+    def generate_sync(self, prompt: str, model: str) -> str:
+        return self._genai.GenerativeModel(model).generate_content(prompt).text
+
+    async def stream(self, prompt: str, model: str) -> AsyncIterator[str]:
+        response = await self._genai.GenerativeModel(model).generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+
+class FakeBackend(LLMBackend):
+    name = "fake"
+
+    def __init__(self, fake=None):
+        from fake_llm import FakeLLM
+
+        self.fake = fake or FakeLLM()
+
+    async def generate(self, prompt: str, model: str, json_mode: bool = False) -> str:
+        return await self.fake.generate(prompt, json_mode)
+
+    def generate_sync(self, prompt: str, model: str) -> str:
+        return self.fake.generate_sync(prompt)
+
+    def stream(self, prompt: str, model: str) -> AsyncIterator[str]:
+        return self.fake.stream(prompt)
+
+
+class HTTPBackend(LLMBackend):
+    """Client for fake_llm_server.py (stdlib only; blocking I/O runs in worker threads)."""
+
+    name = "http"
+
+    def __init__(self, base_url: str = LLM_FAKE_URL, timeout: float = LLM_HTTP_TIMEOUT_SECONDS):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def _open(self, path: str, payload: dict):
+        request = urllib.request.Request(
+            f"{self.base_url}{path}",
+            data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            return urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            detail = e.read().decode("utf-8", "replace")
+            raise LLMBackendError(f"{e.code} {detail}") from None
+
+    def generate_sync(self, prompt: str, model: str, json_mode: bool = False) -> str:
+        with self._open("/v1/generate", {"prompt": prompt, "model": model, "json_mode": json_mode}) as response:
+            return json.loads(response.read())["text"]
+
+    async def generate(self, prompt: str, model: str, json_mode: bool = False) -> str:
+        return await asyncio.to_thread(self.generate_sync, prompt, model, json_mode)
+
+    async def stream(self, prompt: str, model: str) -> AsyncIterator[str]:
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                pass  # the event loop is already closed
+
+        def read():
+            # NDJSON lines: {"text": ...} per chunk, {"error": ...} if the stream fails
+            try:
+                with self._open("/v1/stream", {"prompt": prompt, "model": model}) as response:
+                    for line in response:
+                        if stop.is_set():
+                            return
+                        if line.strip():
+                            event = json.loads(line)
+                            if "error" in event:
+                                raise LLMBackendError(event["error"])
+                            put(event["text"])
+            except Exception as e:
+                put(e)
+            finally:
+                put(done)
+
+        loop.run_in_executor(None, read)
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # The reader thread exits at its next line instead of draining the stream
+            stop.set()
+
+
+BACKENDS = {"gemini": GeminiBackend, "fake": FakeBackend, "http": HTTPBackend}
+
+
+def create_backend(name: str = LLM_BACKEND) -> LLMBackend:
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown LLM_BACKEND {name!r} (expected one of {', '.join(BACKENDS)})")
+    return BACKENDS[name]()
@@ -0,0 +1,126 @@
+"""
+LLM Client
+
+Single choke point for every LLM call made by the backend. The upstream is
+Gemini unless LLM_BACKEND selects the offline stand-in (see llm_backend.py).
+Identical concurrent calls (same model + prompt + options) are coalesced
+into one upstream request (see singleflight.py), which then goes through the LLM
+gateway (see llm_gateway.py) and may raise LLMUnavailable. Non-streamed
+calls slower than their site's recent p95 are hedged (see hedging.py). Each call
+is recorded as a span of the current request trace (see tracing.py) and in
+the llm_calls / llm_call_seconds / llm_estimated_tokens metrics under its
+call `site`.
+
+IMPORTANT: Always use gemini-3-flash-preview - DO NOT CHANGE
+"""
+
+import asyncio
+import time
+from contextlib import contextmanager
+from typing import AsyncIterator
+
+from dotenv import load_dotenv
+
+from cancellation import OperationCancelled
+from hedging import llm_hedger
+from llm_backend import LLMBackend, create_backend
+from llm_gateway import LLMUnavailable, llm_gateway
+from metrics import Counter, Histogram
+from singleflight import SingleFlight, StreamFlight, SyncSingleFlight, flight_key
+from tracing import span
+
+load_dotenv()
+
+# IMPORTANT: Always use gemini-3-flash-preview - DO NOT CHANGE
+MODEL_NAME = "gemini-3-flash-preview"
+
+_backend = None
+
+llm_flight = SingleFlight("llm")
+llm_sync_flight = SyncSingleFlight("llm_sync")
+llm_stream_flight = StreamFlight("llm_stream")
+
+LLM_CALLS = Counter("llm_calls_total", "LLM calls by call site and outcome", ["site", "outcome"])
+LLM_CALL_SECONDS = Histogram(
+    "llm_call_seconds", "LLM call latency by call site (including coalescing and gateway queueing)", ["site"]
+)
+LLM_TOKENS = Counter(
+    "llm_estimated_tokens_total", "Estimated LLM tokens (characters / 4) by call site and direction", ["site", "direction"]
+)
+
+
+def get_backend() -> LLMBackend:
+    """The configured backend, created on first use."""
+    global _backend
+    if _backend is None:
+        _backend = create_backend()
+    return _backend
+
+
+def set_backend(backend: LLMBackend) -> None:
+    """Replace the backend (benchmarks and tests)."""
+    global _backend
+    _backend = backend
+
+
+@contextmanager
+def _observe_call(site: str, prompt: str):
+    """Record one call's outcome, latency and estimated tokens; yields a dict for the response size."""
+    call = {"response_chars": 0}
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield call
+        outcome = "ok"
+    except LLMUnavailable:
+        outcome = "unavailable"
+        raise
+    except (asyncio.CancelledError, GeneratorExit, OperationCancelled):
+        outcome = "cancelled"
+        raise
+    finally:
+        LLM_CALLS.labels(site, outcome).inc()
+        LLM_CALL_SECONDS.labels(site).observe(time.perf_counter() - started)
+        LLM_TOKENS.labels(site, "prompt").inc(len(prompt) // 4)
+        LLM_TOKENS.labels(site, "response").inc(call["response_chars"] // 4)
+
+
+async def generate_text(prompt: str, model: str = MODEL_NAME, json_mode: bool = False, site: str = "other") -> str:
+    """Full response text for a prompt; `site` names the caller in the metrics."""
+    async def upstream() -> str:
+        return await get_backend().generate(prompt, model, json_mode)
+
+    with span("llm.generate", site=site, model=model, json_mode=json_mode, prompt_chars=len(prompt)) as current, \
+            _observe_call(site, prompt) as call:
+        text = await llm_flight.do(
+            flight_key(model, json_mode, prompt),
+            lambda: llm_hedger.run(lambda admitted: llm_gateway.run(upstream, admitted), site),
+        )
+        call["response_chars"] = len(text)
+        if current:
+            current.set(response_chars=len(text))
+        return text
+
+
+def generate_text_sync(prompt: str, model: str = MODEL_NAME, site: str = "other") -> str:
+    """Blocking variant for callers outside the event loop (crewAI agents)."""
+    def call() -> str:
+        return llm_gateway.run_sync(lambda: get_backend().generate_sync(prompt, model))
+
+    with span("llm.generate_sync", site=site, model=model, prompt_chars=len(prompt)), \
+            _observe_call(site, prompt) as observed:
+        text = llm_sync_flight.do(flight_key(model, False, prompt), call)
+        observed["response_chars"] = len(text)
+        return text
+
+
+async def stream_text(prompt: str, model: str = MODEL_NAME, site: str = "other") -> AsyncIterator[str]:
+    """Response text chunks as they are generated."""
+    def upstream() -> AsyncIterator[str]:
+        return llm_gateway.stream(lambda: get_backend().stream(prompt, model))
+
+    key = flight_key(model, "stream", prompt)
+    with span("llm.stream", site=site, model=model, prompt_chars=len(prompt)), _observe_call(site, prompt) as call:
+        async for text in llm_stream_flight.stream(key, upstream):
+            call["response_chars"] += len(text)
+            yield text
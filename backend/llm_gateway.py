@@ -0,0 +1,425 @@
+"""
+LLM Gateway
+
+Bounds and protects the Gemini calls made through llm_client.py:
+
+- Adaptive concurrency limit: grows slowly while latency stays near its
+  baseline, shrinks on latency spikes and quickly on errors / rate limits
+- Bounded wait queue: callers beyond the limit wait up to
+  LLM_QUEUE_TIMEOUT_SECONDS (or the request deadline, if sooner); when the
+  queue is full they are rejected at once; queued calls of higher-priority
+  requests (see scheduler.py) are admitted first
+- Circuit breaker: opens when the recent failure rate is too high, so callers
+  fail fast (and serve degraded answers) until a probe call succeeds again
+
+Rejections raise LLMUnavailable; callers degrade to cached research or
+templated narratives.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, TypeVar
+
+from cancellation import CANCELLED_WORK
+from deadline import remaining
+from metrics import Counter, Gauge, Histogram
+from scheduler import current_priority
+
+T = TypeVar("T")
+
+LLM_INITIAL_CONCURRENCY = float(os.getenv("LLM_INITIAL_CONCURRENCY", "8"))
+LLM_MIN_CONCURRENCY = float(os.getenv("LLM_MIN_CONCURRENCY", "2"))
+LLM_MAX_CONCURRENCY = float(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_QUEUE_SIZE = int(os.getenv("LLM_QUEUE_SIZE", "64"))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "10"))
+LLM_BREAKER_FAILURE_RATE = float(os.getenv("LLM_BREAKER_FAILURE_RATE", "0.5"))
+LLM_BREAKER_MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", "10"))
+LLM_BREAKER_WINDOW = int(os.getenv("LLM_BREAKER_WINDOW", "20"))
+LLM_BREAKER_COOLDOWN_SECONDS = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+
+# Latency above baseline * tolerance is treated as congestion
+LATENCY_TOLERANCE = 2.0
+
+QUEUE_WAIT = Histogram("llm_gateway_queue_wait_seconds", "Time spent waiting for an LLM slot")
+REJECTIONS = Counter("llm_gateway_rejections_total", "LLM calls rejected by the gateway", ["reason"])
+CALLS = Counter("llm_gateway_calls_total", "LLM calls that reached upstream by outcome", ["outcome"])
+CALL_SECONDS = Histogram("llm_gateway_call_seconds", "Upstream LLM call latency")
+LIMIT = Gauge("llm_gateway_concurrency_limit", "Current adaptive concurrency limit")
+INFLIGHT = Gauge("llm_gateway_inflight", "LLM calls currently running upstream")
+QUEUED = Gauge("llm_gateway_queued", "LLM calls waiting for a slot")
+BREAKER_STATE = Gauge("llm_gateway_breaker_state", "Circuit breaker state (0 closed, 1 half-open, 2 open)")
+
+BREAKER_CLOSED, BREAKER_HALF_OPEN, BREAKER_OPEN = "closed", "half_open", "open"
+_BREAKER_STATE_VALUES = {BREAKER_CLOSED: 0, BREAKER_HALF_OPEN: 1, BREAKER_OPEN: 2}
+
+
+class LLMUnavailable(Exception):
+    """The gateway refused the call (circuit open, queue full or wait timeout)."""
+
+    user_message = "Hệ thống AI đang quá tải, vui lòng thử lại sau ít phút."
+
+    def __init__(self, reason: str):
+        super().__init__(f"LLM unavailable: {reason}")
+        self.reason = reason
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    text = f"{type(error).__name__} {error}"
+    return "ResourceExhausted" in text or "429" in text or "rate limit" in text.lower()
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit with a bounded wait queue (FIFO within a request priority)."""
+
+    def __init__(
+        self,
+        initial: float = LLM_INITIAL_CONCURRENCY,
+        minimum: float = LLM_MIN_CONCURRENCY,
+        maximum: float = LLM_MAX_CONCURRENCY,
+        queue_size: int = LLM_QUEUE_SIZE,
+        queue_timeout: float = LLM_QUEUE_TIMEOUT_SECONDS,
+    ):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.inflight = 0
+        self.baseline = None  # slow EWMA of latency
+        self.recent = None  # fast EWMA of latency
+        self._waiters = deque()  # (priority, future); lower priority values are served first
+        self._loop = None  # event loop of the async callers; worker threads queue through it
+        self._lock = threading.Lock()  # slots of worker threads while no event loop is running
+        LIMIT.set(self.limit)
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _has_capacity(self) -> bool:
+        return self.inflight < int(self.limit)
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+
+    def _owner_loop(self):
+        """The running event loop that owns the queue, unless the caller is on it."""
+        loop = self._loop
+        if loop is None or not loop.is_running():
+            return None
+        try:
+            if asyncio.get_running_loop() is loop:
+                return None
+        except RuntimeError:
+            pass
+        return loop
+
+    def call_soon(self, fn: Callable[[], None]) -> None:
+        """Run `fn` (which changes the limiter) on the thread that owns the limiter."""
+        loop = self._owner_loop()
+        if loop is not None:
+            loop.call_soon_threadsafe(fn)
+            return
+        with self._lock:
+            fn()
+
+    def acquire_blocking(self) -> None:
+        """`acquire` for worker threads: they wait in the same queue as the async callers."""
+        loop = self._owner_loop()
+        if loop is not None:
+            # The task copies this thread's context, so request priority and deadline still apply
+            asyncio.run_coroutine_threadsafe(self.acquire(), loop).result()
+            return
+        # No event loop to wait on (scripts, or the loop thread itself): a free slot or nothing
+        with self._lock:
+            if not self._has_capacity() or self._waiters:
+                REJECTIONS.labels("queue_full").inc()
+                raise LLMUnavailable("queue_full")
+            self.inflight += 1
+            INFLIGHT.set(self.inflight)
+            QUEUE_WAIT.observe(0)
+
+    async def acquire(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        if self._has_capacity() and not self._waiters:
+            self.inflight += 1
+            INFLIGHT.set(self.inflight)
+            QUEUE_WAIT.observe(0)
+            return
+        if len(self._waiters) >= self.queue_size:
+            REJECTIONS.labels("queue_full").inc()
+            raise LLMUnavailable("queue_full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        entry = (current_priority(), waiter)
+        self._waiters.append(entry)
+        QUEUED.set(self.queued)
+        started = time.perf_counter()
+        try:
+            # Never wait longer than the request's remaining deadline budget
+            await asyncio.wait_for(asyncio.shield(waiter), min(self.queue_timeout, remaining(self.queue_timeout)))
+        except BaseException as e:
+            timed_out = isinstance(e, asyncio.TimeoutError)
+            if waiter.done() and not waiter.cancelled():
+                if timed_out:
+                    return  # the slot was handed over right at the deadline
+                self.release()
+                raise
+            if timed_out:
+                REJECTIONS.labels("queue_timeout").inc()
+                raise LLMUnavailable("queue_timeout") from None
+            raise
+        finally:
+            if entry in self._waiters:
+                self._waiters.remove(entry)
+                waiter.cancel()
+            QUEUED.set(self.queued)
+            QUEUE_WAIT.observe(time.perf_counter() - started)
+
+    def release(self) -> None:
+        self.inflight -= 1
+        self._wake()
+        INFLIGHT.set(self.inflight)
+
+    def _wake(self) -> None:
+        while self._waiters and self._has_capacity():
+            # min() keeps arrival order among waiters of the same priority
+            entry = min(self._waiters, key=lambda e: e[0])
+            self._waiters.remove(entry)
+            waiter = entry[1]
+            if waiter.done():
+                continue
+            self.inflight += 1
+            waiter.set_result(None)
+
+    def on_success(self, latency: float) -> None:
+        self.recent = latency if self.recent is None else 0.7 * self.recent + 0.3 * latency
+        self.baseline = latency if self.baseline is None else 0.95 * self.baseline + 0.05 * latency
+        if self.recent > self.baseline * LATENCY_TOLERANCE:
+            self.limit = max(self.minimum, self.limit * 0.9)
+        elif self.inflight + 1 >= int(self.limit):
+            # Only grow while the current limit is actually being used
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        LIMIT.set(self.limit)
+        self._wake()
+
+    def on_failure(self, error: BaseException) -> None:
+        self.limit = max(self.minimum, self.limit * (0.5 if is_rate_limit_error(error) else 0.8))
+        LIMIT.set(self.limit)
+
+
+class CircuitBreaker:
+    """Failure-rate breaker over the last `window` upstream calls."""
+
+    def __init__(
+        self,
+        failure_rate: float = LLM_BREAKER_FAILURE_RATE,
+        min_calls: int = LLM_BREAKER_MIN_CALLS,
+        window: int = LLM_BREAKER_WINDOW,
+        cooldown_seconds: float = LLM_BREAKER_COOLDOWN_SECONDS,
+    ):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.cooldown_seconds = cooldown_seconds
+        self.state = BREAKER_CLOSED
+        self.opened_at = 0.0
+        self._outcomes = deque(maxlen=window)  # True on failure
+        self._probing = False
+        self._lock = threading.Lock()
+        BREAKER_STATE.set(0)
+
+    def _set_state(self, state: str) -> None:
+        self.state = state
+        BREAKER_STATE.set(_BREAKER_STATE_VALUES[state])
+
+    def is_open(self) -> bool:
+        """True while calls are being refused (open and still cooling down)."""
+        with self._lock:
+            return self.state == BREAKER_OPEN and time.monotonic() - self.opened_at < self.cooldown_seconds
+
+    def would_reject(self) -> bool:
+        """True if `allow()` would refuse a call now: open, or half-open with the probe in flight."""
+        with self._lock:
+            if self.state == BREAKER_OPEN:
+                return time.monotonic() - self.opened_at < self.cooldown_seconds
+            return self.state == BREAKER_HALF_OPEN and self._probing
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == BREAKER_OPEN:
+                if time.monotonic() - self.opened_at < self.cooldown_seconds:
+                    return False
+                self._set_state(BREAKER_HALF_OPEN)
+            if self.state == BREAKER_HALF_OPEN:
+                if self._probing:
+                    return False
+                self._probing = True
+            return True
+
+    def record(self, failed: bool) -> None:
+        with self._lock:
+            if self.state == BREAKER_HALF_OPEN:
+                self._probing = False
+                if failed:
+                    self._open()
+                else:
+                    self._outcomes.clear()
+                    self._set_state(BREAKER_CLOSED)
+                return
+            self._outcomes.append(failed)
+            failures = sum(self._outcomes)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate:
+                self._open()
+
+    def release_probe(self) -> None:
+        """Free the half-open probe slot of a call that ended without an outcome."""
+        with self._lock:
+            self._probing = False
+
+    def _open(self) -> None:
+        self.opened_at = time.monotonic()
+        self._set_state(BREAKER_OPEN)
+
+
+class LLMGateway:
+    """Adaptive limiter + circuit breaker around upstream LLM calls."""
+
+    def __init__(self, limiter: AdaptiveLimiter = None, breaker: CircuitBreaker = None):
+        self.limiter = limiter or AdaptiveLimiter()
+        self.breaker = breaker or CircuitBreaker()
+
+    def is_open(self) -> bool:
+        """True while upstream is considered unhealthy; callers should degrade."""
+        return self.breaker.is_open()
+
+    def would_reject(self) -> bool:
+        """True if a call made now would fail with LLMUnavailable("circuit_open"); callers should degrade."""
+        return self.breaker.would_reject()
+
+    def _admit(self) -> bool:
+        """Raise if the breaker refuses the call; return True if the call is the half-open probe."""
+        if not self.breaker.allow():
+            REJECTIONS.labels("circuit_open").inc()
+            raise LLMUnavailable("circuit_open")
+        return self.breaker.state == BREAKER_HALF_OPEN
+
+    def _record(self, started: float, error: BaseException = None) -> None:
+        self._record_latency(time.perf_counter() - started, error)
+
+    def _record_latency(self, latency: float, error: BaseException = None) -> None:
+        if error is None:
+            CALLS.labels("success").inc()
+            CALL_SECONDS.observe(latency)
+            self.limiter.on_success(latency)
+        else:
+            CALLS.labels("rate_limited" if is_rate_limit_error(error) else "error").inc()
+            self.limiter.on_failure(error)
+        self.breaker.record(failed=error is not None)
+
+    async def run(self, fn: Callable[[], Awaitable[T]], on_admit: Callable[[], None] = None) -> T:
+        """Run `fn` once a slot is free; `on_admit` is called when the slot is granted."""
+        probe = self._admit()
+        try:
+            await self.limiter.acquire()
+        except BaseException:
+            if probe:
+                self.breaker.release_probe()
+            raise
+        if on_admit is not None:
+            on_admit()
+        started = time.perf_counter()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            CANCELLED_WORK.labels("llm_call").inc()
+            raise
+        except Exception as e:
+            self._record(started, e)
+            raise
+        else:
+            self._record(started)
+            return result
+        finally:
+            if probe:
+                self.breaker.release_probe()
+            self.limiter.release()
+
+    async def stream(self, factory: Callable[[], AsyncIterator[T]]) -> AsyncIterator[T]:
+        """Hold one slot for a whole streamed response; latency is time to first chunk."""
+        probe = self._admit()
+        try:
+            await self.limiter.acquire()
+        except BaseException:
+            if probe:
+                self.breaker.release_probe()
+            raise
+        started = time.perf_counter()
+        recorded = False
+        try:
+            async for item in factory():
+                if not recorded:
+                    self._record(started)
+                    recorded = True
+                yield item
+            if not recorded:
+                self._record(started)
+        except (GeneratorExit, asyncio.CancelledError):
+            CANCELLED_WORK.labels("llm_stream").inc()
+            raise
+        except Exception as e:
+            if not recorded:
+                self._record(started, e)
+            raise
+        finally:
+            if probe:
+                self.breaker.release_probe()
+            self.limiter.release()
+
+    def run_sync(self, fn: Callable[[], T]) -> T:
+        """Blocking calls (worker threads) share the breaker, probe and limit of the async path."""
+        probe = self._admit()
+        try:
+            self.limiter.acquire_blocking()
+        except BaseException:
+            if probe:
+                self.breaker.release_probe()
+            raise
+        started = time.perf_counter()
+        outcome = None  # (latency, error) once the call has an outcome
+        try:
+            result = fn()
+        except Exception as e:
+            outcome = (time.perf_counter() - started, e)
+            raise
+        else:
+            outcome = (time.perf_counter() - started, None)
+            return result
+        finally:
+            self.limiter.call_soon(lambda: self._finish_sync(outcome, probe))
+
+    def _finish_sync(self, outcome, probe: bool) -> None:
+        # Runs where the limiter lives: recording may hand the slot to a queued caller
+        if outcome is not None:
+            self._record_latency(*outcome)
+        if probe:
+            self.breaker.release_probe()
+        self.limiter.release()
+
+    def stats(self) -> dict:
+        wait = QUEUE_WAIT.labels()
+        return {
+            "breaker": self.breaker.state,
+            "concurrencyLimit": round(self.limiter.limit, 2),
+            "inflight": self.limiter.inflight,
+            "queued": self.limiter.queued,
+            "avgQueueWaitMs": round(wait.sum / wait.count * 1000, 1) if wait.count else 0.0,
+            "p95QueueWaitMs": round(wait.quantile(0.95) * 1000, 1) if wait.count else 0.0,
+            "rejections": {reason: int(REJECTIONS.labels(reason).value) for reason in ("queue_full", "queue_timeout", "circuit_open")},
+            "baselineLatencyMs": round(self.limiter.baseline * 1000) if self.limiter.baseline else None,
+        }
+
+
+llm_gateway = LLMGateway()
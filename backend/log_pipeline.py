@@ -0,0 +1,170 @@
+"""
+Logging Pipeline
+
+Keeps log I/O off the event loop. `configure_logging()` installs a single
+queue handler on the root logger; a QueueListener thread formats the
+records and writes them to stderr, so a log call on the request path costs
+one record creation and a non-blocking put. When the queue is full
+(LOG_QUEUE_SIZE) records are dropped and counted instead of blocking.
+
+Messages are formatted lazily on the listener thread: log with %-style
+arguments (`logger.info("Route: %s", intent)`), not f-strings, and pass
+values that are not mutated afterwards.
+
+Output is one JSON object per line (LOG_FORMAT=json, the default) with the
+timestamp, level, logger, message, request id and any `extra=` fields, or
+`[LOGGER] message` lines with LOG_FORMAT=text.
+
+DEBUG lines of the application loggers (APP_LOGGERS) are dropped unless
+- the request enabled verbose logging (`verbose_scope(True)`, set by the
+  agent endpoint's `verbose` flag), or
+- they win the per-logger sample: LOG_DEBUG_SAMPLE_RATES, e.g.
+  "AI_AGENT=0.01,ROUTER=0.1" (unlisted loggers: LOG_DEBUG_SAMPLE_RATE).
+
+Usage:
+    configure_logging()
+    with verbose_scope(request.verbose):
+        logger.debug("Entities: %s", entities)
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from contextlib import contextmanager
+from datetime import datetime
+
+from metrics import Counter
+from tracing import current_request_id
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0"))
+LOG_DEBUG_SAMPLE_RATES = {
+    name.strip(): float(rate)
+    for name, _, rate in (item.partition("=") for item in os.getenv("LOG_DEBUG_SAMPLE_RATES", "").split(","))
+    if name.strip() and rate
+}
+
+# Loggers whose DEBUG lines can be switched on per request or sampled
+APP_LOGGERS = ("AI_AGENT", "ROUTER", "RESEARCH_CACHE", "MOCK_DATA")
+
+LOG_RECORDS_DROPPED = Counter("log_records_dropped_total", "Log records dropped by reason", ["reason"])
+
+# Attributes of every LogRecord; anything else on a record came from `extra=`
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+_verbose = contextvars.ContextVar("log_verbose", default=False)
+_handler = None
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["requestId"] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _RequestFilter(logging.Filter):
+    """Runs in the caller's thread: gates DEBUG lines and stamps the request id."""
+
+    def __init__(self, level: int):
+        super().__init__()
+        self.level = level
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < self.level and not _verbose.get():
+            rate = LOG_DEBUG_SAMPLE_RATES.get(record.name, LOG_DEBUG_SAMPLE_RATE)
+            if rate <= 0 or random.random() >= rate:
+                return False
+        record.request_id = current_request_id()
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stock handler formats here, in the caller's thread; the listener does it instead
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.labels("queue_full").inc()
+
+
+def configure_logging(stream=None) -> None:
+    """Route all logging through the queue; safe to call more than once."""
+    global _handler, _listener
+    if _listener is not None:
+        return
+    level = logging.getLevelName(LOG_LEVEL)
+    target = logging.StreamHandler(stream or sys.stderr)
+    target.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter("[%(name)s] %(message)s"))
+
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    _handler = _QueueHandler(log_queue)
+    _handler.addFilter(_RequestFilter(level))
+    _listener = logging.handlers.QueueListener(log_queue, target)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(_handler)
+    # Application loggers create DEBUG records so verbose requests and samples can keep them
+    for name in APP_LOGGERS:
+        logging.getLogger(name).setLevel(min(level, logging.DEBUG))
+
+
+def flush_logs() -> None:
+    """Block until the listener has written everything queued so far."""
+    if _listener is not None:
+        _listener.queue.join()
+
+
+def shutdown_logging() -> None:
+    global _handler, _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    logging.getLogger().removeHandler(_handler)
+    _handler = _listener = None
+
+
+def is_verbose() -> bool:
+    return _verbose.get()
+
+
+@contextmanager
+def verbose_scope(enabled: bool = True):
+    """Keep DEBUG lines of the application loggers for the current request."""
+    token = _verbose.set(enabled)
+    try:
+        yield
+    finally:
+        # Async generators may be closed from another context; the value then simply stays
+        try:
+            _verbose.reset(token)
+        except ValueError:
+            pass
@@ -1,14 +1,31 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
 from pydantic import BaseModel
+from typing import Optional
+from contextlib import asynccontextmanager
+import asyncio
 import os
 from generator import generate_research_stream
+from cancellation import cancel_on_disconnect
+from tracing import request_id_from
+from request_metrics import observe_stream
+from profiling import choose_mode, profile_stream
+from log_pipeline import configure_logging
+from session_store import session_store
+from llm_gateway import llm_gateway
 
 load_dotenv()
+configure_logging()
 
-app = FastAPI(title="Adecos MVP API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Blocking LLM calls from worker threads (crewAI) queue on this loop with the async ones
+    llm_gateway.limiter.bind_loop(asyncio.get_running_loop())
+    yield
+
+app = FastAPI(title="Adecos MVP API", lifespan=lifespan)
 
 # CORS
 app.add_middleware(
@@ -17,40 +34,117 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-Id", "X-Profile-Id", "X-Session-Id"],
 )
 
 class ResearchRequest(BaseModel):
     niche: str
 
 class ChatRequest(BaseModel):
-    messages: list
+    messages: list = []  # full history; not needed with `message` (server-side session)
+    message: Optional[str] = None  # the new user message of session `session_id`
+    session_id: Optional[str] = None  # created (and returned in X-Session-Id) when missing
+    timings: bool = False  # /api/agent/chat: add per-span timings to the response context
+    verbose: bool = False  # /api/agent/chat: keep this request's DEBUG log lines
+
+def user_id_for(http_request: Request) -> str:
+    """Identity used for fair queuing: X-User-Id header, else the client address."""
+    if http_request.headers.get("x-user-id"):
+        return http_request.headers["x-user-id"]
+    return http_request.client.host if http_request.client else "anonymous"
+
+def request_id_for(http_request: Request) -> str:
+    """Trace id for the request: a well-formed X-Request-Id header, else a new one."""
+    return request_id_from(http_request.headers.get("x-request-id"))
+
+def session_for(request: ChatRequest):
+    """(messages, session) of a chat request: a server-side session when it sends only `message`."""
+    if request.message is None:
+        return request.messages, None
+    session = session_store.get_or_create(request.session_id)
+    return [{"role": "user", "content": request.message}], session
+
+def response_headers(request_id: str, endpoint: str, profile, session) -> dict:
+    headers = {"X-Request-Id": request_id}
+    if profile:
+        headers["X-Profile-Id"] = f"{endpoint}-{request_id}"
+    if session is not None:
+        headers["X-Session-Id"] = session.session_id
+    return headers
+
+def profile_for(http_request: Request):
+    """Profiling mode requested (and authenticated) for this request, or a global sample."""
+    return choose_mode(
+        http_request.headers.get("x-profile") or http_request.query_params.get("profile"),
+        http_request.headers.get("x-profile-token") or http_request.query_params.get("profile_token"),
+    )
 
 @app.get("/")
 async def health_check():
     return {"status": "ok", "service": "Adecos MVP Backend"}
 
+@app.get("/api/stats")
+async def stats():
+    """In-process metrics snapshot (cache hit rates, counters, histograms)."""
+    import metrics
+    from research_cache import research_cache
+    from speculation import speculation_policy
+    from narrative_templates import narrative_policy
+    from llm_gateway import llm_gateway
+    from hedging import llm_hedger
+    from deadline import stage_report
+    from scheduler import request_scheduler
+    import cancellation
+    return {
+        "researchCache": research_cache.stats(),
+        "speculation": speculation_policy.stats(),
+        "narrative": narrative_policy.stats(),
+        "llmGateway": llm_gateway.stats(),
+        "hedging": llm_hedger.stats(),
+        "stages": stage_report(),
+        "scheduler": request_scheduler.stats(),
+        "cancelledWork": cancellation.stats(),
+        "sessions": session_store.stats(),
+        "metrics": metrics.snapshot()
+    }
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """All metrics in the Prometheus text exposition format."""
+    import metrics
+    import data_tools  # registers the tool and dataset metrics before the first agent request
+    return PlainTextResponse(metrics.exposition(), media_type=metrics.CONTENT_TYPE)
+
 @app.post("/api/research/stream")
-async def stream_research(request: ResearchRequest):
+async def stream_research(request: ResearchRequest, http_request: Request):
     return StreamingResponse(
-        generate_research_stream(request.niche),
+        observe_stream(
+            cancel_on_disconnect(generate_research_stream(request.niche, user_id_for(http_request)), "research"),
+            "research", intent="research"
+        ),
         media_type="application/x-ndjson"
     )
 
 @app.post("/api/chat/stream")
-async def stream_chat(request: ChatRequest):
+async def stream_chat(request: ChatRequest, http_request: Request):
     """
     LEGACY endpoint for conversational interface.
     Accepts history, routes intent, and streams back 'type: table' or 'type: text'.
     For the new AI Agent feature, use /api/agent/chat instead.
     """
     from generator import generate_chat_stream
+    request_id = request_id_for(http_request)
+    profile = profile_for(http_request)
+    messages, session = session_for(request)
+    stream = profile_stream(cancel_on_disconnect(generate_chat_stream(messages, session, user_id_for(http_request)), "chat"), "chat", request_id, profile)
     return StreamingResponse(
-        generate_chat_stream(request.messages),
-        media_type="application/x-ndjson"
+        observe_stream(stream, "chat"),
+        media_type="application/x-ndjson",
+        headers=response_headers(request_id, "chat", profile, session)
     )
 
 @app.post("/api/agent/chat")
-async def agent_chat(request: ChatRequest):
+async def agent_chat(request: ChatRequest, http_request: Request):
     """
     NEW AI Agent endpoint with crewAI-powered workflow.
     
@@ -65,11 +159,27 @@ async def agent_chat(request: ChatRequest):
     - chart: chart data with config
     - table: tabular data
     - text: plain text/markdown
+    
+    The request id (X-Request-Id, generated if absent) is echoed in the
+    response headers and tags the request's trace spans. With an
+    authenticated X-Profile header the request is profiled (see profiling.py)
+    and X-Profile-Id names its files in the profile spool.
+    
+    Clients may keep the conversation on the server: send `message` (and
+    the `session_id` returned in X-Session-Id) instead of the full `messages`.
     """
     from generator import generate_agent_stream
+    request_id = request_id_for(http_request)
+    profile = profile_for(http_request)
+    messages, session = session_for(request)
+    stream = generate_agent_stream(
+        messages, user_id_for(http_request), request_id, request.timings, request.verbose, session
+    )
+    stream = profile_stream(cancel_on_disconnect(stream, "agent"), "agent", request_id, profile)
     return StreamingResponse(
-        generate_agent_stream(request.messages),
-        media_type="application/x-ndjson"
+        observe_stream(stream, "agent"),
+        media_type="application/x-ndjson",
+        headers=response_headers(request_id, "agent", profile, session)
     )
 
 if __name__ == "__main__":
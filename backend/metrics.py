@@ -0,0 +1,255 @@
+"""
+Lightweight In-Process Metrics
+
+Counters, gauges and histograms for backend hot paths. Label children are
+resolved once and cached, so recording a sample is a dict lookup plus an
+addition.
+
+Each child guards its updates with its own uncontended lock: metrics are
+recorded from worker threads (blocking LLM calls, the log listener) as well
+as the event loop, and `+=` is not atomic across threads. Hot paths resolve
+their label children once at import time so no label tuples or strings are
+built per call. `exposition()` renders everything in the Prometheus text
+format for GET /metrics.
+
+Usage:
+    CACHE_LOOKUPS = Counter("research_cache_lookups_total", "Research cache lookups", ["result"])
+    CACHE_LOOKUPS.labels("exact_hit").inc()
+"""
+
+import bisect
+import threading
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._children_lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def labels(self, *values):
+        """Return the child for these label values (created once, then cached)."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            with self._children_lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _default(self):
+        return self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def children(self) -> list:
+        """[(label values, child)] for every label combination recorded so far."""
+        return list(self._children.items())
+
+    def samples(self) -> list:
+        return [
+            {"labels": dict(zip(self.labelnames, values)), **child.snapshot()}
+            for values, child in list(self._children.items())
+        ]
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self) -> dict:
+        return {"value": self.value}
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default().inc(amount)
+
+
+class _GaugeChild:
+    __slots__ = ("value", "function", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+        self._lock = threading.Lock()
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def set_function(self, function) -> None:
+        """Compute the value when metrics are read (ratios, ages) instead of on every change."""
+        self.function = function
+
+    def get(self) -> float:
+        if self.function is None:
+            return self.value
+        try:
+            return float(self.function())
+        except Exception:
+            return float("nan")
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value -= amount
+
+    def snapshot(self) -> dict:
+        return {"value": self.get()}
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float) -> None:
+        self._default().set(value)
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default().inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self._default().dec(amount)
+
+    def set_function(self, function) -> None:
+        self._default().set_function(function)
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[idx] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile by linear interpolation inside the bucket."""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for idx, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count > 0:
+                lower = self.buckets[idx - 1] if idx > 0 else 0.0
+                upper = self.buckets[idx] if idx < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * ((rank - seen) / bucket_count)
+            seen += bucket_count
+        return self.buckets[-1]
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "p50": round(self.quantile(0.50), 6),
+            "p95": round(self.quantile(0.95), 6),
+            "p99": round(self.quantile(0.99), 6),
+        }
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default().observe(value)
+
+
+def snapshot() -> dict:
+    """All registered metrics as a JSON-serializable dict."""
+    with _registry_lock:
+        metrics = list(_registry)
+    return {
+        metric.name: {"type": metric.kind, "help": metric.documentation, "samples": metric.samples()}
+        for metric in metrics
+    }
+
+
+def _format_value(value: float) -> str:
+    if value != value:
+        return "NaN"
+    if value in (float("inf"), float("-inf")):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def exposition() -> str:
+    """All registered metrics in the Prometheus text exposition format (0.0.4)."""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        help_text = metric.documentation.replace("\\", "\\\\").replace("\n", "\\n")
+        lines.append(f"# HELP {metric.name} {help_text}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for values, child in metric.children():
+            if metric.kind == "histogram":
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float("inf"),), list(child.counts)):
+                    cumulative += count
+                    le = 'le="' + _format_value(bound) + '"'
+                    lines.append(f"{metric.name}_bucket{_labels(metric.labelnames, values, le)} {cumulative}")
+                labels = _labels(metric.labelnames, values)
+                lines.append(f"{metric.name}_sum{labels} {_format_value(child.sum)}")
+                lines.append(f"{metric.name}_count{labels} {child.count}")
+            else:
+                value = child.get() if metric.kind == "gauge" else child.value
+                lines.append(f"{metric.name}{_labels(metric.labelnames, values)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
@@ -4,7 +4,6 @@ import json
 import logging
 
 # Configure logger
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("MOCK_DATA")
 
 # --- Constants & Lists ---
@@ -34,17 +33,19 @@ class MockDatabase:
         self.campaigns = []
         self.daily_data = [] # List of dicts
         self.generated_at = None
+        self.version = 0  # bumped on every (re)generation
 
     def generate_data(self, num_accounts=5, campaigns_per_account=8, days_history=90):
         """Generates a fresh set of mock data."""
-        logger.info(f"Generating mock data: {num_accounts} accounts, ~{campaigns_per_account} camps/acc, {days_history} days")
+        logger.info("Generating mock data: %d accounts, ~%d camps/acc, %d days", num_accounts, campaigns_per_account, days_history)
         
         self.accounts = self._generate_accounts(num_accounts)
         self.campaigns = self._generate_campaigns(self.accounts, campaigns_per_account)
         self.daily_data = self._generate_daily_data(self.campaigns, days_history)
         self.generated_at = datetime.now()
+        self.version += 1
         
-        logger.info(f"Done. Generated {len(self.campaigns)} campaigns and {len(self.daily_data)} daily records.")
+        logger.info("Done. Generated %d campaigns and %d daily records.", len(self.campaigns), len(self.daily_data))
 
     def _generate_accounts(self, count):
         accounts = []
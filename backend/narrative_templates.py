@@ -0,0 +1,326 @@
+"""
+Templated Narratives for Data Answers
+
+Builds the short Vietnamese narrative of a data_analysis answer locally from
+the query summary, period-over-period deltas and top movers, so simple or
+high-load turns complete in milliseconds without a Gemini call.
+
+Period-over-period deltas compare the requested range with the equally long
+range right before it (the `previousPeriod` returned by QueryAdsCampaignsTool
+with `compare_previous`); top movers compare the two halves of the range.
+
+Modes (NARRATIVE_MODE):
+- llm:      always ask Gemini
+- template: always use the templates
+- auto:     templates for single-metric lookups ("Chi phí tháng 11"), or
+            whenever NARRATIVE_MAX_LLM_INFLIGHT LLM narratives are already
+            being generated
+
+Templates are always used while the LLM gateway circuit breaker rejects calls.
+"""
+
+import os
+import re
+import threading
+import zlib
+from contextlib import contextmanager
+
+from llm_gateway import llm_gateway
+from metrics import Counter, Gauge
+
+NARRATIVE_MODE = os.getenv("NARRATIVE_MODE", "auto").lower()
+NARRATIVE_MAX_LLM_INFLIGHT = int(os.getenv("NARRATIVE_MAX_LLM_INFLIGHT", "8"))
+
+NARRATIVES = Counter("narrative_total", "Data-answer narratives by generator", ["mode"])
+NARRATIVE_LLM_INFLIGHT = Gauge("narrative_llm_inflight", "LLM narratives currently being generated")
+
+# Queries asking for reasoning or open-ended judgement still go to the LLM
+COMPLEX_HINTS = (
+    "tại sao", "vì sao", "giải thích", "nhận xét", "đánh giá", "đề xuất", "gợi ý", "nên",
+    "nguyên nhân", "why", "explain", "recommend", "should",
+)
+# Comparisons and breakdowns need more than one number, so they are not simple lookups
+COMPARISON_HINTS = (
+    "so sánh", "theo", "từng", "mỗi", "xu hướng", "top", "vs", "compare", "by", "per", "breakdown", "trend",
+)
+MAX_SIMPLE_QUERY_WORDS = 8
+
+# Changes smaller than this are reported as flat
+FLAT_THRESHOLD = 0.02
+
+METRIC_LABELS = {
+    "cost": "Chi phí",
+    "revenue": "Doanh thu",
+    "clicks": "Lượt click",
+    "impressions": "Lượt hiển thị",
+    "conversions": "Chuyển đổi",
+    "cpc": "CPC",
+    "ctr": "CTR",
+    "roas": "ROAS",
+    "cpa": "CPA",
+}
+
+METRIC_KEYWORDS = {
+    "cost": ("chi phí", "chi tiêu", "cost", "spend"),
+    "revenue": ("doanh thu", "revenue"),
+    "clicks": ("click",),
+    "impressions": ("hiển thị", "impression"),
+    "conversions": ("chuyển đổi", "conversion"),
+    "cpc": ("cpc",),
+    "ctr": ("ctr",),
+    "roas": ("roas",),
+    "cpa": ("cpa",),
+}
+
+DEFAULT_FOCUS = ["cost", "revenue"]
+
+TEMPLATES = {
+    "overview": [
+        "Trong {time_range}, bạn đã chi **{cost}** cho {clicks} lượt click và thu về **{revenue}** doanh thu (ROAS {roas}).",
+        "Tổng kết {time_range}: chi phí **{cost}**, doanh thu **{revenue}**, {clicks} lượt click, ROAS đạt {roas}.",
+    ],
+    "metric_up": "{label} tăng **{change}** so với kỳ trước ({previous} → {current}).",
+    "metric_down": "{label} giảm **{change}** so với kỳ trước ({previous} → {current}).",
+    "metric_flat": "{label} gần như không đổi so với kỳ trước ({current}).",
+    "mover_up": "Biến động lớn nhất đến từ **{name}**: {label} tăng {change}.",
+    "mover_down": "Biến động lớn nhất đến từ **{name}**: {label} giảm {change}.",
+    "top_share": "**{name}** dẫn đầu với {share} tổng {label_lower}.",
+    "roas_strong": "Hiệu quả đang tốt: mỗi 1 ₫ chi phí mang về {roas} ₫ doanh thu.",
+    "roas_weak": "ROAS dưới 1 — chi phí đang vượt doanh thu, nên rà soát các chiến dịch kém hiệu quả.",
+    "no_data": "Không có dữ liệu quảng cáo nào trong {time_range} với bộ lọc hiện tại.",
+}
+
+ISO_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+ADDITIVE = ("clicks", "impressions", "cost", "conversions", "revenue")
+SUMMARY_KEYS = {
+    "clicks": "totalClicks",
+    "impressions": "totalImpressions",
+    "cost": "totalCost",
+    "conversions": "totalConversions",
+    "revenue": "totalRevenue",
+}
+
+
+def format_number(value: float) -> str:
+    return f"{value:,.0f}".replace(",", ".")
+
+
+def format_metric(metric: str, value: float) -> str:
+    if metric in ("cost", "revenue", "cpc", "cpa"):
+        return f"{format_number(value)} ₫"
+    if metric == "ctr":
+        return f"{value:.2f}%"
+    if metric == "roas":
+        return f"{value:.2f}"
+    return format_number(value)
+
+
+def format_change(change: float) -> str:
+    return f"{abs(change) * 100:.0f}%"
+
+
+def _summary_totals(summary: dict) -> dict:
+    totals = {metric: summary.get(key, 0) for metric, key in SUMMARY_KEYS.items()}
+    totals["cpc"] = totals["cost"] / totals["clicks"] if totals["clicks"] else 0
+    totals["ctr"] = totals["clicks"] / totals["impressions"] * 100 if totals["impressions"] else 0
+    totals["roas"] = totals["revenue"] / totals["cost"] if totals["cost"] else 0
+    totals["cpa"] = totals["cost"] / totals["conversions"] if totals["conversions"] else 0
+    return totals
+
+
+def _change(previous: float, current: float):
+    return (current - previous) / previous if previous else None
+
+
+def mentioned_metrics(query: str) -> list:
+    """Metrics named in the query, in the order they are mentioned."""
+    query_lower = query.lower()
+    found = []
+    for metric, keywords in METRIC_KEYWORDS.items():
+        positions = [query_lower.find(k) for k in keywords if k in query_lower]
+        if positions:
+            found.append((min(positions), metric))
+    return [metric for _, metric in sorted(found)]
+
+
+def focus_metrics(query: str) -> list:
+    """Metrics the user is asking about (cost and revenue when none is named)."""
+    return mentioned_metrics(query) or list(DEFAULT_FOCUS)
+
+
+def period_deltas(data: dict) -> dict:
+    """Compare a QueryAdsCampaignsTool result with its previous period.
+
+    Returns {metric: {"previous", "current", "change"}} (change is a ratio,
+    None when the previous value is zero), or {} when the result has no
+    `previousPeriod`.
+    """
+    previous_period = data.get("previousPeriod")
+    if not previous_period or not data.get("summary"):
+        return {}
+    previous = _summary_totals(previous_period["summary"])
+    current = _summary_totals(data["summary"])
+    return {
+        metric: {"previous": previous[metric], "current": current[metric], "change": _change(previous[metric], current[metric])}
+        for metric in previous
+    }
+
+
+def top_movers(rows: list, metric: str = "cost", limit: int = 1) -> list:
+    """Entities (breakdown data) with the largest absolute change of `metric`
+    between the two halves of the period."""
+    dates = sorted({row["date"] for row in rows if "entity" in row})
+    if len(dates) < 2:
+        return []
+    half = len(dates) // 2
+    earlier, later = set(dates[:half]), set(dates[-half:])
+    by_entity = {}
+    for row in rows:
+        if "entity" not in row:
+            continue
+        previous, current = by_entity.get(row["entity"], (0, 0))
+        if row["date"] in earlier:
+            previous += row.get(metric, 0)
+        if row["date"] in later:
+            current += row.get(metric, 0)
+        by_entity[row["entity"]] = (previous, current)
+    movers = [
+        {"name": name, "previous": previous, "current": current, "change": _change(previous, current)}
+        for name, (previous, current) in by_entity.items()
+        if previous != current
+    ]
+    movers.sort(key=lambda m: abs(m["current"] - m["previous"]), reverse=True)
+    return movers[:limit]
+
+
+def top_share(rows: list, metric: str = "cost") -> dict:
+    """Largest group (account/campaign grouping) and its share of `metric`."""
+    total = sum(row.get(metric, 0) for row in rows)
+    if not rows or not total:
+        return {}
+    top = max(rows, key=lambda row: row.get(metric, 0))
+    return {"name": top.get("date"), "share": top.get(metric, 0) / total}
+
+
+def _additive_focus(focus: list) -> str:
+    return next((metric for metric in focus if metric in ADDITIVE), "cost")
+
+
+def build_narrative(query: str, data: dict, time_range: str) -> str:
+    """2-3 Vietnamese sentences describing a QueryAdsCampaignsTool result."""
+    rows = data.get("data") or []
+    summary = data.get("summary") or {}
+    if not rows or not summary.get("totalImpressions"):
+        return TEMPLATES["no_data"].format(time_range=time_range)
+
+    overview_variants = TEMPLATES["overview"]
+    overview = overview_variants[zlib.crc32(query.encode("utf-8")) % len(overview_variants)]
+    sentences = [overview.format(
+        time_range=time_range,
+        cost=format_metric("cost", summary.get("totalCost", 0)),
+        revenue=format_metric("revenue", summary.get("totalRevenue", 0)),
+        clicks=format_number(summary.get("totalClicks", 0)),
+        roas=format_metric("roas", summary.get("avgROAS", 0)),
+    )]
+
+    focus = focus_metrics(query)
+    deltas = period_deltas(data)
+    for metric in focus[:2]:
+        delta = deltas.get(metric)
+        if not delta or delta["change"] is None:
+            continue
+        change = delta["change"]
+        key = "metric_flat" if abs(change) < FLAT_THRESHOLD else ("metric_up" if change > 0 else "metric_down")
+        sentences.append(TEMPLATES[key].format(
+            label=METRIC_LABELS[metric],
+            change=format_change(change),
+            previous=format_metric(metric, delta["previous"]),
+            current=format_metric(metric, delta["current"]),
+        ))
+
+    mover_metric = _additive_focus(focus)
+    if data.get("is_granular"):
+        for mover in top_movers(rows, mover_metric):
+            if mover["change"] is not None:
+                key = "mover_up" if mover["change"] > 0 else "mover_down"
+                sentences.append(TEMPLATES[key].format(
+                    name=mover["name"], label=METRIC_LABELS[mover_metric].lower(), change=format_change(mover["change"])
+                ))
+    elif not any(ISO_DATE.match(str(row.get("date", ""))) for row in rows):
+        share = top_share(rows, mover_metric)
+        if share:
+            sentences.append(TEMPLATES["top_share"].format(
+                name=share["name"], share=f"{share['share'] * 100:.0f}%", label_lower=METRIC_LABELS[mover_metric].lower()
+            ))
+
+    roas = summary.get("avgROAS", 0)
+    if len(sentences) < 3 and summary.get("totalCost"):
+        if roas >= 2:
+            sentences.append(TEMPLATES["roas_strong"].format(roas=format_metric("roas", roas)))
+        elif roas < 1:
+            sentences.append(TEMPLATES["roas_weak"])
+
+    return " ".join(sentences[:3])
+
+
+def is_simple_query(query: str) -> bool:
+    """A short lookup of one metric, with no reasoning, comparison or breakdown asked for."""
+    query_lower = query.lower()
+    if any(hint in query_lower for hint in COMPLEX_HINTS):
+        return False
+    words = re.findall(r"\w+", query_lower)
+    if any(re.search(rf"\b{re.escape(hint)}\b", query_lower) for hint in COMPARISON_HINTS):
+        return False
+    return len(mentioned_metrics(query)) == 1 and len(words) <= MAX_SIMPLE_QUERY_WORDS
+
+
+class NarrativePolicy:
+    """Chooses between the LLM and the templates for each data answer."""
+
+    def __init__(self, mode: str = NARRATIVE_MODE, max_llm_inflight: int = NARRATIVE_MAX_LLM_INFLIGHT):
+        self.mode = mode
+        self.max_llm_inflight = max_llm_inflight
+        self._inflight = 0
+        self._lock = threading.Lock()
+
+    def choose(self, query: str) -> str:
+        """Return "llm" or "template"."""
+        if llm_gateway.would_reject():
+            return "template"
+        if self.mode in ("llm", "template"):
+            return self.mode
+        if is_simple_query(query):
+            return "template"
+        with self._lock:
+            overloaded = self._inflight >= self.max_llm_inflight
+        return "template" if overloaded else "llm"
+
+    @contextmanager
+    def track_llm(self):
+        """Count an LLM narrative as in flight while the block runs."""
+        with self._lock:
+            self._inflight += 1
+            NARRATIVE_LLM_INFLIGHT.set(self._inflight)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._inflight -= 1
+                NARRATIVE_LLM_INFLIGHT.set(self._inflight)
+
+    def record(self, mode: str) -> None:
+        NARRATIVES.labels(mode).inc()
+
+    def stats(self) -> dict:
+        llm = NARRATIVES.labels("llm").value
+        template = NARRATIVES.labels("template").value
+        total = llm + template
+        return {
+            "mode": self.mode,
+            "llmInflight": self._inflight,
+            "narratives": int(total),
+            "templateShare": round(template / total, 4) if total else 0.0,
+        }
+
+
+narrative_policy = NarrativePolicy()
@@ -0,0 +1,175 @@
+"""
+Approximate Niche Matching
+
+Maps the many ways users phrase a niche ("crypto", "tiền điện tử",
+"sàn crypto", "Crypto programs", "tien dien tu") onto niches that were
+already answered, without any external embedding service.
+
+- Text is diacritic-folded, Vietnamese aliases are mapped to a canonical
+  term and filler words ("sàn", "programs", ...) are dropped
+- Each niche becomes a character trigram count vector
+- Nearest neighbors are found by cosine similarity over candidates that
+  share at least one trigram (inverted index)
+- A match also needs every word on either side to have a counterpart on
+  the other (NICHE_TOKEN_THRESHOLD, which still tolerates typos), so a
+  narrower niche ("beauty for men") does not match a broader one ("beauty")
+"""
+
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter as TermCounter
+from typing import Optional
+
+NICHE_MATCH_THRESHOLD = float(os.getenv("NICHE_MATCH_THRESHOLD", "0.75"))
+# Trigram similarity for two words to count as the same word ("cryto" ~ "crypto")
+NICHE_TOKEN_THRESHOLD = float(os.getenv("NICHE_TOKEN_THRESHOLD", "0.5"))
+NGRAM_SIZE = 3
+
+# Folded Vietnamese/English phrases -> canonical niche term (longest match first)
+NICHE_ALIASES = {
+    "tien dien tu": "crypto",
+    "tien ma hoa": "crypto",
+    "tien ao": "crypto",
+    "cryptocurrency": "crypto",
+    "bitcoin": "crypto",
+    "ngoai hoi": "forex",
+    "giao dich ngoai te": "forex",
+    "my pham": "beauty",
+    "lam dep": "beauty",
+    "skincare": "beauty",
+    "thoi trang": "fashion",
+    "du lich": "travel",
+    "thuong mai dien tu": "ecommerce",
+    "e-commerce": "ecommerce",
+    "e commerce": "ecommerce",
+    "mua sam": "ecommerce",
+    "tai chinh": "finance",
+    "dau tu": "finance",
+    "tro choi": "gaming",
+    "game": "gaming",
+    "cong nghe": "tech",
+    "hosting": "tech",
+    "suc khoe": "health",
+    "giao duc": "education",
+    "khoa hoc": "education",
+}
+
+# Filler words that do not change the niche
+NICHE_STOPWORDS = {
+    "san", "program", "programs", "chuong", "trinh", "affiliate", "affiliates",
+    "tiep", "thi", "lien", "ket", "nganh", "ngach", "linh", "vuc", "niche",
+    "tim", "cac", "ve", "cho", "toi", "find", "the", "in", "for", "best", "top",
+}
+
+_ALIAS_PATTERNS = [
+    (re.compile(rf"\b{re.escape(phrase)}\b"), canonical)
+    for phrase, canonical in sorted(NICHE_ALIASES.items(), key=lambda item: -len(item[0]))
+]
+
+
+def fold_diacritics(text: str) -> str:
+    """Lowercase and strip Vietnamese diacritics ("Tiền điện tử" -> "tien dien tu")."""
+    text = (text or "").lower().replace("đ", "d")
+    decomposed = unicodedata.normalize("NFD", text)
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def canonicalize_niche(niche: str) -> str:
+    """Fold, apply aliases and drop filler words."""
+    text = fold_diacritics(niche)
+    text = re.sub(r"[^a-z0-9\- ]+", " ", text)
+    for pattern, canonical in _ALIAS_PATTERNS:
+        text = pattern.sub(canonical, text)
+    words = [word for word in text.split() if word not in NICHE_STOPWORDS]
+    # Repeated canonical terms ("sàn crypto bitcoin") collapse to one
+    deduped = list(dict.fromkeys(words))
+    return " ".join(deduped) or fold_diacritics(niche).strip()
+
+
+def ngram_vector(text: str, n: int = NGRAM_SIZE) -> TermCounter:
+    padded = f" {text} "
+    if len(padded) < n:
+        return TermCounter([padded])
+    return TermCounter(padded[i:i + n] for i in range(len(padded) - n + 1))
+
+
+def _norm(vector: TermCounter) -> float:
+    return math.sqrt(sum(count * count for count in vector.values()))
+
+
+def _cosine(a: TermCounter, b: TermCounter) -> float:
+    norms = _norm(a) * _norm(b)
+    return sum(count * b.get(gram, 0) for gram, count in a.items()) / norms if norms else 0.0
+
+
+def tokens_match(a: str, b: str, threshold: float = NICHE_TOKEN_THRESHOLD) -> bool:
+    """Whether every word of each canonical niche has a similar word in the other."""
+    a_words = [ngram_vector(word) for word in a.split()]
+    b_words = [ngram_vector(word) for word in b.split()]
+
+    def covered(words: list, others: list) -> bool:
+        return all(any(_cosine(word, other) >= threshold for other in others) for word in words)
+
+    return covered(a_words, b_words) and covered(b_words, a_words)
+
+
+class NicheIndex:
+    """In-memory nearest-neighbor index over canonicalized niche keys."""
+
+    def __init__(self, threshold: float = NICHE_MATCH_THRESHOLD):
+        self.threshold = threshold
+        self._vectors = {}   # key -> (vector, norm, canonical niche)
+        self._postings = {}  # ngram -> set(keys)
+        self._lock = threading.Lock()
+
+    def add(self, key: str) -> None:
+        canonical = canonicalize_niche(key)
+        vector = ngram_vector(canonical)
+        with self._lock:
+            if key in self._vectors:
+                return
+            self._vectors[key] = (vector, _norm(vector), canonical)
+            for gram in vector:
+                self._postings.setdefault(gram, set()).add(key)
+
+    def remove(self, key: str) -> None:
+        with self._lock:
+            entry = self._vectors.pop(key, None)
+            if entry is None:
+                return
+            for gram in entry[0]:
+                keys = self._postings.get(gram)
+                if keys:
+                    keys.discard(key)
+                    if not keys:
+                        del self._postings[gram]
+
+    def nearest(self, niche: str) -> Optional[tuple]:
+        """Return (key, similarity) for the closest indexed niche above the threshold."""
+        canonical = canonicalize_niche(niche)
+        query = ngram_vector(canonical)
+        query_norm = _norm(query)
+        if query_norm == 0:
+            return None
+
+        best_key, best_score = None, 0.0
+        with self._lock:
+            candidates = set()
+            for gram in query:
+                candidates.update(self._postings.get(gram, ()))
+            for key in candidates:
+                vector, norm, key_canonical = self._vectors[key]
+                dot = sum(count * vector.get(gram, 0) for gram, count in query.items())
+                score = dot / (query_norm * norm) if norm else 0.0
+                if score > best_score and tokens_match(canonical, key_canonical):
+                    best_key, best_score = key, score
+
+        if best_key is None or best_score < self.threshold:
+            return None
+        return best_key, best_score
+
+    def __len__(self) -> int:
+        return len(self._vectors)
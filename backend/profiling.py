@@ -0,0 +1,356 @@
+"""
+Per-Request Profiling
+
+Profiles a single /api/agent/chat or /api/chat/stream request on demand, so
+a query that is slow in production can be inspected where it is slow.
+
+A request is profiled when it carries `X-Profile: sampling|cprofile` (or
+`?profile=`) together with `X-Profile-Token` (or `?profile_token=`) equal to
+PROFILE_TOKEN; without PROFILE_TOKEN on-demand profiling is off. Independently,
+PROFILE_SAMPLE_RATE profiles that share of all requests in sampling mode, for
+continuous profiles of the real traffic mix.
+
+Modes:
+- sampling: one background thread samples stacks every PROFILE_INTERVAL_MS
+  (the interpreter switch interval is lowered to match while it runs).
+  Event-loop samples count for a request only while one of its own tasks
+  (or its response stream) is running; worker-thread samples count while
+  the thread is inside a traced span of the request (see tracing.py).
+- cprofile: exact call counts, but cProfile sees the whole event-loop
+  thread, so concurrent requests show up too (use on a quiet instance).
+  Only one cProfile runs at a time; other requests fall back to sampling.
+
+Each profile is written to PROFILE_DIR as `<name>.pstats` (load with
+`python -m pstats`, snakeviz...) and `<name>.folded` (collapsed stacks for
+flamegraph.pl / speedscope). The spool keeps at most PROFILE_SPOOL_MAX_FILES
+profiles and PROFILE_SPOOL_MAX_MB megabytes, oldest evicted first.
+
+Usage:
+    choice = choose_mode(request_header_mode, request_header_token)
+    stream = profile_stream(stream, "agent", request_id, choice)
+"""
+
+import asyncio
+import contextvars
+import cProfile
+import hmac
+import marshal
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter as TallyCounter
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Optional
+
+from metrics import Counter
+
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv(
+    "PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "profiles")
+)
+PROFILE_SPOOL_MAX_FILES = int(os.getenv("PROFILE_SPOOL_MAX_FILES", "100"))
+PROFILE_SPOOL_MAX_MB = float(os.getenv("PROFILE_SPOOL_MAX_MB", "200"))
+
+MODES = ("sampling", "cprofile")
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+PROFILES = Counter("profiles_total", "Profiled requests by mode and reason", ["mode", "reason"])
+PROFILE_REJECTED = Counter("profile_requests_rejected_total", "Profile requests refused by reason", ["reason"])
+SPOOL_EVICTIONS = Counter("profile_spool_evictions_total", "Profiles removed to keep the spool bounded")
+
+_profile = contextvars.ContextVar("profile", default=None)
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="profile-writer")
+_cprofile_lock = threading.Lock()
+
+
+def choose_mode(requested: Optional[str], token: Optional[str]) -> Optional[tuple]:
+    """(mode, reason) for a request, or None when it is not profiled."""
+    if requested:
+        mode = "sampling" if requested in ("1", "true") else requested
+        if mode not in MODES:
+            PROFILE_REJECTED.labels("unknown_mode").inc()
+        elif not PROFILE_TOKEN or not hmac.compare_digest((token or "").encode(), PROFILE_TOKEN.encode()):
+            PROFILE_REJECTED.labels("unauthorized").inc()
+        else:
+            return mode, "requested"
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return "sampling", "sampled"
+    return None
+
+
+def _label(key: tuple) -> str:
+    filename, line, name = key
+    if filename.startswith(BACKEND_DIR):
+        filename = os.path.relpath(filename, BACKEND_DIR)
+    else:
+        filename = os.path.basename(filename)
+    return f"{name} ({filename}:{line})"
+
+
+def _stack(frame) -> tuple:
+    """Function keys from the outermost frame to `frame`."""
+    keys = []
+    while frame is not None:
+        code = frame.f_code
+        keys.append((code.co_filename, code.co_firstlineno, code.co_name))
+        frame = frame.f_back
+    keys.reverse()
+    return tuple(keys)
+
+
+class Profile:
+    """Samples (or cProfile data) collected for one request."""
+
+    def __init__(self, name: str, mode: str):
+        self.name = name
+        self.mode = mode
+        self.loop_thread = threading.get_ident()
+        self.roots = set()  # frames of the request's tasks and response stream
+        self.threads = {}  # worker thread id -> nesting depth
+        self.stacks = TallyCounter()
+        self.lock = threading.Lock()
+        self.profiler = None
+        self.closed = False
+
+    def owns(self, frame) -> bool:
+        while frame is not None:
+            if frame in self.roots:
+                return True
+            frame = frame.f_back
+        return False
+
+    def sample(self, frames: dict) -> None:
+        stacks = []
+        loop_frame = frames.get(self.loop_thread)
+        if loop_frame is not None and self.owns(loop_frame):
+            stacks.append(_stack(loop_frame))
+        with self.lock:
+            threads = list(self.threads)
+        stacks.extend(_stack(frames[ident]) for ident in threads if ident in frames)
+        with self.lock:
+            if not self.closed:
+                self.stacks.update(stacks)
+
+    def close(self) -> None:
+        with self.lock:
+            self.closed = True
+        self.roots.clear()
+
+    def pstats(self) -> dict:
+        """Sampled stacks in the marshalled pstats layout: {func: (cc, nc, tt, ct, callers)}."""
+        interval = PROFILE_INTERVAL_MS / 1000
+        stats = {}
+        for stack, count in self.stacks.items():
+            seconds = count * interval
+            seen = set()
+            for depth, key in enumerate(stack):
+                cc, nc, tt, ct, callers = stats.get(key, (0, 0, 0.0, 0.0, {}))
+                leaf = depth == len(stack) - 1
+                if key not in seen:  # recursion counts once towards inclusive time
+                    ct += seconds
+                    seen.add(key)
+                if leaf:
+                    tt += seconds
+                cc += count
+                nc += count
+                if depth > 0:
+                    caller = stack[depth - 1]
+                    c_cc, c_nc, c_tt, c_ct = callers.get(caller, (0, 0, 0.0, 0.0))
+                    callers[caller] = (c_cc + count, c_nc + count, c_tt + (seconds if leaf else 0.0), c_ct + seconds)
+                stats[key] = (cc, nc, tt, ct, callers)
+        return stats
+
+    def folded(self) -> str:
+        return "".join(f"{';'.join(_label(k) for k in stack)} {count}\n" for stack, count in self.stacks.items())
+
+    def cprofile_folded(self, stats: dict) -> str:
+        """Approximate collapsed stacks from cProfile data: self time along the heaviest caller chain."""
+        lines = []
+        for key, (_, _, tt, _, callers) in stats.items():
+            weight = int(tt * 1_000_000)  # microseconds
+            if weight <= 0:
+                continue
+            chain = [key]
+            while callers:
+                caller = max(callers, key=lambda c: callers[c][3])
+                if caller in chain:
+                    break
+                chain.append(caller)
+                callers = stats.get(caller, (0, 0, 0.0, 0.0, {}))[4]
+            lines.append(f"{';'.join(_label(k) for k in reversed(chain))} {weight}\n")
+        return "".join(lines)
+
+    def save(self) -> None:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base = os.path.join(PROFILE_DIR, self.name)
+        if self.profiler is not None:
+            self.profiler.create_stats()
+            stats = self.profiler.stats
+            folded = self.cprofile_folded(stats)
+        else:
+            stats = self.pstats()
+            folded = self.folded()
+        with open(base + ".pstats", "wb") as f:
+            marshal.dump(stats, f)
+        with open(base + ".folded", "w", encoding="utf-8") as f:
+            f.write(folded)
+        _evict()
+
+
+def _evict() -> None:
+    """Drop the oldest profiles until the spool is within its file and size limits."""
+    profiles = {}
+    for entry in os.scandir(PROFILE_DIR):
+        stem, ext = os.path.splitext(entry.name)
+        if ext in (".pstats", ".folded"):
+            stat = entry.stat()
+            mtime, size = profiles.get(stem, (stat.st_mtime, 0))
+            profiles[stem] = (min(mtime, stat.st_mtime), size + stat.st_size)
+    oldest_first = sorted(profiles, key=lambda stem: profiles[stem][0])
+    total = sum(size for _, size in profiles.values())
+    max_bytes = PROFILE_SPOOL_MAX_MB * 1024 * 1024
+    while oldest_first and (len(oldest_first) > PROFILE_SPOOL_MAX_FILES or total > max_bytes):
+        stem = oldest_first.pop(0)
+        total -= profiles[stem][1]
+        for ext in (".pstats", ".folded"):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, stem + ext))
+            except FileNotFoundError:
+                pass
+        SPOOL_EVICTIONS.inc()
+
+
+class _Sampler:
+    """One thread sampling stacks for every active sampling profile."""
+
+    def __init__(self):
+        self._active = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, profile: Profile) -> None:
+        with self._lock:
+            self._active.add(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+                self._thread.start()
+
+    def remove(self, profile: Profile) -> None:
+        with self._lock:
+            self._active.discard(profile)
+
+    def _run(self) -> None:
+        interval = PROFILE_INTERVAL_MS / 1000
+        me = threading.get_ident()
+        # The sampler only runs when it gets the GIL; a shorter switch interval keeps
+        # CPU-bound code from holding it across whole sampling periods
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(switch_interval, interval))
+        while True:
+            with self._lock:
+                active = list(self._active)
+                if not active:
+                    self._thread = None
+                    sys.setswitchinterval(switch_interval)
+                    return
+            frames = {ident: frame for ident, frame in sys._current_frames().items() if ident != me}
+            for profile in active:
+                profile.sample(frames)
+            del frames
+            # Jitter keeps the samples from locking onto periodic work (e.g. event-loop ticks)
+            time.sleep(interval * random.uniform(0.5, 1.5))
+
+
+sampler = _Sampler()
+
+
+def _task_factory(previous):
+    """Wrap the loop's task factory so tasks created by a profiled request are attributed to it."""
+    def factory(loop, coro, **kwargs):
+        task = previous(loop, coro, **kwargs) if previous else asyncio.Task(coro, loop=loop, **kwargs)
+        context = kwargs.get("context")
+        profile = context.get(_profile) if context is not None else _profile.get()
+        if profile is not None and getattr(coro, "cr_frame", None) is not None:
+            profile.roots.add(coro.cr_frame)
+        return task
+    factory.profiling = True
+    return factory
+
+
+def _install_task_factory() -> None:
+    loop = asyncio.get_running_loop()
+    current = loop.get_task_factory()
+    if not getattr(current, "profiling", False):
+        loop.set_task_factory(_task_factory(current))
+
+
+def enter_thread():
+    """Attribute the calling worker thread to the request's sampling profile; returns a token for exit_thread."""
+    profile = _profile.get()
+    if profile is None:
+        return None
+    ident = threading.get_ident()
+    if ident == profile.loop_thread:
+        return None
+    with profile.lock:
+        profile.threads[ident] = profile.threads.get(ident, 0) + 1
+    return profile, ident
+
+
+def exit_thread(token) -> None:
+    if token is None:
+        return
+    profile, ident = token
+    with profile.lock:
+        depth = profile.threads.get(ident, 0) - 1
+        if depth > 0:
+            profile.threads[ident] = depth
+        else:
+            profile.threads.pop(ident, None)
+
+
+async def profile_stream(
+    stream: AsyncIterator[str], endpoint: str, request_id: str, choice: Optional[tuple]
+) -> AsyncIterator[str]:
+    """Profile the work behind a response stream when `choice` (from choose_mode) asks for it."""
+    if choice is None:
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
+        return
+
+    mode, reason = choice
+    if mode == "cprofile" and not _cprofile_lock.acquire(blocking=False):
+        mode = "sampling"
+    # Spool file names never contain path separators or unbounded client input
+    safe_id = re.sub(r"[^A-Za-z0-9_-]", "_", request_id)[:64]
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{endpoint}-{safe_id}-{mode}"
+    profile = Profile(name, mode)
+    _profile.set(profile)
+    PROFILES.labels(mode, reason).inc()
+    if mode == "cprofile":
+        profile.profiler = cProfile.Profile()
+        profile.profiler.enable()
+    else:
+        _install_task_factory()
+        profile.roots.add(sys._getframe())
+        sampler.add(profile)
+    try:
+        async for chunk in stream:
+            yield chunk
+    finally:
+        if profile.profiler is not None:
+            profile.profiler.disable()
+            _cprofile_lock.release()
+        else:
+            sampler.remove(profile)
+        profile.close()
+        _writer.submit(profile.save)
+        await stream.aclose()
@@ -0,0 +1,154 @@
+"""
+Ads Query Plans and Slow-Query Log
+
+A QueryPlan follows one QueryAdsCampaignsTool query: the resolved date
+range, each campaign filter with the campaigns it kept, rows scanned vs.
+returned and the time spent per phase. It backs the tool's `explain`
+option and the slow-query log.
+
+Queries slower than SLOW_QUERY_SECONDS are appended to SLOW_QUERY_LOG_PATH
+(rotated at SLOW_QUERY_LOG_MAX_BYTES, SLOW_QUERY_LOG_BACKUPS files kept) as
+JSON lines keyed by a normalized `shape` - grouping, breakdown, which
+filters were used and the date span, without the filter values - so the
+worst shapes can be found by counting lines per shape.
+
+Usage:
+    plan = QueryPlan(params)
+    start_date, end_date = parse_date_range(...)
+    plan.mark("parseDateRange")
+    ...
+    response["explain"] = plan.explain(start_date, end_date, len(db.daily_data), len(result))
+    plan.log_if_slow(start_date, end_date, len(result))
+"""
+
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+from datetime import datetime
+
+from metrics import Counter
+
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_SECONDS", "0.5"))
+SLOW_QUERY_LOG_PATH = os.getenv(
+    "SLOW_QUERY_LOG_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "slow_queries.log")
+)
+SLOW_QUERY_LOG_MAX_BYTES = int(os.getenv("SLOW_QUERY_LOG_MAX_BYTES", str(5 * 1024 * 1024)))
+SLOW_QUERY_LOG_BACKUPS = int(os.getenv("SLOW_QUERY_LOG_BACKUPS", "3"))
+
+FILTERS = ("account_ids", "campaign_ids", "program", "keywords")
+
+SLOW_QUERIES = Counter("ads_slow_queries_total", "Ads queries above SLOW_QUERY_SECONDS by group_by", ["group_by"])
+
+_slow_log = None
+_slow_log_lock = threading.Lock()
+
+
+def _slow_query_logger() -> logging.Logger:
+    """The rotating slow-query logger, created on first use."""
+    global _slow_log
+    with _slow_log_lock:
+        if _slow_log is None:
+            os.makedirs(os.path.dirname(os.path.abspath(SLOW_QUERY_LOG_PATH)), exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                SLOW_QUERY_LOG_PATH, maxBytes=SLOW_QUERY_LOG_MAX_BYTES, backupCount=SLOW_QUERY_LOG_BACKUPS,
+                encoding="utf-8",
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger = logging.getLogger("SLOW_QUERY")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.addHandler(handler)
+            _slow_log = logger
+    return _slow_log
+
+
+def normalize_query_spec(params: dict, start_date: str, end_date: str) -> dict:
+    """The shape of a query: what was asked for, not for which accounts or keywords."""
+    span_days = (datetime.strptime(end_date, "%Y-%m-%d") - datetime.strptime(start_date, "%Y-%m-%d")).days + 1
+    filters = {}
+    for name in FILTERS:
+        value = params.get(name)
+        if value:
+            filters[name] = len(value) if isinstance(value, list) else 1
+    spec = {
+        "groupBy": params.get("group_by", "day"),
+        "breakdown": params.get("breakdown"),
+        "filters": filters,
+        "spanDays": span_days,
+    }
+    spec["shape"] = (
+        f"group_by={spec['groupBy']} breakdown={spec['breakdown'] or 'none'} "
+        f"filters={','.join(filters) or 'none'} span={span_days}d"
+    )
+    return spec
+
+
+class QueryPlan:
+    """Phase timings, filter steps and row counts of one ads query."""
+
+    def __init__(self, params: dict):
+        self.params = params
+        self.started = self._last = time.perf_counter()
+        self.phases = {}
+        self.filters = []
+        self.rows_scanned = 0
+        self.passes = 0
+        self.rows_matched = 0
+        # "scan" of the whole dataset, or "session_cache" for the previous result's rows
+        # ("session_cache+scan" when `compare_previous` still scanned the dataset;
+        # the in-memory store has no index or rollups)
+        self.access_path = "scan"
+
+    def mark(self, phase: str) -> None:
+        """Close `phase`: the time since the previous mark is attributed to it."""
+        now = time.perf_counter()
+        self.phases[phase] = round(self.phases.get(phase, 0.0) + (now - self._last) * 1000, 3)
+        self._last = now
+
+    def filter(self, name: str, value, before: int, after: int) -> None:
+        self.filters.append({"filter": name, "value": value, "campaignsBefore": before, "campaignsAfter": after})
+
+    def scanned(self, rows: int) -> None:
+        self.rows_scanned += rows
+        self.passes += 1
+
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self.started) * 1000, 3)
+
+    def explain(self, start_date: str, end_date: str, dataset_rows: int, rows_returned: int) -> dict:
+        return {
+            "dateRange": {"input": self.params.get("date_range", "last 30 days"), "start": start_date, "end": end_date},
+            "filterPlan": self.filters,
+            "accessPath": self.access_path,
+            "rows": {
+                "dataset": dataset_rows,
+                "scanned": self.rows_scanned,
+                "matched": self.rows_matched,
+                "returned": rows_returned,
+                "passes": self.passes,
+            },
+            "phasesMs": dict(self.phases),
+            "totalMs": self.elapsed_ms(),
+            "spec": normalize_query_spec(self.params, start_date, end_date),
+        }
+
+    def log_if_slow(self, start_date: str, end_date: str, rows_returned: int) -> bool:
+        total_ms = self.elapsed_ms()
+        if total_ms < SLOW_QUERY_SECONDS * 1000:
+            return False
+        spec = normalize_query_spec(self.params, start_date, end_date)
+        SLOW_QUERIES.labels(spec["groupBy"]).inc()
+        _slow_query_logger().info(json.dumps({
+            "ts": datetime.now().isoformat(timespec="seconds"),
+            "shape": spec.pop("shape"),
+            "spec": spec,
+            "totalMs": total_ms,
+            "accessPath": self.access_path,
+            "rowsScanned": self.rows_scanned,
+            "rowsReturned": rows_returned,
+            "phasesMs": dict(self.phases),
+        }, ensure_ascii=False))
+        return True
@@ -0,0 +1,58 @@
+"""
+Request Metrics
+
+Counts, latency and open streams per API endpoint and routed intent. The
+endpoint wraps its response stream in `observe_stream`; code that learns
+the intent later (the router, in a child task) reports it with
+`set_intent`, which writes into a per-request holder shared through a
+context variable.
+
+Usage:
+    return StreamingResponse(observe_stream(stream, "agent"), ...)
+    ...
+    set_intent(routed.intent)
+"""
+
+import asyncio
+import contextvars
+import time
+from typing import AsyncIterator
+
+from metrics import Counter, Gauge, Histogram
+
+REQUESTS = Counter("http_requests_total", "Streamed API requests by endpoint, intent and outcome", ["endpoint", "intent", "outcome"])
+REQUEST_SECONDS = Histogram("http_request_seconds", "Streamed API request duration by endpoint and intent", ["endpoint", "intent"])
+STREAMS_INFLIGHT = Gauge("http_streams_inflight", "Response streams currently open", ["endpoint"])
+
+_request = contextvars.ContextVar("request_metrics", default=None)
+
+
+def set_intent(intent: str) -> None:
+    """Label the current request with its routed intent (no-op outside a request)."""
+    request = _request.get()
+    if request is not None:
+        request["intent"] = intent
+
+
+async def observe_stream(stream: AsyncIterator[str], endpoint: str, intent: str = "unknown") -> AsyncIterator[str]:
+    """Wrap a response stream to record it per endpoint and intent."""
+    request = {"intent": intent}
+    _request.set(request)
+    inflight = STREAMS_INFLIGHT.labels(endpoint)
+    inflight.inc()
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        async for chunk in stream:
+            yield chunk
+    except (GeneratorExit, asyncio.CancelledError):
+        outcome = "cancelled"
+        raise
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        inflight.dec()
+        REQUESTS.labels(endpoint, request["intent"], outcome).inc()
+        REQUEST_SECONDS.labels(endpoint, request["intent"]).observe(time.perf_counter() - started)
+        await stream.aclose()
@@ -0,0 +1,325 @@
+"""
+Persistent Research Results Cache
+
+Stores parsed affiliate program tables on disk (SQLite), keyed by the
+normalized niche, so repeated "Crypto"/"Forex"/"Beauty" lookups skip Gemini.
+
+- Fresh entries are served immediately
+- Stale entries are served immediately while a background refresh runs
+- Entries older than the stale window are treated as misses
+- The table is bounded; least recently used entries are evicted
+- Differently phrased niches fall back to an approximate match against
+  already answered ones (see niche_matcher.py)
+- While the LLM gateway circuit breaker rejects calls (open, or half-open
+  with its probe in flight) or a request is out of time, expired entries are still served (marked `degraded`) and no
+  background refresh is started
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Optional
+
+from intent_cache import normalize_query
+from llm_gateway import llm_gateway
+from metrics import Counter, Gauge, Histogram
+from niche_matcher import NicheIndex
+
+logger = logging.getLogger("RESEARCH_CACHE")
+
+RESEARCH_CACHE_PATH = os.getenv(
+    "RESEARCH_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "research_cache.sqlite3"),
+)
+RESEARCH_CACHE_FRESH_SECONDS = float(os.getenv("RESEARCH_CACHE_FRESH_SECONDS", str(24 * 3600)))
+RESEARCH_CACHE_STALE_SECONDS = float(os.getenv("RESEARCH_CACHE_STALE_SECONDS", str(7 * 24 * 3600)))
+RESEARCH_CACHE_MAX_ENTRIES = int(os.getenv("RESEARCH_CACHE_MAX_ENTRIES", "500"))
+# Fraction of fuzzy hits re-checked against a fresh generation
+FUZZY_VERIFY_RATE = float(os.getenv("RESEARCH_CACHE_FUZZY_VERIFY_RATE", "0.05"))
+# Brand overlap below this means the fuzzy match served the wrong niche
+FUZZY_FALSE_MATCH_OVERLAP = 0.2
+
+LOOKUPS = Counter("research_cache_lookups_total", "Research cache lookups by result", ["result"])
+FUZZY_SIMILARITY = Histogram(
+    "research_cache_fuzzy_similarity", "Similarity of served fuzzy matches",
+    buckets=(0.75, 0.8, 0.85, 0.9, 0.95, 1.0),
+)
+FUZZY_VERIFICATIONS = Counter("research_cache_fuzzy_verifications_total", "Fuzzy hits re-checked against Gemini", ["outcome"])
+HIT_RATIO = Gauge("research_cache_hit_ratio", "Share of research cache lookups served from the cache (exact or fuzzy)")
+
+
+def normalize_niche(niche: str) -> str:
+    return normalize_query(niche)
+
+
+def brand_overlap(left: list, right: list) -> float:
+    """Jaccard overlap of brand names between two research tables."""
+    left_brands = {str(row.get("brand", "")).lower() for row in left if isinstance(row, dict)}
+    right_brands = {str(row.get("brand", "")).lower() for row in right if isinstance(row, dict)}
+    if not left_brands or not right_brands:
+        return 0.0
+    return len(left_brands & right_brands) / len(left_brands | right_brands)
+
+
+def is_cacheable_table(table) -> bool:
+    """Only successful, non-empty program lists are worth caching."""
+    return (
+        isinstance(table, list)
+        and len(table) > 0
+        and all(isinstance(row, dict) and "error" not in row for row in table)
+    )
+
+
+def _create_detached_task(coro) -> asyncio.Task:
+    """Run `coro` in a fresh context, outside the request that scheduled it.
+
+    Background refreshes are shared by every later request: they must not
+    inherit this request's deadline, cancel token, trace or priority class.
+    """
+    loop = asyncio.get_running_loop()
+    return contextvars.Context().run(loop.create_task, coro)
+
+
+class ResearchCache:
+    """Disk-backed LRU cache of research tables with stale-while-revalidate."""
+
+    def __init__(
+        self,
+        path: str = RESEARCH_CACHE_PATH,
+        fresh_seconds: float = RESEARCH_CACHE_FRESH_SECONDS,
+        stale_seconds: float = RESEARCH_CACHE_STALE_SECONDS,
+        max_entries: int = RESEARCH_CACHE_MAX_ENTRIES,
+        niche_index: Optional[NicheIndex] = None,
+        fuzzy_verify_rate: float = FUZZY_VERIFY_RATE,
+    ):
+        self.path = path
+        self.fresh_seconds = fresh_seconds
+        self.stale_seconds = stale_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.fuzzy_verify_rate = fuzzy_verify_rate
+        self._refreshing = {}  # key -> asyncio.Task
+        self._index = niche_index or NicheIndex()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS research_cache (
+                    key TEXT PRIMARY KEY,
+                    niche TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )"""
+            )
+        for key in self.keys():
+            self._index.add(key)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get(self, niche: str, allow_expired: bool = False) -> Optional[dict]:
+        """Return {"niche", "table", "created_at"} or None if missing/expired."""
+        key = normalize_niche(niche)
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT niche, payload, created_at FROM research_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[2] > self.stale_seconds and not allow_expired:
+                conn.execute("DELETE FROM research_cache WHERE key = ?", (key,))
+                self._index.remove(key)
+                return None
+            conn.execute("UPDATE research_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return {"niche": row[0], "table": json.loads(row[1]), "created_at": row[2]}
+
+    def put(self, niche: str, table: list) -> None:
+        key = normalize_niche(niche)
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO research_cache (key, niche, payload, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, niche, json.dumps(table, ensure_ascii=False), now, now),
+            )
+            evicted = [
+                row[0] for row in conn.execute(
+                    "SELECT key FROM research_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?",
+                    (self.max_entries,),
+                )
+            ]
+            conn.executemany("DELETE FROM research_cache WHERE key = ?", [(k,) for k in evicted])
+        self._index.add(key)
+        for evicted_key in evicted:
+            self._index.remove(evicted_key)
+
+    def lookup(self, niche: str, allow_expired: bool = False) -> tuple:
+        """Exact lookup first, then the nearest previously answered niche.
+
+        Returns:
+            (entry or None, match) where match is {"type": "exact"|"fuzzy"|"miss", ...}
+        """
+        entry = self.get(niche, allow_expired)
+        if entry is not None:
+            LOOKUPS.labels("exact_hit").inc()
+            return entry, {"type": "exact"}
+
+        nearest = self._index.nearest(niche)
+        if nearest is not None:
+            matched_key, similarity = nearest
+            entry = self.get(matched_key, allow_expired)
+            if entry is not None:
+                LOOKUPS.labels("fuzzy_hit").inc()
+                FUZZY_SIMILARITY.observe(similarity)
+                logger.info("Fuzzy research cache match: '%s' -> '%s' (%.2f)", niche, matched_key, similarity)
+                return entry, {"type": "fuzzy", "matchedNiche": entry["niche"], "similarity": round(similarity, 3)}
+            self._index.remove(matched_key)
+
+        LOOKUPS.labels("miss").inc()
+        return None, {"type": "miss"}
+
+    def keys(self) -> list:
+        with self._lock, self._connect() as conn:
+            return [row[0] for row in conn.execute("SELECT key FROM research_cache")]
+
+    def is_fresh(self, entry: dict) -> bool:
+        return time.time() - entry["created_at"] <= self.fresh_seconds
+
+    def describe(self, entry: Optional[dict], refreshing: bool = False, match: Optional[dict] = None) -> dict:
+        """Freshness block exposed in the response context."""
+        if entry is None:
+            return {"hit": False, "stale": False, "ageSeconds": 0, "cachedAt": datetime.now().isoformat(timespec="seconds")}
+        info = {
+            "hit": True,
+            "stale": not self.is_fresh(entry),
+            "refreshing": refreshing,
+            "ageSeconds": int(time.time() - entry["created_at"]),
+            "cachedAt": datetime.fromtimestamp(entry["created_at"]).isoformat(timespec="seconds"),
+        }
+        if match and match.get("type") == "fuzzy":
+            info["matchedNiche"] = match["matchedNiche"]
+            info["similarity"] = match["similarity"]
+        return info
+
+    def serve_cached(self, niche: str, fetch: Callable[[], Awaitable[list]]) -> tuple:
+        """Return the cached table for `niche` if one can be served.
+
+        Stale entries schedule a background refresh through `fetch`.
+
+        Returns:
+            (table or None, cache_info)
+        """
+        if llm_gateway.would_reject():
+            return self.serve_degraded(niche)
+        entry, match = self.lookup(niche)
+        if entry is None:
+            return None, self.describe(None)
+        if self.is_fresh(entry):
+            if match["type"] == "fuzzy" and random.random() < self.fuzzy_verify_rate:
+                self._schedule_verification(niche, entry, fetch)
+            return entry["table"], self.describe(entry, match=match)
+        # Refreshing under the requested niche also turns a fuzzy hit into an exact one
+        refreshing = self._schedule_refresh(niche, fetch)
+        return entry["table"], self.describe(entry, refreshing=refreshing, match=match)
+
+    def serve_degraded(self, niche: str) -> tuple:
+        """Best cached table regardless of age, for when Gemini cannot be used.
+
+        Returns:
+            (table or None, cache_info marked `degraded`)
+        """
+        entry, match = self.lookup(niche, allow_expired=True)
+        if entry is None:
+            return None, self.describe(None)
+        return entry["table"], {**self.describe(entry, match=match), "degraded": True}
+
+    async def get_or_fetch(self, niche: str, fetch: Callable[[], Awaitable[list]]) -> tuple:
+        """Serve from cache when possible, otherwise call `fetch` and store the result.
+
+        Returns:
+            (table, cache_info)
+        """
+        table, info = self.serve_cached(niche, fetch)
+        if table is not None:
+            return table, info
+
+        table = await fetch()
+        if is_cacheable_table(table):
+            self.put(niche, table)
+        return table, info
+
+    def stats(self) -> dict:
+        """Hit rates derived from the lookup counters."""
+        counts = {result: LOOKUPS.labels(result).value for result in ("exact_hit", "fuzzy_hit", "miss")}
+        total = sum(counts.values())
+        verified = sum(FUZZY_VERIFICATIONS.labels(o).value for o in ("confirmed", "false_match"))
+        false_matches = FUZZY_VERIFICATIONS.labels("false_match").value
+        return {
+            "lookups": int(total),
+            "hitRate": round((counts["exact_hit"] + counts["fuzzy_hit"]) / total, 4) if total else 0.0,
+            "fuzzyHitRate": round(counts["fuzzy_hit"] / total, 4) if total else 0.0,
+            "fuzzyVerified": int(verified),
+            "falseMatchRate": round(false_matches / verified, 4) if verified else 0.0,
+            "indexedNiches": len(self._index),
+        }
+
+    def _schedule_refresh(self, niche: str, fetch: Callable[[], Awaitable[list]]) -> bool:
+        key = normalize_niche(niche)
+        if key in self._refreshing:
+            return True
+        try:
+            task = _create_detached_task(self._refresh(key, niche, fetch))
+        except RuntimeError:
+            return False
+        self._refreshing[key] = task
+        return True
+
+    def _schedule_verification(self, niche: str, served: dict, fetch: Callable[[], Awaitable[list]]) -> None:
+        key = normalize_niche(niche)
+        if key in self._refreshing:
+            return
+        try:
+            task = _create_detached_task(self._verify(key, niche, served, fetch))
+        except RuntimeError:
+            return
+        self._refreshing[key] = task
+
+    async def _verify(self, key: str, niche: str, served: dict, fetch: Callable[[], Awaitable[list]]) -> None:
+        """Compare a served fuzzy match with a fresh generation for the requested niche."""
+        try:
+            table = await fetch()
+            if not is_cacheable_table(table):
+                return
+            self.put(niche, table)
+            overlap = brand_overlap(served["table"], table)
+            if overlap < FUZZY_FALSE_MATCH_OVERLAP:
+                FUZZY_VERIFICATIONS.labels("false_match").inc()
+                logger.warning("Fuzzy false match: '%s' was served '%s' (brand overlap %.2f)", niche, served["niche"], overlap)
+            else:
+                FUZZY_VERIFICATIONS.labels("confirmed").inc()
+        except Exception as e:
+            logger.warning("Fuzzy match verification failed for '%s': %s", niche, e)
+        finally:
+            self._refreshing.pop(key, None)
+
+    async def _refresh(self, key: str, niche: str, fetch: Callable[[], Awaitable[list]]) -> None:
+        try:
+            table = await fetch()
+            if is_cacheable_table(table):
+                self.put(niche, table)
+                logger.info("Refreshed research cache for '%s'", niche)
+        except Exception as e:
+            logger.warning("Background refresh failed for '%s': %s", niche, e)
+        finally:
+            self._refreshing.pop(key, None)
+
+
+research_cache = ResearchCache()
+HIT_RATIO.set_function(lambda: research_cache.stats()["hitRate"])
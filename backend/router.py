@@ -0,0 +1,279 @@
+"""
+Unified Intent Router
+
+One structured Gemini call returns the intent, typed entities and a
+confidence score for every endpoint (/api/chat/stream, /api/research/stream,
+/api/agent/chat), replacing the three separate classifiers.
+
+- Workflow-emitted follow-up suggestions resolve from seeded classifications
+- Repeated queries are served from the route cache
+- When the intent is already known (e.g. the research endpoint receives an
+  explicit niche) the route is built locally without any LLM call
+"""
+
+import json
+import logging
+import re
+from dataclasses import asdict, dataclass, field
+from typing import Optional
+
+from intent_cache import TTLCache, make_cache_key, lookup_seeded_intent, to_legacy_intent
+from metrics import Counter, Gauge
+from llm_client import generate_text
+
+logger = logging.getLogger("ROUTER")
+
+ROUTES = Counter("router_routes_total", "Routed queries by source (llm, seed, cache, forced, fallback)", ["source"])
+CACHE_HIT_RATIO = Gauge("router_cache_hit_ratio", "Share of routed queries answered without an LLM call (seed or cache)")
+
+
+def _cache_hit_ratio() -> float:
+    counts = {source: ROUTES.labels(source).value for source in ("seed", "cache", "llm", "fallback")}
+    total = sum(counts.values())
+    return (counts["seed"] + counts["cache"]) / total if total else 0.0
+
+
+CACHE_HIT_RATIO.set_function(_cache_hit_ratio)
+
+INTENTS = ("data_analysis", "data_query", "comparison", "explanation", "followup", "research")
+GROUP_BY_VALUES = ("day", "week", "month", "account", "campaign")
+BREAKDOWN_VALUES = ("account", "campaign")
+VISUAL_TYPES = ("line", "bar", "area")
+
+# Prompt context is bounded so long conversations do not grow the routing call
+MAX_CONTEXT_CHARS = 2000
+
+ROUTER_PROMPT = """Bạn là bộ định tuyến intent cho một ứng dụng quản lý quảng cáo affiliate và nghiên cứu chương trình affiliate.
+
+Phân loại câu hỏi của người dùng vào MỘT trong các loại sau:
+
+1. **data_analysis** - Xem dữ liệu, biểu đồ, metrics quảng cáo, kể cả phân tích theo nhóm.
+   Ví dụ: "Chi phí tháng 11", "Hiển thị clicks tuần này", "ROAS của tôi thế nào?", "Chi phí theo tài khoản"
+2. **data_query** - Danh sách/bảng campaigns hoặc accounts (CHỈ LIST/TABLE).
+   Ví dụ: "Liệt kê các chiến dịch", "Tài khoản nào đang active?"
+3. **comparison** - So sánh giữa các khoảng thời gian hoặc đối tượng.
+   Ví dụ: "So sánh tháng 10 và 11", "Tuần này vs tuần trước"
+4. **explanation** - Giải thích, hướng dẫn, khái niệm.
+   Ví dụ: "CPC là gì?", "Tại sao chi phí tăng?", "What is affiliate marketing?"
+5. **followup** - Hỏi tiếp về câu trả lời trước đó.
+   Ví dụ: "Chi tiết hơn", "Tại sao ngày 15 lại cao?", "tell me more about the first one"
+6. **research** - Tìm chương trình affiliate, ngách, cơ hội kiếm tiền.
+   Ví dụ: "Crypto", "Forex", "beauty ecommerce", "Tìm affiliate program", "Ngách nào tốt?"
+
+Câu hỏi: "{query}"
+
+Lịch sử hội thoại: {context}
+
+Chỉ điền entity khi có trong câu hỏi hoặc ngữ cảnh; nếu không, dùng null hoặc [].
+Trả lời CHỈ bằng JSON theo đúng format:
+{{
+    "intent": "<loại>",
+    "confidence": <0.0-1.0>,
+    "entities": {{
+        "time_range": "<khoảng thời gian, v.d. tháng 11, last 7 days>",
+        "metrics": ["<cpc|ctr|roas|cpa|cost|revenue|clicks|impressions|conversions>"],
+        "campaigns": ["<tên campaign>"],
+        "program": "<chương trình affiliate, v.d. Shopee, Binance>",
+        "keywords": ["<từ khóa lọc, v.d. crypto, forex>"],
+        "group_by": "<day|week|month|account|campaign>",
+        "breakdown": "<account|campaign|none>",
+        "visual_type": "<line|bar|area|none>",
+        "niche": "<ngách/lĩnh vực nếu là research>"
+    }}
+}}
+"""
+
+# Local fallback when the LLM response cannot be used
+EXPLANATION_HINTS = ("là gì", "giải thích", "tại sao", "vì sao", "như thế nào", "what is", "why", "how", "explain")
+DATA_QUERY_HINTS = ("liệt kê", "danh sách", "list")
+DATA_HINTS = (
+    "chi phí", "doanh thu", "click", "cpc", "ctr", "roas", "cpa", "hiển thị", "chuyển đổi",
+    "tuần", "tháng", "ngày", "chiến dịch", "tài khoản", "campaign", "account", "cost", "revenue",
+)
+
+
+@dataclass
+class RouteEntities:
+    """Typed entities extracted by the router."""
+    time_range: Optional[str] = None
+    metrics: list = field(default_factory=list)
+    campaigns: list = field(default_factory=list)
+    program: Optional[str] = None
+    keywords: list = field(default_factory=list)
+    group_by: Optional[str] = None
+    breakdown: Optional[str] = None
+    visual_type: Optional[str] = None
+    niche: Optional[str] = None
+    # "More programs" follow-up: programs beyond the ones already shown for the niche
+    expand: bool = False
+
+    @classmethod
+    def from_raw(cls, raw: Optional[dict]) -> "RouteEntities":
+        """Coerce loosely-typed LLM output into valid entity values."""
+        raw = raw if isinstance(raw, dict) else {}
+
+        def text(value) -> Optional[str]:
+            if value is None:
+                return None
+            value = str(value).strip()
+            return value if value and value.lower() not in ("none", "null", "n/a") and not value.startswith("<") else None
+
+        def text_list(value) -> list:
+            if value is None:
+                return []
+            if isinstance(value, str):
+                value = [value]
+            return [item for item in (text(v) for v in value) if item]
+
+        def choice(value, allowed) -> Optional[str]:
+            value = text(value)
+            return value.lower() if value and value.lower() in allowed else None
+
+        return cls(
+            time_range=text(raw.get("time_range")),
+            metrics=[m.lower() for m in text_list(raw.get("metrics"))],
+            campaigns=text_list(raw.get("campaigns")),
+            program=text(raw.get("program")),
+            keywords=text_list(raw.get("keywords")),
+            group_by=choice(raw.get("group_by"), GROUP_BY_VALUES),
+            breakdown=choice(raw.get("breakdown"), BREAKDOWN_VALUES),
+            visual_type=choice(raw.get("visual_type"), VISUAL_TYPES),
+            niche=text(raw.get("niche")),
+            expand=raw.get("expand") is True,
+        )
+
+    def to_dict(self) -> dict:
+        """Entities as a dict without empty values (the shape the crews expect)."""
+        return {key: value for key, value in asdict(self).items() if value not in (None, [], False)}
+
+
+@dataclass
+class RouteResult:
+    intent: str
+    entities: RouteEntities
+    confidence: float
+    source: str  # llm | seed | cache | forced | fallback
+
+    @property
+    def legacy_intent(self) -> str:
+        """Intent mapped onto the research/explanation/followup set of /api/chat/stream."""
+        return to_legacy_intent(self.intent)
+
+    def to_dict(self) -> dict:
+        return {
+            "intent": self.intent,
+            "entities": self.entities.to_dict(),
+            "confidence": self.confidence,
+            "source": self.source,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict, source: str) -> "RouteResult":
+        intent = data.get("intent")
+        try:
+            confidence = float(data.get("confidence", 0.5))
+        except (TypeError, ValueError):
+            confidence = 0.5
+        return cls(
+            intent=intent if intent in INTENTS else "research",
+            entities=RouteEntities.from_raw(data.get("entities")),
+            confidence=max(0.0, min(1.0, confidence)),
+            source=source,
+        )
+
+
+route_cache = TTLCache()
+
+
+def _context_lines(conversation_history: str) -> list:
+    return conversation_history.splitlines() if conversation_history else []
+
+
+def lookup_known_route(query: str, conversation_history: str = "", previous_context: Optional[dict] = None) -> Optional[RouteResult]:
+    """Return the route if it is known without an LLM call (seeded or cached), else None."""
+    seeded = lookup_seeded_intent(query, previous_context)
+    if seeded:
+        return RouteResult.from_dict(seeded, source="seed")
+
+    cached = route_cache.get(make_cache_key(query, _context_lines(conversation_history)))
+    if cached:
+        return RouteResult.from_dict(cached, source="cache")
+    return None
+
+
+def route_forced(intent: str, query: str, **entities) -> RouteResult:
+    """Build a route locally when the caller already knows the intent."""
+    raw = dict(entities)
+    if intent == "research":
+        raw.setdefault("niche", query)
+    ROUTES.labels("forced").inc()
+    return RouteResult(intent=intent, entities=RouteEntities.from_raw(raw), confidence=1.0, source="forced")
+
+
+def _has_hint(text: str, hints) -> bool:
+    return any(re.search(rf"\b{re.escape(hint)}\b", text) for hint in hints)
+
+
+def heuristic_route(query: str) -> RouteResult:
+    """Keyword-based route used when the LLM output is unusable."""
+    query_lower = query.lower()
+    if _has_hint(query_lower, EXPLANATION_HINTS):
+        intent = "explanation"
+    elif _has_hint(query_lower, DATA_QUERY_HINTS):
+        intent = "data_query"
+    elif _has_hint(query_lower, DATA_HINTS):
+        intent = "data_analysis"
+    else:
+        intent = "research"
+    raw = {"niche": query} if intent == "research" else {}
+    return RouteResult(intent=intent, entities=RouteEntities.from_raw(raw), confidence=0.3, source="fallback")
+
+
+def _parse_response(text: str) -> dict:
+    text = text.strip()
+    if text.startswith("```"):
+        text = re.sub(r"^```(?:json)?", "", text).rsplit("```", 1)[0]
+    return json.loads(text)
+
+
+def record_known_route(result: RouteResult) -> None:
+    """Count a route answered by `lookup_known_route` (seed or cache) in the route stats."""
+    ROUTES.labels(result.source).inc()
+    logger.info("Route (%s): %s", result.source, result.intent)
+    logger.debug("Entities: %s", result.entities)
+
+
+async def route(query: str, conversation_history: str = "", previous_context: Optional[dict] = None) -> RouteResult:
+    """Route a user query with a single structured LLM call.
+
+    Args:
+        query: The current user message
+        conversation_history: "role: content" lines of previous turns
+        previous_context: `context` block of the previous assistant response
+
+    Returns:
+        RouteResult with intent, typed entities and confidence
+    """
+    known = lookup_known_route(query, conversation_history, previous_context)
+    if known:
+        record_known_route(known)
+        return known
+
+    context = conversation_history[-MAX_CONTEXT_CHARS:] if conversation_history else "Chưa có"
+    prompt = ROUTER_PROMPT.format(query=query, context=context)
+
+    try:
+        data = _parse_response(await generate_text(prompt, json_mode=True, site="router"))
+        if data.get("intent") not in INTENTS:
+            raise ValueError(f"Unknown intent {data.get('intent')!r}")
+    except Exception as e:
+        logger.warning("Routing failed (%s), using keyword fallback", e)
+        ROUTES.labels("fallback").inc()
+        return heuristic_route(query)
+
+    result = RouteResult.from_dict(data, source="llm")
+    ROUTES.labels("llm").inc()
+    route_cache.set(make_cache_key(query, _context_lines(conversation_history)), result.to_dict())
+    logger.info("Route (llm): %s (%.2f)", result.intent, result.confidence)
+    logger.debug("Entities: %s", result.entities)
+    return result
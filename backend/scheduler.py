@@ -0,0 +1,198 @@
+"""
+Request Scheduler
+
+Data questions are answered from the local ads database in well under a
+second, while research and explanations wait on long LLM generations. Both
+share the event loop and the LLM quota, so without scheduling a burst of
+research traffic makes "Chi phí tuần này" wait behind it.
+
+Requests are admitted through priority classes (see INTENT_CLASSES):
+
+- A free slot always goes to the highest class with waiters
+- Within a class, users are served round-robin, so one user's burst does
+  not delay everyone else
+- When SCHEDULER_SHED_QUEUE requests are already waiting, new requests of
+  the lowest class are shed (RequestShed) instead of queueing
+
+The class of the running request is kept in a context variable, so the LLM
+gateway admits queued calls in the same order. Latency per class is checked
+against SLO_<CLASS>_SECONDS and reported by `stats()`.
+"""
+
+import asyncio
+import contextvars
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+from metrics import Counter, Gauge, Histogram
+
+# Highest priority first
+PRIORITY_CLASSES = ("data", "generative")
+
+INTENT_CLASSES = {
+    "data_query": "data",
+    "data_analysis": "data",
+    "comparison": "data",
+    "followup": "data",
+    "research": "generative",
+    "explanation": "generative",
+}
+
+SCHEDULER_MAX_ACTIVE = int(os.getenv("SCHEDULER_MAX_ACTIVE", "16"))
+SCHEDULER_SHED_QUEUE = int(os.getenv("SCHEDULER_SHED_QUEUE", "32"))
+SLO_SECONDS = {
+    "data": float(os.getenv("SLO_DATA_SECONDS", "2")),
+    "generative": float(os.getenv("SLO_GENERATIVE_SECONDS", "20")),
+}
+
+QUEUE_WAIT = Histogram("scheduler_queue_wait_seconds", "Time spent waiting for a request slot", ["class"])
+LATENCY = Histogram("scheduler_latency_seconds", "Scheduled request latency (queue wait + execution)", ["class"])
+SLO_RESULTS = Counter("scheduler_slo_total", "Scheduled requests by SLO outcome", ["class", "result"])
+SHED = Counter("scheduler_shed_total", "Requests rejected by load shedding", ["class"])
+QUEUED = Gauge("scheduler_queued", "Requests waiting for a slot", ["class"])
+ACTIVE = Gauge("scheduler_active", "Requests holding a slot")
+
+_priority_class = contextvars.ContextVar("priority_class", default=None)
+
+
+class RequestShed(Exception):
+    """The request was rejected because its class is being shed."""
+
+    user_message = "Hệ thống đang bận, vui lòng thử lại sau ít phút."
+
+    def __init__(self, priority_class: str):
+        super().__init__(f"Request shed: {priority_class}")
+        self.priority_class = priority_class
+
+
+def class_for(intent: str) -> str:
+    return INTENT_CLASSES.get(intent, PRIORITY_CLASSES[-1])
+
+
+def current_priority() -> int:
+    """Priority of the current request (0 is highest); unscheduled work sorts last."""
+    priority_class = _priority_class.get()
+    return PRIORITY_CLASSES.index(priority_class) if priority_class else len(PRIORITY_CLASSES)
+
+
+class RequestScheduler:
+    def __init__(
+        self,
+        max_active: int = SCHEDULER_MAX_ACTIVE,
+        shed_queue: int = SCHEDULER_SHED_QUEUE,
+        slo_seconds: dict = None,
+    ):
+        self.max_active = max_active
+        self.shed_queue = shed_queue
+        self.slo_seconds = dict(slo_seconds or SLO_SECONDS)
+        self.active = 0
+        # class -> user -> waiters; user order is the round-robin order
+        self._queues = {priority_class: OrderedDict() for priority_class in PRIORITY_CLASSES}
+
+    def queued(self, priority_class: str = None) -> int:
+        classes = [priority_class] if priority_class else PRIORITY_CLASSES
+        return sum(len(waiters) for c in classes for waiters in self._queues[c].values())
+
+    @asynccontextmanager
+    async def slot(self, intent: str, user_id: str = "anonymous"):
+        """Hold one of the request slots for the duration of the block.
+
+        Raises:
+            RequestShed: If the request's class is being shed
+        """
+        priority_class = class_for(intent)
+        started = time.perf_counter()
+        await self._acquire(priority_class, user_id)
+        QUEUE_WAIT.labels(priority_class).observe(time.perf_counter() - started)
+        token = _priority_class.set(priority_class)
+        try:
+            yield priority_class
+        finally:
+            _priority_class.reset(token)
+            self._release()
+            self._record(priority_class, time.perf_counter() - started)
+
+    async def _acquire(self, priority_class: str, user_id: str) -> None:
+        if self.active < self.max_active and not self.queued():
+            self._activate()
+            return
+        if priority_class == PRIORITY_CLASSES[-1] and self.queued() >= self.shed_queue:
+            SHED.labels(priority_class).inc()
+            raise RequestShed(priority_class)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues[priority_class].setdefault(user_id, deque()).append(waiter)
+        QUEUED.labels(priority_class).set(self.queued(priority_class))
+        try:
+            await waiter
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                self._release()  # the slot was handed over as the caller went away
+            else:
+                self._discard(priority_class, user_id, waiter)
+            raise
+
+    def _activate(self) -> None:
+        self.active += 1
+        ACTIVE.set(self.active)
+
+    def _release(self) -> None:
+        self.active -= 1
+        ACTIVE.set(self.active)
+        while self.active < self.max_active:
+            waiter = self._next_waiter()
+            if waiter is None:
+                break
+            self._activate()
+            waiter.set_result(None)
+
+    def _next_waiter(self):
+        for priority_class in PRIORITY_CLASSES:
+            users = self._queues[priority_class]
+            while users:
+                user_id, waiters = next(iter(users.items()))
+                waiter = waiters.popleft()
+                if waiters:
+                    users.move_to_end(user_id)
+                else:
+                    del users[user_id]
+                QUEUED.labels(priority_class).set(self.queued(priority_class))
+                if not waiter.done():
+                    return waiter
+        return None
+
+    def _discard(self, priority_class: str, user_id: str, waiter) -> None:
+        waiters = self._queues[priority_class].get(user_id)
+        if waiters and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del self._queues[priority_class][user_id]
+        QUEUED.labels(priority_class).set(self.queued(priority_class))
+
+    def _record(self, priority_class: str, latency: float) -> None:
+        LATENCY.labels(priority_class).observe(latency)
+        met = latency <= self.slo_seconds[priority_class]
+        SLO_RESULTS.labels(priority_class, "met" if met else "missed").inc()
+
+    def stats(self) -> dict:
+        classes = {}
+        for priority_class in PRIORITY_CLASSES:
+            latency = LATENCY.labels(priority_class)
+            met = SLO_RESULTS.labels(priority_class, "met").value
+            missed = SLO_RESULTS.labels(priority_class, "missed").value
+            classes[priority_class] = {
+                "queued": self.queued(priority_class),
+                "shed": int(SHED.labels(priority_class).value),
+                "sloSeconds": self.slo_seconds[priority_class],
+                "sloMetRate": round(met / (met + missed), 3) if met + missed else None,
+                "count": latency.count,
+                "p50Ms": round(latency.quantile(0.5) * 1000),
+                "p95Ms": round(latency.quantile(0.95) * 1000),
+                "queueWaitP95Ms": round(QUEUE_WAIT.labels(priority_class).quantile(0.95) * 1000),
+            }
+        return {"active": self.active, "maxActive": self.max_active, "classes": classes}
+
+
+request_scheduler = RequestScheduler()
@@ -0,0 +1,178 @@
+"""
+Conversation Session Store
+
+Keeps each conversation's history on the server so clients send only the
+new message (`session_id` + `message`) instead of the full `messages` list.
+
+- Sessions are kept in memory, keyed by session id; they expire after
+  SESSION_TTL_SECONDS of inactivity and the least recently used ones are
+  evicted beyond SESSION_MAX_SESSIONS
+- A session holds the last turns verbatim plus a rolling summary of older
+  ones; the history pasted into prompts stays under SESSION_HISTORY_TOKENS
+- Compaction is extractive (older turns are shortened into the summary),
+  so it never costs an LLM call on the request path
+- The last assistant `context` (filters, niche) is kept for follow-ups,
+  together with the rows the last data query matched, so drill-downs run
+  on that subset instead of the whole dataset (see data_tools.RowSelection)
+
+Usage:
+    session = session_store.get_or_create(session_id)
+    history = session.history()
+    ...
+    session.add_exchange(query, answer_text, context)
+"""
+
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+from metrics import Counter, Gauge
+
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "3600"))
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "1000"))
+# Prompt budget for summary + recent turns (estimated tokens, ~4 chars each)
+SESSION_HISTORY_TOKENS = int(os.getenv("SESSION_HISTORY_TOKENS", "1500"))
+SESSION_SUMMARY_TOKENS = int(os.getenv("SESSION_SUMMARY_TOKENS", "400"))
+# Messages (user + assistant) kept verbatim before they are folded into the summary
+SESSION_RECENT_MESSAGES = int(os.getenv("SESSION_RECENT_MESSAGES", "6"))
+# Largest row selection kept for follow-up drill-downs (references into the dataset)
+SESSION_MAX_ROWS = int(os.getenv("SESSION_MAX_ROWS", "50000"))
+
+# Longest excerpt of a turn kept in the summary
+SUMMARY_LINE_CHARS = 160
+
+SESSIONS_EVICTED = Counter("sessions_evicted_total", "Conversation sessions evicted by reason", ["reason"])
+SESSIONS_ACTIVE = Gauge("sessions_active", "Conversation sessions held in memory")
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+
+def _line(role: str, content: str) -> str:
+    return f"{role}: {content}\n"
+
+
+def _excerpt(content: str) -> str:
+    content = " ".join(content.split())
+    return content if len(content) <= SUMMARY_LINE_CHARS else content[:SUMMARY_LINE_CHARS - 1] + "…"
+
+
+class Session:
+    """One conversation: rolling summary, recent turns and the last answer's context."""
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.summary = ""
+        self.recent = []  # [(role, content)]
+        self.previous_context = None
+        self.rows = None  # data_tools.RowSelection of the last data query
+        self.turns = 0
+        self._lock = threading.Lock()
+
+    def add_exchange(self, query: str, answer: str, context: Optional[dict] = None) -> None:
+        """Record a user message and the answer it got, compacting older turns."""
+        with self._lock:
+            self.recent.append(("user", query))
+            self.recent.append(("assistant", answer))
+            if context:
+                self.previous_context = context
+            self.turns += 1
+            self._compact()
+
+    def keep_rows(self, selection) -> None:
+        """Remember the rows of the last data query (unless there are too many)."""
+        with self._lock:
+            self.rows = selection if len(selection.rows) <= SESSION_MAX_ROWS else None
+
+    def _compact(self) -> None:
+        while self.recent and (
+            len(self.recent) > SESSION_RECENT_MESSAGES or self._history_tokens() > SESSION_HISTORY_TOKENS
+        ):
+            role, content = self.recent.pop(0)
+            self.summary += _line(role, _excerpt(content))
+        # The summary keeps its newest lines within its own budget
+        while estimate_tokens(self.summary) > SESSION_SUMMARY_TOKENS and "\n" in self.summary:
+            self.summary = self.summary.split("\n", 1)[1]
+
+    def _history_tokens(self) -> int:
+        return estimate_tokens(self._render())
+
+    def _render(self) -> str:
+        recent = "".join(_line(role, content) for role, content in self.recent)
+        if not self.summary:
+            return recent
+        return f"[Tóm tắt hội thoại trước]\n{self.summary}[Gần đây]\n{recent}"
+
+    def history(self) -> str:
+        """Conversation history for prompts, in the `role: content` form of the message lists."""
+        with self._lock:
+            return self._render()
+
+
+class SessionStore:
+    """Thread-safe LRU of sessions that expire after `ttl_seconds` of inactivity."""
+
+    def __init__(self, max_sessions: int = SESSION_MAX_SESSIONS, ttl_seconds: float = SESSION_TTL_SECONDS):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions = OrderedDict()  # session id -> (expires_at, Session)
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> Optional[Session]:
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            expires_at, session = entry
+            if expires_at < time.monotonic():
+                del self._sessions[session_id]
+                SESSIONS_EVICTED.labels("ttl").inc()
+                return None
+            self._sessions[session_id] = (time.monotonic() + self.ttl_seconds, session)
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def get_or_create(self, session_id: Optional[str] = None) -> Session:
+        """The live session `session_id`, or a new one (under that id, or a generated one)."""
+        session = self.get(session_id) if session_id else None
+        if session is not None:
+            return session
+        session = Session(session_id or new_session_id())
+        with self._lock:
+            self._sessions[session.session_id] = (time.monotonic() + self.ttl_seconds, session)
+            self._evict()
+        return session
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        # Entries are in last-use order, so expired ones are at the front
+        while self._sessions:
+            session_id, (expires_at, _) = next(iter(self._sessions.items()))
+            if expires_at >= now and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[session_id]
+            SESSIONS_EVICTED.labels("ttl" if expires_at < now else "lru").inc()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._sessions.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"sessions": len(self._sessions), "maxSessions": self.max_sessions, "ttlSeconds": self.ttl_seconds}
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+# Singleton instance
+session_store = SessionStore()
+SESSIONS_ACTIVE.set_function(lambda: len(session_store))
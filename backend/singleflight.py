@@ -0,0 +1,184 @@
+"""
+Single-Flight Request Coalescing
+
+Concurrent identical calls share one upstream execution: the first caller
+(the leader) runs the work, later callers with the same key await its
+result instead of starting their own. Nothing is cached once the call
+finishes; this only collapses calls that overlap in time.
+
+- SingleFlight:     coroutines (LLM calls)
+- SyncSingleFlight: blocking functions called from worker threads
+                    (QueryAdsCampaignsTool computations)
+- StreamFlight:     async generators; every subscriber receives all items,
+                    late joiners first get a replay of what was produced
+"""
+
+import asyncio
+import hashlib
+import json
+import threading
+from typing import Any, AsyncIterator, Awaitable, Callable
+
+from cancellation import OperationCancelled
+from metrics import Counter
+
+FLIGHT_CALLS = Counter(
+    "singleflight_calls_total", "Calls through single-flight groups (leader ran the work, coalesced shared it)", ["flight", "result"]
+)
+
+
+def flight_key(*parts: Any) -> str:
+    """Stable hash of the call identity (model, prompt, options...)."""
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """Coalesces concurrent coroutine calls that share a key.
+
+    The shared work runs as its own task; it is cancelled only when every
+    caller waiting on it has gone away.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls = {}  # key -> [task, waiters]
+
+    def inflight(self) -> int:
+        return len(self._calls)
+
+    def _forget(self, key: str, call: list) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            task = asyncio.ensure_future(fn())
+            call = self._calls[key] = [task, 0]
+            task.add_done_callback(lambda _, call=call: self._forget(key, call))
+            FLIGHT_CALLS.labels(self.name, "leader").inc()
+        else:
+            FLIGHT_CALLS.labels(self.name, "coalesced").inc()
+
+        task = call[0]
+        call[1] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done() and call[1] == 1:
+                task.cancel()
+                self._forget(key, call)
+            raise
+        finally:
+            call[1] -= 1
+
+
+class _SyncCall:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SyncSingleFlight:
+    """Thread-safe single-flight for blocking functions."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _SyncCall()
+        FLIGHT_CALLS.labels(self.name, "leader" if leader else "coalesced").inc()
+
+        if not leader:
+            call.done.wait()
+            if isinstance(call.error, OperationCancelled):
+                # The leader's client went away; this caller still wants the result
+                return self.do(key, fn)
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+
+class _StreamCall:
+    def __init__(self):
+        self.items = []
+        self.finished = False
+        self.error = None
+        self.changed = asyncio.Condition()
+        self.subscribers = 0
+        self.task = None
+
+
+class StreamFlight:
+    """Fans one async generator out to every concurrent subscriber of a key."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls = {}
+
+    async def _pump(self, key: str, call: _StreamCall, agen: AsyncIterator) -> None:
+        try:
+            async for item in agen:
+                async with call.changed:
+                    call.items.append(item)
+                    call.changed.notify_all()
+        except Exception as e:
+            call.error = e
+        finally:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+            async with call.changed:
+                call.finished = True
+                call.changed.notify_all()
+
+    async def stream(self, key: str, factory: Callable[[], AsyncIterator]) -> AsyncIterator:
+        call = self._calls.get(key)
+        if call is None:
+            call = self._calls[key] = _StreamCall()
+            call.task = asyncio.ensure_future(self._pump(key, call, factory()))
+            FLIGHT_CALLS.labels(self.name, "leader").inc()
+        else:
+            FLIGHT_CALLS.labels(self.name, "coalesced").inc()
+
+        call.subscribers += 1
+        position = 0
+        try:
+            while True:
+                async with call.changed:
+                    await call.changed.wait_for(lambda: position < len(call.items) or call.finished)
+                    pending = call.items[position:]
+                if pending:
+                    position += len(pending)
+                    for item in pending:
+                        yield item
+                    continue
+                if call.error is not None:
+                    raise call.error
+                return
+        finally:
+            call.subscribers -= 1
+            if call.subscribers == 0 and not call.finished:
+                call.task.cancel()
+                if self._calls.get(key) is call:
+                    del self._calls[key]
@@ -0,0 +1,126 @@
+"""
+Speculative Execution for /api/chat/stream
+
+Most chat traffic is research, so the research generation can start at the
+same moment as intent classification instead of after it. The speculative
+output is buffered; it is committed if the intent turns out to be
+research/followup and cancelled otherwise.
+
+Modes (CHAT_SPECULATION_MODE):
+- off:  never speculate
+- on:   always speculate when classification needs an LLM call
+- auto: speculate while the recent research share stays above
+        CHAT_SPECULATION_MIN_RESEARCH_SHARE
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+
+from metrics import Counter, Histogram
+
+CHAT_SPECULATION_MODE = os.getenv("CHAT_SPECULATION_MODE", "auto").lower()
+CHAT_SPECULATION_MIN_RESEARCH_SHARE = float(os.getenv("CHAT_SPECULATION_MIN_RESEARCH_SHARE", "0.6"))
+CHAT_SPECULATION_WINDOW = int(os.getenv("CHAT_SPECULATION_WINDOW", "200"))
+
+SPECULATIONS = Counter("chat_speculation_total", "Speculative research generations by outcome", ["outcome"])
+SPECULATION_SAVED = Histogram("chat_speculation_saved_seconds", "Latency saved by committed speculations")
+SPECULATION_WASTED = Histogram("chat_speculation_wasted_seconds", "Generation time thrown away by cancelled speculations")
+
+_SENTINEL = object()
+
+
+class SpeculativeStream:
+    """Runs an async generator ahead of time and buffers what it yields."""
+
+    def __init__(self, agen):
+        self.started_at = time.perf_counter()
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._pump(agen))
+
+    async def _pump(self, agen):
+        try:
+            async for item in agen:
+                await self._queue.put(item)
+        except Exception as e:
+            await self._queue.put(e)
+        finally:
+            await self._queue.put(_SENTINEL)
+
+    async def commit(self):
+        """Yield everything the generator produced so far, then the rest live."""
+        try:
+            while True:
+                item = await self._queue.get()
+                if item is _SENTINEL:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self._task.cancel()
+
+    def cancel(self) -> float:
+        """Stop the speculative work and return how long it ran (seconds)."""
+        self._task.cancel()
+        return time.perf_counter() - self.started_at
+
+
+class SpeculationPolicy:
+    """Decides whether to speculate and keeps wasted/saved statistics."""
+
+    def __init__(
+        self,
+        mode: str = CHAT_SPECULATION_MODE,
+        min_research_share: float = CHAT_SPECULATION_MIN_RESEARCH_SHARE,
+        window: int = CHAT_SPECULATION_WINDOW,
+    ):
+        self.mode = mode
+        self.min_research_share = min_research_share
+        self._recent = deque(maxlen=window)  # True if the turn was research/followup
+        self._lock = threading.Lock()
+
+    def research_share(self) -> float:
+        with self._lock:
+            if not self._recent:
+                return 1.0
+            return sum(self._recent) / len(self._recent)
+
+    def should_speculate(self) -> bool:
+        if self.mode == "on":
+            return True
+        if self.mode == "auto":
+            return self.research_share() >= self.min_research_share
+        return False
+
+    def record_intent(self, is_research: bool) -> None:
+        with self._lock:
+            self._recent.append(is_research)
+
+    def record_committed(self, saved_seconds: float) -> None:
+        SPECULATIONS.labels("committed").inc()
+        SPECULATION_SAVED.observe(saved_seconds)
+
+    def record_wasted(self, wasted_seconds: float) -> None:
+        SPECULATIONS.labels("wasted").inc()
+        SPECULATION_WASTED.observe(wasted_seconds)
+
+    def stats(self) -> dict:
+        committed = SPECULATIONS.labels("committed").value
+        wasted = SPECULATIONS.labels("wasted").value
+        total = committed + wasted
+        saved = SPECULATION_SAVED.labels()
+        return {
+            "mode": self.mode,
+            "speculating": self.should_speculate(),
+            "researchShare": round(self.research_share(), 4),
+            "speculations": int(total),
+            "wastedRate": round(wasted / total, 4) if total else 0.0,
+            "avgSavedMs": round(saved.sum / saved.count * 1000) if saved.count else 0,
+            "totalSavedMs": round(saved.sum * 1000),
+        }
+
+
+speculation_policy = SpeculationPolicy()
@@ -0,0 +1,105 @@
+"""
+Stage Dependency Graph
+
+Runs the stages of a pipeline concurrently with asyncio: each stage starts
+as soon as the stages it depends on have finished. Per-stage timings are
+recorded so the critical path of a request is visible, and each stage is a
+span of the current request trace (see tracing.py).
+
+Usage:
+    graph = StageGraph("data_analysis")
+    graph.add("query", run_query, offload=True)
+    graph.add("chart", build_chart, deps=["query"], offload=True)
+    graph.add("narrative", write_narrative, deps=["query"])
+    results = await graph.run()
+"""
+
+import asyncio
+import inspect
+import time
+from typing import Callable
+
+from metrics import Histogram
+from tracing import span
+
+STAGE_SECONDS = Histogram("pipeline_stage_seconds", "Duration of pipeline stages", ["pipeline", "stage"])
+
+
+class StageGraph:
+    """A small DAG of named stages.
+
+    Stage functions receive the results of their dependencies as keyword
+    arguments. Coroutine functions are awaited; plain functions run inline,
+    or in a worker thread when `offload=True` (blocking or CPU-bound work).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._stages = {}  # name -> (fn, deps, offload)
+        self.timings = {}  # name -> {"startMs", "endMs", "durationMs"}
+
+    def add(self, name: str, fn: Callable, deps=(), offload: bool = False) -> None:
+        for dep in deps:
+            if dep not in self._stages:
+                raise ValueError(f"Stage '{name}' depends on unknown stage '{dep}'")
+        self._stages[name] = (fn, tuple(deps), offload)
+
+    async def run(self) -> dict:
+        """Run all stages and return {stage name: result}.
+
+        If a stage fails, the stages still running are cancelled and the
+        error is raised.
+        """
+        started_at = time.perf_counter()
+        tasks = {}
+
+        async def run_stage(name: str):
+            fn, deps, offload = self._stages[name]
+            inputs = {dep: await tasks[dep] for dep in deps}
+            stage_start = time.perf_counter()
+            with span(f"stage.{self.name}.{name}"):
+                if inspect.iscoroutinefunction(fn):
+                    result = await fn(**inputs)
+                elif offload:
+                    result = await asyncio.to_thread(fn, **inputs)
+                else:
+                    result = fn(**inputs)
+            stage_end = time.perf_counter()
+            self.timings[name] = {
+                "startMs": round((stage_start - started_at) * 1000, 1),
+                "endMs": round((stage_end - started_at) * 1000, 1),
+                "durationMs": round((stage_end - stage_start) * 1000, 1),
+            }
+            STAGE_SECONDS.labels(self.name, name).observe(stage_end - stage_start)
+            return result
+
+        # Stages are registered after their dependencies, so tasks exist when awaited
+        for name in self._stages:
+            tasks[name] = asyncio.ensure_future(run_stage(name))
+
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+        return {name: task.result() for name, task in tasks.items()}
+
+    def critical_path(self) -> list:
+        """Stages on the longest dependency chain, ending at the last stage to finish."""
+        if not self.timings:
+            return []
+        current = max(self.timings, key=lambda name: self.timings[name]["endMs"])
+        path = [current]
+        while True:
+            deps = self._stages[current][1]
+            if not deps:
+                break
+            current = max(deps, key=lambda dep: self.timings[dep]["endMs"])
+            path.append(current)
+        return list(reversed(path))
+
+    def describe(self) -> str:
+        """One-line summary for logs, e.g. "query=12ms chart=3ms | critical: query → narrative"."""
+        stages = " ".join(f"{name}={t['durationMs']:.0f}ms" for name, t in self.timings.items())
+        return f"{stages} | critical: {' → '.join(self.critical_path())}"
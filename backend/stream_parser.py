@@ -0,0 +1,88 @@
+"""
+Incremental JSON Array Parser
+
+Extracts complete objects from a JSON array while it is still being
+generated, so research tables can be streamed row by row instead of
+waiting for the whole Gemini response.
+
+Usage:
+    parser = IncrementalArrayParser()
+    async for chunk in response:
+        for row in parser.feed(chunk.text):
+            yield row
+"""
+
+import json
+
+
+class IncrementalArrayParser:
+    """Yields each top-level object of the first JSON array in a token stream.
+
+    Markdown fences and any text before the opening bracket are ignored.
+    The full text is kept in `buffer` so callers can fall back to a regular
+    parse when the model does not return an array of objects.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.rows_emitted = 0
+        self.closed = False
+        self._pos = 0            # next character to scan
+        self._in_array = False
+        self._depth = 0          # nesting depth inside the current element
+        self._in_string = False
+        self._escaped = False
+        self._start = None       # buffer index where the current object began
+
+    def feed(self, text: str) -> list:
+        """Consume more text and return the objects completed by it."""
+        self.buffer += text
+        completed = []
+        buffer = self.buffer
+        pos = self._pos
+
+        while pos < len(buffer) and not self.closed:
+            ch = buffer[pos]
+
+            if not self._in_array:
+                if ch == "[":
+                    self._in_array = True
+                pos += 1
+                continue
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                if self._depth == 0 and ch == "{":
+                    self._start = pos
+                self._depth += 1
+            elif ch in "}]":
+                if self._depth == 0 and ch == "]":
+                    self.closed = True
+                else:
+                    self._depth -= 1
+                    if self._depth == 0 and self._start is not None:
+                        row = self._decode(buffer[self._start:pos + 1])
+                        if row is not None:
+                            completed.append(row)
+                        self._start = None
+            pos += 1
+
+        self._pos = pos
+        self.rows_emitted += len(completed)
+        return completed
+
+    @staticmethod
+    def _decode(segment: str):
+        try:
+            row = json.loads(segment)
+        except json.JSONDecodeError:
+            return None
+        return row if isinstance(row, dict) else None
@@ -0,0 +1,107 @@
+"""
+Test suite for client-disconnect cancellation (no API key needed)
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cancellation import (
+    CANCELLED_WORK,
+    CancelToken,
+    OperationCancelled,
+    _token,
+    cancel_on_disconnect,
+    check_cancelled,
+    current_token,
+)
+from singleflight import SyncSingleFlight
+
+
+async def _test_token_reaches_worker_threads():
+    token = CancelToken()
+    _token.set(token)
+    checked = []
+
+    def tool():
+        for _ in range(100):
+            try:
+                check_cancelled()
+            except OperationCancelled:
+                checked.append("stopped")
+                return
+            time.sleep(0.01)
+        checked.append("finished")
+
+    worker = asyncio.create_task(asyncio.to_thread(tool))
+    await asyncio.sleep(0.05)
+    token.cancel()
+    await worker
+    assert checked == ["stopped"], checked
+    _token.set(None)
+    print("✅ blocking tools see the request's cancellation")
+
+
+async def _test_disconnect_cancels_stream():
+    before = CANCELLED_WORK.labels("request").value
+    closed = []
+    tokens = []
+
+    async def endpoint_stream():
+        try:
+            tokens.append(current_token())
+            for i in range(10):
+                yield f"chunk {i}\n"
+                await asyncio.sleep(0.01)
+        finally:
+            closed.append(True)
+
+    wrapped = cancel_on_disconnect(endpoint_stream(), "agent")
+    assert await wrapped.__anext__() == "chunk 0\n"
+    # Starlette closes the body iterator when the client goes away
+    await wrapped.aclose()
+
+    assert closed == [True], "inner stream must be closed"
+    assert tokens[0].cancelled
+    assert CANCELLED_WORK.labels("request").value == before + 1
+
+    finished = [chunk async for chunk in cancel_on_disconnect(endpoint_stream(), "agent")]
+    assert len(finished) == 10
+    assert CANCELLED_WORK.labels("request").value == before + 1, "completed streams are not cancellations"
+    print("✅ disconnect cancels the request and closes its stream")
+
+
+def test_follower_survives_leader_cancellation():
+    flight = SyncSingleFlight("test_cancel")
+    leader_started = threading.Event()
+    results = []
+
+    def cancelled_leader():
+        leader_started.set()
+        time.sleep(0.05)
+        raise OperationCancelled()
+
+    def follower():
+        leader_started.wait()
+        results.append(flight.do("nov", lambda: '{"data": []}'))
+
+    thread = threading.Thread(target=follower)
+    thread.start()
+    try:
+        flight.do("nov", cancelled_leader)
+    except OperationCancelled:
+        pass
+    thread.join()
+    assert results == ['{"data": []}'], results
+    print("✅ coalesced callers rerun when the leader's client disconnects")
+
+
+if __name__ == "__main__":
+    asyncio.run(_test_token_reaches_worker_threads())
+    asyncio.run(_test_disconnect_cancels_stream())
+    test_follower_survives_leader_cancellation()
+    print("\nAll cancellation tests passed")
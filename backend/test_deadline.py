@@ -0,0 +1,93 @@
+"""
+Test suite for deadline budgets and hedged requests (no API key needed)
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from deadline import DeadlineExceeded, deadline_scope, remaining, run_stage, stage_report
+from hedging import Hedger
+
+
+async def _test_stage_budgets():
+    async def slow():
+        await asyncio.sleep(1)
+        return "llm"
+
+    with deadline_scope(0.1) as deadline:
+        assert abs(deadline.stage_budget("routing") - 0.02) < 0.005, "routing gets 20% of the budget"
+        result = await run_stage("routing", slow, fallback=lambda: "heuristic")
+        assert result == "heuristic"
+
+        async def child():
+            return remaining()
+        assert await asyncio.create_task(child()) <= 0.1, "tasks inherit the request deadline"
+
+        try:
+            await run_stage("query", slow)
+            raise AssertionError("a stage without fallback must raise")
+        except DeadlineExceeded:
+            pass
+
+    assert remaining() is None, "no deadline outside the scope"
+    assert await run_stage("narrative", lambda: asyncio.sleep(0, "fast")) == "fast"
+
+    report = stage_report()
+    assert report["routing"]["hedging_on"]["fallbacks"] >= 1 or report["routing"]["hedging_off"]["fallbacks"] >= 1
+    print("✅ stages fall back when their budget runs out")
+
+
+async def _test_hedging():
+    hedger = Hedger(enabled=True, min_samples=5, max_ratio=1.0)
+    for _ in range(5):
+        hedger.record(0.01, "router")
+        hedger.record(2.0, "research")
+    assert hedger.hedge_delay("router") == 0.01
+    assert hedger.hedge_delay("research") == 2.0, "each call site is hedged at its own p95"
+    assert hedger.hedge_delay("chat") is None, "no hedging before a site has enough samples"
+
+    attempts = []
+
+    async def flaky(admitted):
+        admitted()
+        attempts.append(1)
+        # The first attempt hits the slow tail, the duplicate is fast
+        await asyncio.sleep(1 if len(attempts) == 1 else 0.01)
+        return len(attempts)
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    result = await hedger.run(flaky, "router")
+    assert loop.time() - started < 0.5, "the hedge wins over the slow primary"
+    assert len(attempts) == 2 and result == 2
+
+    queued = Hedger(enabled=True, min_samples=5, max_ratio=1.0)
+    for _ in range(5):
+        queued.record(0.05, "router")
+    calls = []
+
+    async def behind_the_limit(admitted):
+        calls.append(1)
+        await asyncio.sleep(0.2)  # waiting for a gateway slot
+        admitted()
+        await asyncio.sleep(0.01)
+        return "ok"
+
+    assert await queued.run(behind_the_limit, "router") == "ok"
+    assert len(calls) == 1, "time queued before admission does not trigger a hedge"
+    assert max(queued._latencies["router"]) < 0.1, "latency is measured from admission"
+
+    capped = Hedger(enabled=True, min_samples=1, max_ratio=0.0)
+    capped.record(0.001)
+    assert capped.hedge_delay("other") is None, "hedges are capped"
+    assert Hedger(enabled=False).hedge_delay() is None
+    print("✅ slow calls are hedged and the first result wins")
+
+
+if __name__ == "__main__":
+    asyncio.run(_test_stage_budgets())
+    asyncio.run(_test_hedging())
+    print("\nAll deadline tests passed")
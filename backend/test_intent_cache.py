@@ -0,0 +1,74 @@
+"""
+Test suite for the intent classification cache (no API key needed)
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from intent_cache import (
+    TTLCache,
+    make_cache_key,
+    lookup_seeded_intent,
+    research_suggestions,
+    to_legacy_intent,
+    DATA_ANALYSIS_SUGGESTIONS,
+)
+
+
+def test_ttl_and_eviction():
+    cache = TTLCache(max_entries=2, ttl_seconds=0.05)
+    cache.set("a", {"intent": "research"})
+    cache.set("b", {"intent": "explanation"})
+    assert cache.get("a")["intent"] == "research"  # "a" becomes most recent
+    cache.set("c", {"intent": "followup"})
+    assert cache.get("b") is None, "least recently used entry should be evicted"
+    assert cache.get("a") is not None
+    time.sleep(0.06)
+    assert cache.get("a") is None, "entry should expire after TTL"
+    print("✅ TTL expiry and LRU eviction work.")
+
+
+def test_cache_returns_copies():
+    cache = TTLCache()
+    cache.set("k", {"entities": {"keywords": ["crypto"]}})
+    cache.get("k")["entities"]["keywords"].append("forex")
+    assert cache.get("k")["entities"]["keywords"] == ["crypto"]
+    print("✅ Cached values are isolated from caller mutation.")
+
+
+def test_cache_key_normalization():
+    assert make_cache_key("  Chi phí   TUẦN này? ", []) == make_cache_key("chi phí tuần này", [])
+    assert make_cache_key("Crypto", ["user: Forex"]) != make_cache_key("Crypto", ["user: Beauty"])
+    # Only the recent context window matters
+    old = ["user: a", "user: b", "user: c", "user: d"]
+    assert make_cache_key("x", old) == make_cache_key("x", ["user: z"] + old)
+    print("✅ Cache keys normalize queries and hash recent context.")
+
+
+def test_seeded_suggestions():
+    previous = {"filters": {"timeRange": "tháng 11", "program": "Shopee", "keywords": None}}
+    for suggestion in DATA_ANALYSIS_SUGGESTIONS:
+        result = lookup_seeded_intent(suggestion, previous)
+        assert result is not None, suggestion
+        assert result["entities"]["program"] == "Shopee"
+    assert lookup_seeded_intent("Phân tích theo chiến dịch")["entities"]["group_by"] == "campaign"
+
+    for suggestion in research_suggestions("Crypto"):
+        assert lookup_seeded_intent(suggestion, {"niche": "Crypto"}) is not None, suggestion
+    more = lookup_seeded_intent("Thêm programs trong lĩnh vực Crypto")
+    assert more["intent"] == "research" and more["entities"]["niche"] == "Crypto" and more["entities"]["expand"]
+    assert lookup_seeded_intent("Ngách liên quan khác", {"niche": "Forex"})["entities"]["niche"].endswith("Forex")
+
+    assert lookup_seeded_intent("Chi phí tháng 11") is None
+    assert to_legacy_intent("comparison") == "followup"
+    print("✅ Workflow follow-up suggestions are pre-seeded.")
+
+
+if __name__ == "__main__":
+    test_ttl_and_eviction()
+    test_cache_returns_copies()
+    test_cache_key_normalization()
+    test_seeded_suggestions()
@@ -0,0 +1,164 @@
+"""
+Test suite for the pluggable LLM backend and the offline fake (no API key needed)
+"""
+
+import asyncio
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ["LLM_BACKEND"] = "fake"
+
+from fake_llm import FakeLLM, FakeLLMError, parse_latency, respond
+from llm_backend import FakeBackend, HTTPBackend, LLMBackend, create_backend
+from llm_client import set_backend
+from llm_gateway import is_rate_limit_error
+from router import ROUTER_PROMPT, RouteResult, route, route_cache
+from generator import PROMPT_TEMPLATE, fetch_research_table, parse_research_buffer
+
+FAST = dict(latency="fixed:1", chunk_ms=0, seed=1)
+
+
+def test_latency_specs():
+    rng = random.Random(0)
+    assert parse_latency("fixed:250")(rng) == 0.25
+    assert all(0.1 <= parse_latency("uniform:100:300")(rng) <= 0.3 for _ in range(100))
+    samples = sorted(parse_latency("lognormal:500:0.5")(rng) for _ in range(2000))
+    assert 0.45 < samples[1000] < 0.55, samples[1000]
+    try:
+        parse_latency("gaussian:1")
+        assert False, "unknown distributions are rejected"
+    except ValueError:
+        pass
+    print("✅ latency distributions")
+
+
+def test_schema_valid_responses():
+    routed = json.loads(respond(ROUTER_PROMPT.format(query="Chi phí tuần này", context="Chưa có")))
+    assert set(routed) == {"intent", "confidence", "entities"}
+    assert RouteResult.from_dict(routed, source="llm").intent == "data_analysis"
+    research_route = json.loads(respond(ROUTER_PROMPT.format(query="Crypto", context="Chưa có")))
+    assert research_route["intent"] == "research" and research_route["entities"]["niche"] == "Crypto"
+
+    programs = parse_research_buffer(respond(PROMPT_TEMPLATE.format(niche="Crypto", context="")))
+    assert 5 <= len(programs) <= 10
+    for program in programs:
+        assert set(program) == {
+            "brand", "program_url", "commission_percent", "commission_type",
+            "can_use_brand", "traffic_3m", "legitimacy_score",
+        }
+    assert programs == parse_research_buffer(respond(PROMPT_TEMPLATE.format(niche="Crypto", context="")))
+
+    narrative = respond("Bạn là một chuyên gia phân tích quảng cáo.\nDữ liệu tổng hợp (tuần này):\n- Clicks: 1,234\n")
+    assert "1,234" in narrative and "tuần này" in narrative
+    print("✅ intent JSON, research arrays and narratives")
+
+
+async def _test_stream_timing():
+    fake = FakeLLM(latency="fixed:50", chunk_ms=20, chunk_chars=50, seed=1)
+    prompt = PROMPT_TEMPLATE.format(niche="Forex", context="")
+    started = time.perf_counter()
+    arrivals, chunks = [], []
+    async for chunk in fake.stream(prompt):
+        arrivals.append(time.perf_counter() - started)
+        chunks.append(chunk)
+    assert "".join(chunks) == respond(prompt)
+    assert all(len(chunk) <= 50 for chunk in chunks)
+    assert arrivals[0] >= 0.05, arrivals[0]
+    assert arrivals[-1] - arrivals[0] >= 0.02 * (len(chunks) - 1) * 0.9
+    print(f"✅ streamed {len(chunks)} chunks, first after {arrivals[0] * 1000:.0f}ms")
+
+
+async def _test_injected_failures():
+    try:
+        await FakeLLM(**{**FAST, "rate_limit_rate": 1}).generate("x")
+        assert False, "rate limit should be injected"
+    except FakeLLMError as e:
+        assert e.status == 429 and is_rate_limit_error(e)
+    try:
+        await FakeLLM(**{**FAST, "error_rate": 1}).generate("x")
+        assert False, "error should be injected"
+    except FakeLLMError as e:
+        assert e.status == 500 and not is_rate_limit_error(e)
+    print("✅ injected errors and rate limits")
+
+
+async def _test_client_paths():
+    assert isinstance(create_backend("fake"), FakeBackend)
+    set_backend(FakeBackend(FakeLLM(**FAST)))
+    route_cache.clear()
+
+    routed = await route("Liệt kê các chiến dịch")
+    assert routed.source == "llm" and routed.intent == "data_query"
+
+    table = await fetch_research_table("Du lịch")
+    assert 5 <= len(table) <= 10
+    print("✅ router and research run end-to-end on the fake backend")
+
+
+def test_http_stand_in():
+    try:
+        import uvicorn
+        from fake_llm_server import app, fake
+    except ImportError:
+        print("⚠️  fastapi/uvicorn not installed, HTTP stand-in skipped")
+        return
+
+    fake.sample_latency = parse_latency("fixed:1")
+    fake.chunk_seconds = 0
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=8091, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+
+    backend = HTTPBackend("http://127.0.0.1:8091")
+    prompt = PROMPT_TEMPLATE.format(niche="Crypto", context="")
+
+    async def fetch():
+        text = await backend.generate(prompt, "fake")
+        streamed = "".join([chunk async for chunk in backend.stream(prompt, "fake")])
+        return text, streamed
+
+    text, streamed = asyncio.run(fetch())
+    assert text == streamed == respond(prompt)
+
+    fake.rate_limit_rate = 1
+    try:
+        backend.generate_sync(prompt, "fake")
+        assert False, "429 should surface as an error"
+    except Exception as e:
+        assert is_rate_limit_error(e), e
+    server.should_exit = True
+    thread.join()
+    print("✅ HTTP stand-in serves the same responses and status codes")
+
+
+def test_backend_is_abstract():
+    class Incomplete(LLMBackend):
+        async def generate(self, prompt, model, json_mode=False):
+            return ""
+
+    for cls in (LLMBackend, Incomplete):
+        try:
+            cls()
+            raise AssertionError(f"{cls.__name__} must not be instantiable")
+        except TypeError:
+            pass
+    assert isinstance(create_backend("fake"), LLMBackend)
+    print("✅ backends must implement generate, generate_sync and stream")
+
+
+if __name__ == "__main__":
+    test_backend_is_abstract()
+    test_latency_specs()
+    test_schema_valid_responses()
+    asyncio.run(_test_stream_timing())
+    asyncio.run(_test_injected_failures())
+    asyncio.run(_test_client_paths())
+    test_http_stand_in()
+    print("\nAll LLM backend tests passed")
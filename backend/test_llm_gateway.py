@@ -0,0 +1,208 @@
+"""
+Test suite for the LLM gateway: adaptive limit, wait queue, circuit breaker
+(no API key needed)
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from llm_gateway import AdaptiveLimiter, CircuitBreaker, LLMGateway, LLMUnavailable
+
+
+class RateLimited(Exception):
+    """Stand-in for google.api_core ResourceExhausted (429)."""
+
+    def __str__(self):
+        return "429 ResourceExhausted"
+
+
+async def _test_limit_and_queue():
+    gateway = LLMGateway(AdaptiveLimiter(initial=2, minimum=1, maximum=2, queue_size=2, queue_timeout=1))
+    running = peak = 0
+
+    async def upstream():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.02)
+        running -= 1
+        return "ok"
+
+    results = await asyncio.gather(*(gateway.run(upstream) for _ in range(4)), return_exceptions=True)
+    assert results == ["ok"] * 4
+    assert peak == 2, f"at most 2 calls upstream at once, saw {peak}"
+
+    outcomes = await asyncio.gather(*(gateway.run(upstream) for _ in range(6)), return_exceptions=True)
+    rejected = [o for o in outcomes if isinstance(o, LLMUnavailable)]
+    assert len(rejected) == 2 and rejected[0].reason == "queue_full", "calls beyond limit + queue are rejected"
+    print("✅ concurrency limit and bounded queue")
+
+
+async def _test_queue_timeout():
+    gateway = LLMGateway(AdaptiveLimiter(initial=1, minimum=1, maximum=1, queue_size=4, queue_timeout=0.02))
+
+    async def slow():
+        await asyncio.sleep(0.1)
+
+    outcomes = await asyncio.gather(gateway.run(slow), gateway.run(slow), return_exceptions=True)
+    assert outcomes[0] is None
+    assert isinstance(outcomes[1], LLMUnavailable) and outcomes[1].reason == "queue_timeout"
+    assert gateway.limiter.inflight == 0 and gateway.limiter.queued == 0
+    print("✅ queue wait timeout")
+
+
+async def _test_adaptive_limit():
+    limiter = AdaptiveLimiter(initial=8, minimum=2, maximum=16)
+    limiter.on_failure(RateLimited())
+    assert limiter.limit == 4, "rate limits halve the limit"
+    limiter.on_failure(ValueError("boom"))
+    assert abs(limiter.limit - 3.2) < 1e-9
+    for _ in range(5):
+        limiter.on_failure(RateLimited())
+    assert limiter.limit == 2, "never below the minimum"
+
+    limiter.inflight = 1
+    for _ in range(20):
+        limiter.on_success(0.1)
+    assert limiter.limit > 2, "steady latency grows the limit while it is used"
+    grown = limiter.limit
+    for _ in range(5):
+        limiter.on_success(1.0)
+    assert limiter.limit < grown, "latency spikes shrink the limit"
+    print("✅ adaptive limit reacts to errors and latency")
+
+
+async def _test_circuit_breaker():
+    gateway = LLMGateway(
+        AdaptiveLimiter(initial=4, minimum=1, maximum=4),
+        CircuitBreaker(failure_rate=0.5, min_calls=4, window=4, cooldown_seconds=0.05),
+    )
+
+    async def failing():
+        raise RateLimited()
+
+    async def healthy():
+        return "ok"
+
+    for _ in range(4):
+        try:
+            await gateway.run(failing)
+        except RateLimited:
+            pass
+    assert gateway.is_open()
+    try:
+        await gateway.run(healthy)
+        raise AssertionError("open breaker must reject calls")
+    except LLMUnavailable as e:
+        assert e.reason == "circuit_open"
+
+    time.sleep(0.06)
+    assert not gateway.is_open()
+    assert await gateway.run(healthy) == "ok", "half-open probe goes through"
+    assert gateway.breaker.state == "closed"
+    print("✅ circuit breaker opens, fails fast and recovers")
+
+
+async def _test_stream():
+    gateway = LLMGateway(AdaptiveLimiter(initial=1, minimum=1, maximum=1))
+
+    async def chunks():
+        for text in ["[", "]"]:
+            yield text
+
+    assert [c async for c in gateway.stream(chunks)] == ["[", "]"]
+    assert gateway.limiter.inflight == 0, "slot released after the stream"
+    print("✅ streamed calls hold one slot")
+
+
+async def _test_run_sync():
+    gateway = LLMGateway(
+        AdaptiveLimiter(initial=1, minimum=1, maximum=1, queue_size=4, queue_timeout=1),
+        CircuitBreaker(failure_rate=0.5, min_calls=2, window=2, cooldown_seconds=0.05),
+    )
+    gateway.limiter.bind_loop(asyncio.get_running_loop())
+    lock = threading.Lock()
+    running = peak = 0
+
+    def upstream():
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        time.sleep(0.02)
+        with lock:
+            running -= 1
+        return "ok"
+
+    results = await asyncio.gather(*(asyncio.to_thread(gateway.run_sync, upstream) for _ in range(3)))
+    assert results == ["ok"] * 3
+    assert peak == 1, f"worker threads share the limit, saw {peak} calls at once"
+    await asyncio.sleep(0)
+    assert gateway.limiter.inflight == 0 and gateway.limiter.queued == 0
+
+    gateway.breaker._open()
+    time.sleep(0.06)
+    release = threading.Event()
+
+    def probe():
+        release.wait(1)
+        return "ok"
+
+    probing = asyncio.create_task(asyncio.to_thread(gateway.run_sync, probe))
+    while not gateway.breaker._probing:
+        await asyncio.sleep(0.001)
+    try:
+        await asyncio.to_thread(gateway.run_sync, upstream)
+        raise AssertionError("only the half-open probe may go through")
+    except LLMUnavailable as e:
+        assert e.reason == "circuit_open"
+    release.set()
+    assert await probing == "ok"
+    await asyncio.sleep(0)
+    assert gateway.breaker.state == "closed", "a successful sync probe closes the breaker"
+    print("✅ blocking calls share the limit and the half-open probe")
+
+
+def test_run_sync_without_loop():
+    gateway = LLMGateway(AdaptiveLimiter(initial=1, minimum=1, maximum=1))
+    assert gateway.run_sync(lambda: "ok") == "ok"
+    assert gateway.limiter.inflight == 0
+    gateway.limiter.inflight = 1
+    try:
+        gateway.run_sync(lambda: "ok")
+        raise AssertionError("no free slot and no loop to wait on")
+    except LLMUnavailable as e:
+        assert e.reason == "queue_full"
+    print("✅ blocking calls without an event loop take a free slot or are refused")
+
+
+def test_degraded_narrative():
+    import narrative_templates
+    from llm_gateway import llm_gateway
+
+    policy = narrative_templates.NarrativePolicy(mode="llm")
+    assert policy.choose("Tại sao chi phí tăng?") == "llm"
+    llm_gateway.breaker._open()
+    try:
+        assert policy.choose("Tại sao chi phí tăng?") == "template", "open breaker forces templates"
+    finally:
+        llm_gateway.breaker.record(failed=False)
+        llm_gateway.breaker._set_state("closed")
+    print("✅ narratives degrade to templates while the breaker is open")
+
+
+if __name__ == "__main__":
+    asyncio.run(_test_limit_and_queue())
+    asyncio.run(_test_queue_timeout())
+    asyncio.run(_test_adaptive_limit())
+    asyncio.run(_test_circuit_breaker())
+    asyncio.run(_test_stream())
+    asyncio.run(_test_run_sync())
+    test_run_sync_without_loop()
+    test_degraded_narrative()
+    print("\nAll LLM gateway tests passed")
@@ -0,0 +1,154 @@
+"""
+Test suite for the queued, sampled JSON logging pipeline (no API key needed)
+"""
+
+import asyncio
+import io
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import log_pipeline
+from log_pipeline import LOG_RECORDS_DROPPED, JsonFormatter, configure_logging, flush_logs, shutdown_logging, verbose_scope
+from tracing import trace_scope
+
+logger = logging.getLogger("AI_AGENT")
+
+
+@contextmanager
+def _pipeline():
+    """A pipeline of its own for one test, writing to a stream the test reads."""
+    shutdown_logging()  # configure_logging() is a no-op while another pipeline runs
+    stream = io.StringIO()
+    configure_logging(stream)
+    try:
+        yield stream
+    finally:
+        shutdown_logging()
+
+
+def _entries(stream: io.StringIO) -> list:
+    flush_logs()
+    lines = stream.getvalue().splitlines()
+    stream.seek(0)
+    stream.truncate()
+    return [json.loads(line) for line in lines]
+
+
+class FormattedOn:
+    """Records the thread its message was formatted on."""
+
+    def __init__(self):
+        self.thread = None
+
+    def __str__(self):
+        self.thread = threading.current_thread().name
+        return "entities"
+
+
+def test_json_output():
+    with _pipeline() as stream:
+        with trace_scope("test.logging", "req-log-1"):
+            logger.info("Route: %s", "data_query", extra={"intent": "data_query"})
+        logging.getLogger("ROUTER").warning("no request")
+        first, second = _entries(stream)
+    assert first["level"] == "INFO" and first["logger"] == "AI_AGENT"
+    assert first["msg"] == "Route: data_query" and first["requestId"] == "req-log-1"
+    assert first["intent"] == "data_query"
+    assert "requestId" not in second
+    print("✅ records are written as JSON with the request id and extra fields")
+
+
+def test_lazy_formatting():
+    # Its own queue handler and listener on a non-propagating logger: handlers
+    # on the root logger (pytest's capture) would format in the caller's thread
+    log_queue = queue.Queue()
+    captured = io.StringIO()
+    target = logging.StreamHandler(captured)
+    target.setFormatter(JsonFormatter())
+    listener = logging.handlers.QueueListener(log_queue, target)
+    handler = log_pipeline._QueueHandler(log_queue)
+    isolated = logging.getLogger("AI_AGENT.lazy_formatting")
+    isolated.propagate = False
+    isolated.setLevel(logging.DEBUG)
+    isolated.addHandler(handler)
+    listener.start()
+
+    value = FormattedOn()
+    try:
+        isolated.debug("Entities: %s", value)
+    finally:
+        listener.stop()  # drains the queue
+        isolated.removeHandler(handler)
+    [entry] = [json.loads(line) for line in captured.getvalue().splitlines()]
+    assert entry["msg"] == "Entities: entities"
+    assert value.thread != threading.current_thread().name, "message formatted on the caller's thread"
+    print("✅ messages are formatted on the listener thread")
+
+
+async def _test_debug_is_per_request():
+    async def request(verbose: bool, request_id: str):
+        with trace_scope("test.logging", request_id), verbose_scope(verbose):
+            await asyncio.sleep(0)
+            # Child tasks and worker threads inherit the setting
+            await asyncio.create_task(asyncio.to_thread(logger.debug, "debug from %s", request_id))
+            logger.info("info from %s", request_id)
+
+    with _pipeline() as stream:
+        await asyncio.gather(request(True, "req-verbose"), request(False, "req-quiet"))
+        entries = _entries(stream)
+    debug = [(e["requestId"], e["msg"]) for e in entries if e["level"] == "DEBUG"]
+    assert debug == [("req-verbose", "debug from req-verbose")], debug
+    assert sum(e["level"] == "INFO" for e in entries) == 2
+    print("✅ DEBUG lines are kept for verbose requests only")
+
+
+def test_sampling():
+    random.seed(7)
+    log_pipeline.LOG_DEBUG_SAMPLE_RATES["AI_AGENT"] = 0.1
+    try:
+        with _pipeline() as stream:
+            for index in range(2000):
+                logger.debug("sampled %d", index)
+                logging.getLogger("ROUTER").debug("unsampled %d", index)
+            entries = _entries(stream)
+    finally:
+        del log_pipeline.LOG_DEBUG_SAMPLE_RATES["AI_AGENT"]
+    assert all(e["logger"] == "AI_AGENT" for e in entries)
+    assert 140 < len(entries) < 260, len(entries)
+    print("✅ DEBUG lines are sampled per logger")
+
+
+def test_full_queue_drops():
+    dropped = LOG_RECORDS_DROPPED.labels("queue_full").value
+    queue_size, log_pipeline.LOG_QUEUE_SIZE = log_pipeline.LOG_QUEUE_SIZE, 5
+    try:
+        with _pipeline() as stream:
+            log_pipeline._listener.stop()  # nothing drains the queue
+            try:
+                for index in range(8):
+                    logger.info("burst %d", index)
+                assert LOG_RECORDS_DROPPED.labels("queue_full").value == dropped + 3
+            finally:
+                log_pipeline._listener.start()
+            assert len(_entries(stream)) == 5
+    finally:
+        log_pipeline.LOG_QUEUE_SIZE = queue_size
+    print("✅ a full queue drops records instead of blocking")
+
+
+if __name__ == "__main__":
+    test_json_output()
+    test_lazy_formatting()
+    asyncio.run(_test_debug_is_per_request())
+    test_sampling()
+    test_full_queue_drops()
+    print("\nAll logging pipeline tests passed")
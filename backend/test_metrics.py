@@ -0,0 +1,122 @@
+"""
+Test suite for the Prometheus exposition and request / LLM metrics (no API key needed)
+"""
+
+import asyncio
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ["LLM_BACKEND"] = "fake"
+
+import metrics
+from metrics import Counter, Gauge, Histogram
+from request_metrics import REQUESTS, REQUEST_SECONDS, STREAMS_INFLIGHT, observe_stream, set_intent
+from fake_llm import FakeLLM
+from llm_backend import FakeBackend
+from llm_client import LLM_CALLS, LLM_TOKENS, generate_text, set_backend
+
+
+def _lines(name: str) -> list:
+    return [line for line in metrics.exposition().splitlines() if line.startswith(name)]
+
+
+def test_exposition_format():
+    counter = Counter("test_expo_total", "A \\ counter\nwith two lines", ["path"])
+    counter.labels('a"b').inc(3)
+    histogram = Histogram("test_expo_seconds", "Latency", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value)
+    gauge = Gauge("test_expo_ratio", "Computed on scrape")
+    gauge.set_function(lambda: 0.25)
+
+    text = metrics.exposition()
+    assert "# HELP test_expo_total A \\\\ counter\\nwith two lines" in text
+    assert "# TYPE test_expo_total counter" in text
+    assert 'test_expo_total{path="a\\"b"} 3' in text
+    assert _lines("test_expo_seconds_bucket") == [
+        'test_expo_seconds_bucket{le="0.1"} 1',
+        'test_expo_seconds_bucket{le="1"} 2',
+        'test_expo_seconds_bucket{le="+Inf"} 3',
+    ]
+    assert _lines("test_expo_seconds_count") == ["test_expo_seconds_count 3"]
+    assert _lines("test_expo_seconds_sum") == ["test_expo_seconds_sum 5.55"]
+    assert _lines("test_expo_ratio") == ["test_expo_ratio 0.25"]
+    assert metrics.snapshot()["test_expo_ratio"]["samples"][0]["value"] == 0.25
+
+    broken = Gauge("test_expo_broken", "Function raising")
+    broken.set_function(lambda: 1 / 0)
+    assert _lines("test_expo_broken") == ["test_expo_broken NaN"]
+    print("✅ Prometheus text exposition (escaping, cumulative buckets, computed gauges)")
+
+
+async def _test_stream_metrics():
+    async def agent_stream():
+        # The intent is learned in a child task, as in the agent workflow
+        await asyncio.create_task(asyncio.sleep(0, result=set_intent("data_query")))
+        assert STREAMS_INFLIGHT.labels("test_agent").value == 1
+        yield "a\n"
+        yield "b\n"
+
+    chunks = [chunk async for chunk in observe_stream(agent_stream(), "test_agent")]
+    assert chunks == ["a\n", "b\n"]
+    assert REQUESTS.labels("test_agent", "data_query", "ok").value == 1
+    assert REQUEST_SECONDS.labels("test_agent", "data_query").count == 1
+    assert STREAMS_INFLIGHT.labels("test_agent").value == 0
+
+    wrapped = observe_stream(agent_stream(), "test_agent", intent="research")
+    await wrapped.__anext__()
+    await wrapped.aclose()
+    assert REQUESTS.labels("test_agent", "data_query", "cancelled").value == 1
+    assert STREAMS_INFLIGHT.labels("test_agent").value == 0
+    print("✅ request counts, latency and in-flight streams per endpoint and intent")
+
+
+async def _test_llm_site_metrics():
+    set_backend(FakeBackend(FakeLLM(latency="fixed:1", chunk_ms=0, seed=1)))
+    text = await generate_text("Giải thích CPC là gì", site="test_site")
+    assert LLM_CALLS.labels("test_site", "ok").value == 1
+    assert LLM_TOKENS.labels("test_site", "response").value == len(text) // 4
+
+    set_backend(FakeBackend(FakeLLM(latency="fixed:1", chunk_ms=0, seed=1, error_rate=1)))
+    try:
+        await generate_text("Giải thích ROAS", site="test_site")
+        assert False, "the injected error should surface"
+    except Exception:
+        pass
+    assert LLM_CALLS.labels("test_site", "error").value == 1
+    assert any(line.startswith('llm_call_seconds_count{site="test_site"} 2') for line in _lines("llm_call_seconds_count"))
+    print("✅ LLM calls, latency and estimated tokens per call site")
+
+
+def test_concurrent_updates():
+    counter = Counter("test_threads_total", "Concurrent increments")
+    histogram = Histogram("test_threads_seconds", "Concurrent observations", buckets=(1.0,))
+    switch = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # force thread switches in the middle of updates
+    try:
+        def record():
+            for _ in range(20000):
+                counter.inc()
+                histogram.observe(0.5)
+
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch)
+    assert counter.labels().value == 80000, "no increment is lost"
+    child = histogram.labels()
+    assert child.count == 80000 and child.counts[0] == 80000 and child.sum == 40000
+    print("✅ updates from several threads are not lost")
+
+
+if __name__ == "__main__":
+    test_exposition_format()
+    test_concurrent_updates()
+    asyncio.run(_test_stream_metrics())
+    asyncio.run(_test_llm_site_metrics())
+    print("\nAll metrics tests passed")
@@ -182,7 +182,7 @@ async def test_agent_intent():
         
         for q in queries:
             print(f"\nQuery: '{q}'")
-            result = classify_intent(q)
+            result = await classify_intent(q)
             print(f"Intent: {result.get('intent')}")
             print(f"Entities: {result.get('entities')}")
             
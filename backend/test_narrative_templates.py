@@ -0,0 +1,170 @@
+"""
+Test suite for templated data-answer narratives (no API key needed)
+"""
+
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("LLM_BACKEND", "fake")
+
+from narrative_templates import (
+    NarrativePolicy,
+    build_narrative,
+    focus_metrics,
+    is_simple_query,
+    period_deltas,
+    top_movers,
+)
+
+
+def day(date, cost, revenue, clicks=100, impressions=2000, entity=None):
+    row = {"date": date, "cost": cost, "revenue": revenue, "clicks": clicks, "impressions": impressions, "conversions": 1}
+    if entity:
+        row["entity"] = entity
+    return row
+
+
+def summary(rows):
+    cost = sum(r["cost"] for r in rows)
+    revenue = sum(r["revenue"] for r in rows)
+    return {
+        "totalClicks": sum(r["clicks"] for r in rows),
+        "totalCost": cost,
+        "totalRevenue": revenue,
+        "totalImpressions": sum(r["impressions"] for r in rows),
+        "avgROAS": round(revenue / cost, 2) if cost else 0,
+    }
+
+
+def with_previous(rows, previous_rows):
+    return {"data": rows, "summary": summary(rows), "previousPeriod": {"start": "", "end": "", "summary": summary(previous_rows)}}
+
+
+def test_period_deltas():
+    rows = [day("2025-11-03", 150, 300), day("2025-11-04", 150, 300)]
+    previous = [day("2025-11-01", 100, 300), day("2025-11-02", 100, 300)]
+    deltas = period_deltas(with_previous(rows, previous))
+    assert deltas["cost"]["previous"] == 200 and deltas["cost"]["current"] == 300
+    assert abs(deltas["cost"]["change"] - 0.5) < 1e-9
+    assert deltas["revenue"]["change"] == 0
+    assert period_deltas({"data": rows, "summary": summary(rows)}) == {}, "no previous period, no deltas"
+    print("✅ period-over-period deltas")
+
+
+def test_previous_period_from_tool():
+    from data_tools import QueryAdsCampaignsTool, db
+
+    result = json.loads(QueryAdsCampaignsTool()._run(json.dumps({"date_range": "last 7 days", "compare_previous": True})))
+    current, previous = result["dateRange"], result["previousPeriod"]
+    assert previous["end"] < current["start"], "the previous period ends before the requested one"
+    span = lambda r: date.fromisoformat(r["end"]) - date.fromisoformat(r["start"])
+    assert span(previous) == span(current), "both periods are equally long"
+    assert date.fromisoformat(previous["end"]) + timedelta(days=1) == date.fromisoformat(current["start"])
+    expected = sum(d["cost"] for d in db.daily_data if previous["start"] <= d["date"] <= previous["end"])
+    assert previous["summary"]["totalCost"] == expected
+    assert "previousPeriod" not in json.loads(QueryAdsCampaignsTool()._run(json.dumps({"date_range": "last 7 days"})))
+    assert QueryAdsCampaignsTool().previous_period({"date_range": "last 7 days"}) == previous, "computed on demand"
+    print("✅ the data tool returns the real previous period")
+
+
+def test_top_movers():
+    rows = [
+        day("2025-11-01", 100, 0, entity="A"), day("2025-11-02", 110, 0, entity="A"),
+        day("2025-11-01", 100, 0, entity="B"), day("2025-11-02", 400, 0, entity="B"),
+    ]
+    movers = top_movers(rows, "cost")
+    assert movers[0]["name"] == "B"
+    assert movers[0]["change"] == 3.0
+    print("✅ top movers")
+
+
+def test_build_narrative():
+    rows = [day("2025-11-01", 100_000, 300_000), day("2025-11-02", 200_000, 300_000)]
+    previous = [day("2025-10-30", 100_000, 300_000), day("2025-10-31", 50_000, 300_000)]
+    text = build_narrative("Chi phí tháng 11", with_previous(rows, previous), "tháng 11")
+    assert "600.000 ₫" in text
+    assert "Chi phí tăng **100%** so với kỳ trước (150.000 ₫ → 300.000 ₫)" in text
+    assert text == build_narrative("Chi phí tháng 11", with_previous(rows, previous), "tháng 11"), "deterministic"
+    assert "kỳ trước" not in build_narrative("Chi phí tháng 11", {"data": rows, "summary": summary(rows)}, "tháng 11")
+
+    grouped = [day("Account A", 300, 900), day("Account B", 100, 100)]
+    text = build_narrative("Chi phí theo tài khoản", {"data": grouped, "summary": summary(grouped)}, "last 30 days")
+    assert "**Account A** dẫn đầu với 75% tổng chi phí" in text
+
+    empty = build_narrative("Chi phí", {"data": [], "summary": {}}, "tuần này")
+    assert "Không có dữ liệu" in empty
+    print("✅ narrative text")
+
+
+def test_policy():
+    assert focus_metrics("ROAS và chi phí") == ["roas", "cost"]
+    assert is_simple_query("Chi phí tháng 11")
+    assert is_simple_query("ROAS 30 ngày qua")
+    assert not is_simple_query("Tại sao chi phí tăng?")
+    # Only single-metric lookups are simple
+    assert not is_simple_query("Chi phí và doanh thu tháng 11"), "two metrics"
+    assert not is_simple_query("So sánh chi phí tháng 10 và tháng 11"), "comparison"
+    assert not is_simple_query("Chi phí theo chiến dịch tháng 11"), "breakdown"
+    assert not is_simple_query("Tháng 11 chạy quảng cáo thế nào"), "no metric named"
+    assert not is_simple_query("Cho tôi xem chi phí quảng cáo của tất cả tài khoản trong tháng 11"), "long request"
+
+    policy = NarrativePolicy(mode="auto", max_llm_inflight=1)
+    assert policy.choose("Chi phí tháng 11") == "template"
+    assert policy.choose("Tại sao chi phí tăng?") == "llm"
+    with policy.track_llm():
+        assert policy.choose("Tại sao chi phí tăng?") == "template", "templates take over under load"
+    assert NarrativePolicy(mode="llm").choose("Chi phí") == "llm"
+    print("✅ narrative policy")
+
+
+async def _test_previous_period_only_for_templates():
+    import agents
+    from data_tools import QueryAdsCampaignsTool
+    from narrative_templates import narrative_policy
+
+    calls = []
+    original_period, original_mode = QueryAdsCampaignsTool.previous_period, narrative_policy.mode
+
+    def counting(self, params):
+        calls.append(params)
+        return original_period(self, params)
+
+    QueryAdsCampaignsTool.previous_period = counting
+    try:
+        narrative_policy.mode = "llm"
+        await agents.execute_data_analysis_crew("Chi phí 30 ngày qua", {"time_range": "last 30 days"})
+        assert not calls, "LLM narratives do not scan the previous period"
+        narrative_policy.mode = "template"
+        result = await agents.execute_data_analysis_crew("Chi phí 30 ngày qua", {"time_range": "last 30 days"})
+        assert len(calls) == 1
+        assert "kỳ trước" in json.dumps(result, ensure_ascii=False)
+    finally:
+        QueryAdsCampaignsTool.previous_period, narrative_policy.mode = original_period, original_mode
+    print("✅ the previous period is computed for templated narratives only")
+
+
+def test_speed():
+    rows = [day(f"2025-11-{d:02d}", 1000 * d, 3000 * d) for d in range(1, 31)]
+    data = {"data": rows, "summary": summary(rows)}
+    start = time.perf_counter()
+    for _ in range(100):
+        build_narrative("Doanh thu 30 ngày", data, "last 30 days")
+    per_call_ms = (time.perf_counter() - start) * 10
+    assert per_call_ms < 5, f"template narrative took {per_call_ms:.2f}ms"
+    print(f"✅ template narrative in {per_call_ms:.3f}ms")
+
+
+if __name__ == "__main__":
+    test_period_deltas()
+    test_previous_period_from_tool()
+    test_top_movers()
+    test_build_narrative()
+    test_policy()
+    test_speed()
+    asyncio.run(_test_previous_period_only_for_templates())
+    print("\nAll narrative template tests passed")
@@ -23,15 +23,17 @@ async def test_new_schema():
     async for chunk in generate_chat_stream(messages):
         full_response += chunk
     
-    # Parse and verify the schema
+    # Parse and verify the schema (NDJSON: one table_row per program, then table_end)
     try:
-        data = json.loads(full_response)
-        print(f"\nResponse Type: {data['type']}")
-        print(f"Number of programs: {len(data['content'])}")
+        lines = [json.loads(line) for line in full_response.splitlines() if line.strip()]
+        rows = [line['content'] for line in lines if line['type'] == 'table_row']
+        print(f"\nResponse Types: {[line['type'] for line in lines]}")
+        print(f"Number of programs: {len(rows)}")
+        print(f"Time to first row: {lines[-1].get('context', {}).get('timeToFirstRowMs')} ms")
         
-        if data['content']:
+        if rows:
             print("\nFirst program sample:")
-            first_program = data['content'][0]
+            first_program = rows[0]
             for key, value in first_program.items():
                 print(f"  {key}: {value}")
             
@@ -0,0 +1,157 @@
+"""
+Test suite for per-request profiling (no API key needed)
+"""
+
+import asyncio
+import glob
+import os
+import pstats
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import profiling
+from profiling import choose_mode, profile_stream
+from tracing import span, trace_scope
+
+profiling.PROFILE_DIR = tempfile.mkdtemp()
+profiling.PROFILE_INTERVAL_MS = 1
+
+
+def _flush() -> None:
+    profiling._writer.submit(lambda: None).result()
+
+
+def _files(request_id: str) -> dict:
+    _flush()
+    return {os.path.splitext(path)[1]: path for path in glob.glob(os.path.join(profiling.PROFILE_DIR, f"*{request_id}*"))}
+
+
+def _spin(seconds: float) -> None:
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+async def busy_profiled():
+    for _ in range(40):
+        _spin(0.002)
+        await asyncio.sleep(0)
+
+
+async def busy_other():
+    for _ in range(40):
+        _spin(0.002)
+        await asyncio.sleep(0)
+
+
+async def busy_child():
+    for _ in range(20):
+        _spin(0.002)
+        await asyncio.sleep(0)
+
+
+def busy_worker():
+    with span("worker"):
+        _spin(0.05)
+
+
+async def profiled_lines():
+    with trace_scope("test.profiled"):
+        await busy_profiled()
+        await asyncio.create_task(busy_child())
+        await asyncio.to_thread(busy_worker)
+        yield "done\n"
+
+
+async def other_lines():
+    await busy_other()
+    yield "done\n"
+
+
+def test_choose_mode():
+    profiling.PROFILE_TOKEN = "secret"
+    try:
+        assert choose_mode(None, None) is None
+        assert choose_mode("cprofile", "wrong") is None
+        assert choose_mode("flamegraph", "secret") is None
+        assert choose_mode("cprofile", "secret") == ("cprofile", "requested")
+        assert choose_mode("1", "secret") == ("sampling", "requested")
+        profiling.PROFILE_TOKEN = ""
+        assert choose_mode("sampling", "") is None, "no token configured means no on-demand profiling"
+        profiling.PROFILE_SAMPLE_RATE = 1.0
+        assert choose_mode(None, None) == ("sampling", "sampled")
+    finally:
+        profiling.PROFILE_TOKEN = ""
+        profiling.PROFILE_SAMPLE_RATE = 0.0
+    print("✅ profiling needs the token, or a global sample")
+
+
+async def _drain(stream) -> list:
+    return [chunk async for chunk in stream]
+
+
+async def _test_sampling_is_per_request():
+    profiled = profile_stream(profiled_lines(), "agent", "req-sampled", ("sampling", "requested"))
+    other = profile_stream(other_lines(), "agent", "req-other", None)
+    await asyncio.gather(_drain(profiled), _drain(other))
+
+    files = _files("req-sampled")
+    assert set(files) == {".pstats", ".folded"}, files
+    with open(files[".folded"]) as f:
+        folded = f.read()
+    assert "busy_profiled" in folded and "busy_child" in folded and "busy_worker" in folded
+    assert "busy_other" not in folded, "samples of a concurrent request leaked in"
+    stats = pstats.Stats(files[".pstats"])
+    assert any(name == "_spin" for (_, _, name) in stats.stats)
+    assert not _files("req-other")
+    print("✅ sampling profile covers the request's tasks and worker threads only")
+
+
+async def _test_cprofile():
+    await _drain(profile_stream(profiled_lines(), "chat", "req-cprofile", ("cprofile", "requested")))
+    files = _files("req-cprofile")
+    stats = pstats.Stats(files[".pstats"])
+    calls = {name: value[1] for (_, _, name), value in stats.stats.items()}
+    # Exact call counts on the event-loop thread (the worker thread's spin is not seen)
+    assert calls.get("_spin") == 60, calls.get("_spin")
+    with open(files[".folded"]) as f:
+        assert "_spin" in f.read()
+    assert profiling._cprofile_lock.acquire(blocking=False)
+    profiling._cprofile_lock.release()
+    print("✅ cProfile mode writes pstats and collapsed stacks")
+
+
+async def _test_spool_is_bounded():
+    profiling.PROFILE_SPOOL_MAX_FILES = 2
+    try:
+        for index in range(4):
+            await _drain(profile_stream(other_lines(), "agent", f"req-spool-{index}", ("sampling", "sampled")))
+            _flush()
+            time.sleep(0.01)
+    finally:
+        profiling.PROFILE_SPOOL_MAX_FILES = 100
+    stems = {os.path.splitext(p)[0] for p in os.listdir(profiling.PROFILE_DIR)}
+    assert len(stems) == 2, stems
+    assert all("req-spool-2" in s or "req-spool-3" in s for s in stems), stems
+    print("✅ spool keeps the newest profiles")
+
+
+async def _test_spool_names_are_sanitized():
+    await _drain(profile_stream(other_lines(), "agent", "../../escape/req-unsafe", ("sampling", "sampled")))
+    _flush()
+    names = [name for name in os.listdir(profiling.PROFILE_DIR) if "req-unsafe" in name]
+    assert names and all("______escape_req-unsafe" in name for name in names), names
+    assert not glob.glob(os.path.join(os.path.dirname(profiling.PROFILE_DIR), "escape*"))
+    print("✅ request ids cannot leave the profile spool")
+
+
+if __name__ == "__main__":
+    test_choose_mode()
+    asyncio.run(_test_sampling_is_per_request())
+    asyncio.run(_test_cprofile())
+    asyncio.run(_test_spool_is_bounded())
+    asyncio.run(_test_spool_names_are_sanitized())
+    print("\nAll profiling tests passed")
@@ -0,0 +1,149 @@
+"""
+Test suite for ads query explain output and the slow-query log (no API key needed)
+"""
+
+import glob
+import json
+import logging
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import query_plan
+import data_tools
+from data_tools import ROW_CACHE, QueryAdsCampaignsTool, db
+from query_plan import SLOW_QUERIES, normalize_query_spec
+
+query_plan.SLOW_QUERY_LOG_PATH = os.path.join(tempfile.mkdtemp(), "slow_queries.log")
+
+
+def _query(**params) -> dict:
+    return json.loads(QueryAdsCampaignsTool()._run(json.dumps(params)))
+
+
+def test_explain():
+    program = db.campaigns[0]["program"]
+    plain = _query(date_range="last 30 days", program=program)
+    assert "explain" not in plain
+
+    result = _query(date_range="last 30 days", program=program, group_by="week", explain=True)
+    explain = result["explain"]
+    assert explain["dateRange"] == {"input": "last 30 days", **result["dateRange"]}
+    assert explain["accessPath"] == "scan"
+    [step] = explain["filterPlan"]
+    assert step["filter"] == "program" and step["campaignsBefore"] == len(db.campaigns)
+    assert 0 < step["campaignsAfter"] <= step["campaignsBefore"]
+
+    rows = explain["rows"]
+    assert rows["dataset"] == len(db.daily_data)
+    # One pass over the dataset, one over the matching rows to aggregate by date
+    assert rows["passes"] == 2 and rows["scanned"] == rows["dataset"] + rows["matched"]
+    assert rows["returned"] == len(result["data"]) == result["totalRecords"]
+    assert list(explain["phasesMs"]) == ["parseDateRange", "filterCampaigns", "scan", "aggregateByDate", "groupBy", "summary"]
+    assert explain["totalMs"] >= sum(explain["phasesMs"].values()) - 0.01
+    assert explain["spec"]["shape"] == "group_by=week breakdown=none filters=program span=31d"
+
+    granular = _query(breakdown="campaign", explain=True)["explain"]
+    assert granular["rows"]["passes"] == 3 and "breakdown" in granular["phasesMs"]
+    print("✅ explain reports date range, filter plan, rows and per-phase timings")
+
+
+def test_normalized_spec():
+    spec = normalize_query_spec(
+        {"keywords": ["vay", "crypto"], "account_ids": ["acc_1"], "group_by": "campaign"}, "2024-11-01", "2024-11-30"
+    )
+    assert spec == {
+        "groupBy": "campaign",
+        "breakdown": None,
+        "filters": {"account_ids": 1, "keywords": 2},
+        "spanDays": 30,
+        "shape": "group_by=campaign breakdown=none filters=account_ids,keywords span=30d",
+    }
+    # Filter values never reach the spec
+    assert "vay" not in json.dumps(spec)
+    print("✅ query specs are normalized to their shape")
+
+
+def test_slow_query_log_rotates():
+    query_plan.SLOW_QUERY_SECONDS = 0
+    query_plan.SLOW_QUERY_LOG_MAX_BYTES = 2000
+    query_plan.SLOW_QUERY_LOG_BACKUPS = 2
+    try:
+        for _ in range(20):
+            _query(date_range="tháng này", keywords=["vay"])
+    finally:
+        query_plan.SLOW_QUERY_SECONDS = 0.5
+    logging.getLogger("SLOW_QUERY").handlers[0].flush()
+
+    files = sorted(glob.glob(query_plan.SLOW_QUERY_LOG_PATH + "*"))
+    assert len(files) == 3, files
+    assert all(os.path.getsize(f) <= 2000 for f in files)
+    with open(query_plan.SLOW_QUERY_LOG_PATH, encoding="utf-8") as f:
+        entry = json.loads(f.readline())
+    assert entry["shape"].startswith("group_by=day breakdown=none filters=keywords span=")
+    assert entry["rowsScanned"] >= len(db.daily_data) and "scan" in entry["phasesMs"]
+    assert SLOW_QUERIES.labels("day").value == 20
+
+    before = SLOW_QUERIES.labels("day").value
+    _query(date_range="tháng này", keywords=["vay"])
+    assert SLOW_QUERIES.labels("day").value == before, "fast queries are not logged"
+    print("✅ slow queries are logged by shape to a rotating file")
+
+
+def _run_on(selection=None, **params):
+    payload, kept = QueryAdsCampaignsTool().run_on({**params, "explain": True}, selection)
+    result = json.loads(payload)
+    return result, result.pop("explain"), kept
+
+
+def test_drilldown_on_cached_rows():
+    program = db.campaigns[0]["program"]
+    keywords = list(db.campaigns[0]["keywords"][:2])
+    _, explain, selection = _run_on(date_range="last 30 days", program=program, keywords=keywords)
+    assert explain["accessPath"] == "scan" and len(selection.rows) == explain["rows"]["matched"]
+
+    follow_ups = [
+        {"date_range": "last 30 days", "program": program, "keywords": keywords, "group_by": "campaign"},
+        {"date_range": "last 7 days", "program": program, "keywords": keywords[:1], "breakdown": "account"},
+        {"date_range": "last 30 days", "program": program, "keywords": keywords, "campaign_ids": [db.campaigns[0]["id"]]},
+    ]
+    for params in follow_ups:
+        hits = ROW_CACHE.labels("hit").value
+        result, explain, kept = _run_on(selection, **params)
+        fresh, _, _ = _run_on(**params)
+        assert explain["accessPath"] == "session_cache" and kept is selection, params
+        assert explain["rows"]["scanned"] < len(db.daily_data)
+        assert result == fresh, "drill-down on the cached rows must match a full scan"
+        assert ROW_CACHE.labels("hit").value == hits + 1
+
+    broader = [
+        {"date_range": "last 60 days", "program": program, "keywords": keywords},
+        {"date_range": "last 30 days", "keywords": keywords},
+        {"date_range": "last 30 days", "program": program, "keywords": keywords + ["khác"]},
+    ]
+    for params in broader:
+        _, explain, kept = _run_on(selection, **params)
+        assert explain["accessPath"] == "scan" and kept is not selection, params
+
+    data_tools.db.version += 1
+    try:
+        _, explain, _ = _run_on(selection, date_range="last 30 days", program=program, keywords=keywords)
+    finally:
+        data_tools.db.version -= 1
+    assert explain["accessPath"] == "scan", "rows of an older dataset version are not reused"
+
+    # The previous period is outside the session's rows: explain reports the dataset scan
+    _, explain, kept = _run_on(selection, date_range="last 30 days", program=program, keywords=keywords, compare_previous=True)
+    assert kept is selection and explain["accessPath"] == "session_cache+scan"
+    assert explain["rows"]["scanned"] >= len(db.daily_data) and "previousPeriod" in explain["phasesMs"]
+    print("✅ follow-ups that narrow, regroup or re-break down reuse the previous rows")
+
+
+if __name__ == "__main__":
+    test_explain()
+    test_normalized_spec()
+    test_slow_query_log_rotates()
+    test_drilldown_on_cached_rows()
+    print("\nAll query plan tests passed")
@@ -0,0 +1,209 @@
+"""
+Test suite for the persistent research cache (no API key needed)
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from research_cache import ResearchCache
+
+TABLE = [{"brand": "Binance", "commission_percent": 20}]
+
+
+def make_cache(**kwargs) -> ResearchCache:
+    path = os.path.join(tempfile.mkdtemp(), "research.sqlite3")
+    return ResearchCache(path=path, **kwargs)
+
+
+async def _test_fresh_hit_skips_fetch():
+    cache = make_cache()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        return TABLE
+
+    table, info = await cache.get_or_fetch("Crypto", fetch)
+    assert table == TABLE and not info["hit"]
+    table, info = await cache.get_or_fetch("  crypto ", fetch)
+    assert table == TABLE and info["hit"] and not info["stale"]
+    assert len(calls) == 1
+    print("✅ Fresh entries are served without calling Gemini.")
+
+
+async def _test_stale_while_revalidate():
+    cache = make_cache(fresh_seconds=0.01)
+    cache.put("Forex", TABLE)
+    time.sleep(0.02)
+    refreshed = [{"brand": "Exness", "commission_percent": 0}]
+
+    async def fetch():
+        return refreshed
+
+    table, info = await cache.get_or_fetch("Forex", fetch)
+    assert table == TABLE and info["stale"] and info["refreshing"]
+    await asyncio.sleep(0.05)
+    assert cache.get("Forex")["table"] == refreshed
+    print("✅ Stale entries are served while a background refresh runs.")
+
+
+async def _test_refresh_is_detached_from_request():
+    import cancellation
+    from deadline import current_deadline, deadline_scope
+    from scheduler import PRIORITY_CLASSES, current_priority, request_scheduler
+    from tracing import current_trace, trace_scope
+
+    cache = make_cache(fresh_seconds=0.01)
+    cache.put("Forex", TABLE)
+    time.sleep(0.02)
+    seen = []
+
+    async def fetch():
+        seen.append((current_deadline(), current_trace(), cancellation.current_token(), current_priority()))
+        return TABLE
+
+    token = cancellation.CancelToken()
+    with trace_scope("test.refresh", "req-refresh"), deadline_scope(0.5):
+        cancellation._token.set(token)
+        async with request_scheduler.slot("data_query", "u1"):
+            table, info = cache.serve_cached("Forex", fetch)
+            assert info["refreshing"]
+    token.cancel()
+    await asyncio.sleep(0.05)
+    assert seen == [(None, None, None, len(PRIORITY_CLASSES))], "the refresh sees none of the request's state"
+    print("✅ Background refreshes run outside the request's deadline, trace and cancel token.")
+
+
+async def _test_errors_not_cached_and_eviction():
+    cache = make_cache(max_entries=2)
+
+    async def failing():
+        return [{"error": "Invalid JSON from AI"}]
+
+    await cache.get_or_fetch("Beauty", failing)
+    assert cache.get("Beauty") is None
+    cache.put("a", TABLE)
+    cache.put("b", TABLE)
+    cache.get("a")
+    time.sleep(0.01)
+    cache.put("c", TABLE)
+    assert sorted(cache.keys()) == ["a", "c"]
+    print("✅ Error tables are not cached and LRU eviction bounds the store.")
+
+
+async def _test_fuzzy_vietnamese_match():
+    cache = make_cache(fuzzy_verify_rate=1.0)
+    cache.put("Crypto", TABLE)
+
+    async def fetch():
+        return [{"brand": "Nike"}]  # unrelated result -> false match
+
+    for phrasing in ["tiền điện tử", "sàn crypto", "Crypto programs", "tien dien tu"]:
+        table, info = await cache.get_or_fetch(phrasing, fetch)
+        assert info["hit"] and info.get("matchedNiche"), phrasing
+        await asyncio.sleep(0.01)
+    # The verification stored the fresh table under the requested niche
+    assert cache.get("tiền điện tử")["table"] == [{"brand": "Nike"}]
+    _, info = await cache.get_or_fetch("Gaming", fetch)
+    assert not info["hit"]
+    stats = cache.stats()
+    assert stats["fuzzyVerified"] >= 1 and stats["falseMatchRate"] > 0
+    print(f"✅ Vietnamese phrasings resolve to cached niches (stats: {stats}).")
+
+
+def test_narrower_niches_do_not_match():
+    from niche_matcher import NicheIndex
+
+    index = NicheIndex()
+    for niche in ["Beauty", "Crypto", "Travel", "Gaming"]:
+        index.add(niche)
+    for phrasing in ["beauty for men", "Beauty products", "crypto forex", "travel insurance", "gaming laptops"]:
+        assert index.nearest(phrasing) is None, phrasing
+    assert index.nearest("Mỹ phẩm")[0] == "Beauty"
+
+    cache = make_cache()
+    cache.put("Beauty", TABLE)
+    assert cache.lookup("beauty for men")[0] is None, "a narrower niche is not served the broader table"
+    print("✅ Niches with extra or different words do not fuzzy-match.")
+
+
+async def _test_degraded_serves_expired_entries():
+    from llm_gateway import llm_gateway
+
+    cache = make_cache(fresh_seconds=0.01, stale_seconds=0.02)
+    cache.put("Forex", TABLE)
+    time.sleep(0.03)
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        return TABLE
+
+    llm_gateway.breaker._open()
+    try:
+        table, info = cache.serve_cached("Forex", fetch)
+    finally:
+        llm_gateway.breaker._set_state("closed")
+    assert table == TABLE and info["degraded"], "expired entries are served while upstream is down"
+
+    # Half-open: only the probe goes upstream, everyone else degrades
+    llm_gateway.breaker._set_state("half_open")
+    try:
+        assert not llm_gateway.would_reject(), "the next call may become the probe"
+        assert llm_gateway.breaker.allow(), "probe admitted"
+        table, info = cache.serve_cached("Forex", fetch)
+    finally:
+        llm_gateway.breaker.release_probe()
+        llm_gateway.breaker._set_state("closed")
+    assert table == TABLE and info["degraded"], "non-probe requests degrade while the probe runs"
+    assert not calls, "no refresh is started while the breaker rejects calls"
+    assert cache.serve_cached("Forex", fetch)[0] is None, "expired entries are misses again once healthy"
+    print("✅ Expired research is served while the LLM circuit rejects calls.")
+
+
+async def _test_more_programs_bypasses_cache():
+    os.environ.setdefault("LLM_BACKEND", "fake")
+    import agents
+    from router import lookup_known_route
+
+    cache = make_cache()
+    cache.put("Crypto", TABLE)
+    prompts = []
+
+    async def generate_text(prompt, *args, **kwargs):
+        prompts.append(prompt)
+        return '[{"brand": "OKX", "commission_percent": 40}]'
+
+    routed = lookup_known_route("Thêm programs trong lĩnh vực Crypto")
+    assert routed.entities.expand and routed.to_dict()["entities"] == {"niche": "Crypto", "expand": True}
+    original_cache, original_generate = agents.research_cache, agents.generate_text
+    agents.research_cache, agents.generate_text = cache, generate_text
+    try:
+        result = await agents.execute_research_crew("Thêm programs trong lĩnh vực Crypto", routed.entities.to_dict())
+        plain = await agents.execute_research_crew("Crypto", {"niche": "Crypto"})
+    finally:
+        agents.research_cache, agents.generate_text = original_cache, original_generate
+
+    narrative, table = result["content"]["sections"]
+    assert table["content"] == [{"brand": "OKX", "commission_percent": 40}], "more programs must not replay the cached table"
+    assert not result["context"]["cache"]["hit"]
+    assert len(prompts) == 1 and "Binance" in prompts[0], "already shown brands are excluded in the prompt"
+    assert cache.get("Crypto")["table"] == TABLE, "the expansion does not overwrite the niche's cached table"
+    assert plain["content"]["sections"][1]["content"] == TABLE and plain["context"]["cache"]["hit"]
+    print("✅ 'More programs' follow-ups fetch new programs instead of the cached table.")
+
+
+if __name__ == "__main__":
+    asyncio.run(_test_fuzzy_vietnamese_match())
+    test_narrower_niches_do_not_match()
+    asyncio.run(_test_fresh_hit_skips_fetch())
+    asyncio.run(_test_stale_while_revalidate())
+    asyncio.run(_test_refresh_is_detached_from_request())
+    asyncio.run(_test_errors_not_cached_and_eviction())
+    asyncio.run(_test_degraded_serves_expired_entries())
+    asyncio.run(_test_more_programs_bypasses_cache())
@@ -0,0 +1,100 @@
+"""
+Test suite for the unified intent router (no LLM call is made)
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("LLM_BACKEND", "fake")
+
+from router import (
+    ROUTES,
+    RouteEntities,
+    RouteResult,
+    route_cache,
+    route_forced,
+    heuristic_route,
+    lookup_known_route,
+)
+from intent_cache import make_cache_key, SUGGESTION_BY_CAMPAIGN
+
+
+def test_entity_coercion():
+    entities = RouteEntities.from_raw({
+        "time_range": "tháng 11",
+        "metrics": "CPC",
+        "campaigns": None,
+        "group_by": "Campaign",
+        "breakdown": "none",
+        "visual_type": "<line|bar|area|none>",
+        "niche": "null",
+    })
+    assert entities.metrics == ["cpc"]
+    assert entities.campaigns == []
+    assert entities.group_by == "campaign"
+    assert entities.breakdown is None
+    assert entities.visual_type is None, "unfilled template values are dropped"
+    assert entities.to_dict() == {"time_range": "tháng 11", "metrics": ["cpc"], "group_by": "campaign"}
+    print("✅ entity coercion")
+
+
+def test_route_result_from_dict():
+    result = RouteResult.from_dict({"intent": "bogus", "confidence": "2", "entities": []}, source="llm")
+    assert result.intent == "research"
+    assert result.confidence == 1.0
+    assert result.entities.to_dict() == {}
+    assert RouteResult.from_dict({"intent": "comparison"}, source="llm").legacy_intent == "followup"
+    print("✅ route result parsing")
+
+
+def test_forced_route():
+    result = route_forced("research", "Crypto")
+    assert result.source == "forced"
+    assert result.entities.niche == "Crypto"
+    assert result.confidence == 1.0
+    print("✅ forced route")
+
+
+def test_heuristic_route():
+    assert heuristic_route("CPC là gì?").intent == "explanation"
+    assert heuristic_route("Liệt kê các chiến dịch").intent == "data_query"
+    assert heuristic_route("Chi phí tháng 11").intent == "data_analysis"
+    assert heuristic_route("Show me forex programs").intent == "research", "'show' must not match 'how'"
+    assert heuristic_route("Forex").entities.niche == "Forex"
+    print("✅ heuristic fallback")
+
+
+def test_known_routes():
+    seeded = lookup_known_route(SUGGESTION_BY_CAMPAIGN, "", {"filters": {"timeRange": "last 7 days"}})
+    assert seeded.source == "seed"
+    assert seeded.entities.group_by == "campaign"
+    assert seeded.entities.time_range == "last 7 days"
+
+    history = "user: Crypto\nassistant: [table]"
+    assert lookup_known_route("Forex", history) is None
+    route_cache.set(make_cache_key("Forex", history.splitlines()), {"intent": "research", "entities": {"niche": "Forex"}, "confidence": 0.9})
+    cached = lookup_known_route("  forex ", history)
+    assert cached.source == "cache"
+    assert cached.entities.niche == "Forex"
+    print("✅ seeded and cached routes")
+
+
+async def _test_chat_stream_counts_known_routes():
+    from generator import generate_chat_stream
+
+    seeds = ROUTES.labels("seed").value
+    lines = [line async for line in generate_chat_stream([{"role": "user", "content": "Thêm programs trong lĩnh vực Crypto"}])]
+    assert lines and ROUTES.labels("seed").value == seeds + 1, "seeded routes of the chat stream are counted"
+    print("✅ chat stream fast-path routes are counted by source")
+
+
+if __name__ == "__main__":
+    test_entity_coercion()
+    test_route_result_from_dict()
+    test_forced_route()
+    test_heuristic_route()
+    test_known_routes()
+    asyncio.run(_test_chat_stream_counts_known_routes())
+    print("\nAll router tests passed")
@@ -0,0 +1,179 @@
+"""
+Test suite for priority request scheduling (no API key needed)
+"""
+
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("LLM_BACKEND", "fake")
+
+from llm_gateway import AdaptiveLimiter
+from scheduler import RequestScheduler, RequestShed, class_for, current_priority
+
+
+async def _run(scheduler, order, name, intent, user="u1", hold=0.02):
+    async with scheduler.slot(intent, user):
+        order.append(name)
+        await asyncio.sleep(hold)
+
+
+def test_classes():
+    assert class_for("data_query") == "data"
+    assert class_for("data_analysis") == "data"
+    assert class_for("research") == "generative"
+    assert class_for("explanation") == "generative"
+    assert class_for("unknown") == "generative"
+    print("✅ intents map to priority classes")
+
+
+async def _test_data_jumps_research_queue():
+    scheduler = RequestScheduler(max_active=1, shed_queue=100)
+    order = []
+    first = asyncio.create_task(_run(scheduler, order, "research-0", "research"))
+    await asyncio.sleep(0)
+    tasks = [asyncio.create_task(_run(scheduler, order, f"research-{i}", "research")) for i in range(1, 4)]
+    await asyncio.sleep(0)
+    tasks.append(asyncio.create_task(_run(scheduler, order, "data", "data_query")))
+    await asyncio.gather(first, *tasks)
+    assert order[:2] == ["research-0", "data"], order
+    print("✅ data queries are admitted ahead of queued research")
+
+
+async def _test_fair_between_users():
+    scheduler = RequestScheduler(max_active=1, shed_queue=100)
+    order = []
+    first = asyncio.create_task(_run(scheduler, order, "busy-0", "research", "busy"))
+    await asyncio.sleep(0)
+    tasks = [asyncio.create_task(_run(scheduler, order, f"busy-{i}", "research", "busy", 0.005)) for i in range(1, 5)]
+    await asyncio.sleep(0)
+    tasks.append(asyncio.create_task(_run(scheduler, order, "quiet", "research", "quiet", 0.005)))
+    await asyncio.gather(first, *tasks)
+    assert order.index("quiet") == 2, order
+    print("✅ users are served round-robin within a class")
+
+
+async def _test_shedding():
+    scheduler = RequestScheduler(max_active=1, shed_queue=2)
+    order = []
+    tasks = [asyncio.create_task(_run(scheduler, order, f"r{i}", "research", hold=0.05)) for i in range(3)]
+    await asyncio.sleep(0.01)
+    assert scheduler.queued() == 2
+
+    try:
+        async with scheduler.slot("research", "u2"):
+            pass
+        assert False, "lowest class should be shed"
+    except RequestShed:
+        pass
+
+    # Higher classes still queue
+    tasks.append(asyncio.create_task(_run(scheduler, order, "data", "data_analysis")))
+    await asyncio.gather(*tasks)
+    assert "data" in order
+    assert scheduler.stats()["classes"]["generative"]["shed"] >= 1
+    print("✅ lowest class is shed when queues are long")
+
+
+async def _test_cancelled_waiter_frees_queue():
+    scheduler = RequestScheduler(max_active=1, shed_queue=100)
+    order = []
+    first = asyncio.create_task(_run(scheduler, order, "a", "research", hold=0.05))
+    await asyncio.sleep(0)
+    waiting = asyncio.create_task(_run(scheduler, order, "b", "research"))
+    await asyncio.sleep(0.01)
+    waiting.cancel()
+    await asyncio.gather(first, waiting, return_exceptions=True)
+    assert scheduler.queued() == 0 and scheduler.active == 0
+    assert order == ["a"]
+    print("✅ cancelled waiters leave the queue")
+
+
+async def _test_priority_reaches_gateway():
+    limiter = AdaptiveLimiter(initial=1, minimum=1, maximum=1, queue_size=10, queue_timeout=5)
+    scheduler = RequestScheduler(max_active=10, shed_queue=100)
+    await limiter.acquire()
+    order = []
+
+    async def llm_call(name, intent):
+        async with scheduler.slot(intent, name):
+            assert current_priority() == (0 if intent == "data_query" else 1)
+            await limiter.acquire()
+            order.append(name)
+            limiter.release()
+
+    tasks = [asyncio.create_task(llm_call("research", "research"))]
+    await asyncio.sleep(0)
+    tasks.append(asyncio.create_task(llm_call("data", "data_query")))
+    await asyncio.sleep(0)
+    limiter.release()
+    await asyncio.gather(*tasks)
+    assert order == ["data", "research"], order
+    assert current_priority() == 2, "outside a slot work sorts last"
+    print("✅ gateway admits queued LLM calls by request priority")
+
+
+async def _test_slo_report():
+    scheduler = RequestScheduler(max_active=4, shed_queue=100, slo_seconds={"data": 0.01, "generative": 1})
+    await _run(scheduler, [], "fast", "data_query", hold=0)
+    await _run(scheduler, [], "slow", "data_query", hold=0.03)
+    data = scheduler.stats()["classes"]["data"]
+    assert data["sloSeconds"] == 0.01
+    assert 0 < data["sloMetRate"] < 1, data
+    assert {"p50Ms", "p95Ms", "queueWaitP95Ms", "queued"} <= set(data)
+    print("✅ per-class latency is reported against its SLO")
+
+
+async def _collect(stream) -> list:
+    return [line async for line in stream]
+
+
+async def _test_chat_stream_is_scheduled():
+    import generator
+
+    original = generator.request_scheduler
+    try:
+        generator.request_scheduler = scheduler = RequestScheduler(max_active=1, shed_queue=100)
+        async with scheduler.slot("data_query", "u1"):
+            stream = generator.generate_chat_stream([{"role": "user", "content": "CPC là gì?"}], user_id="u2")
+            answer = asyncio.create_task(_collect(stream))
+            for _ in range(200):
+                if scheduler.queued():
+                    break
+                await asyncio.sleep(0.01)
+            assert list(scheduler._queues["generative"]) == ["u2"], "the chat stream waits for a slot as its user"
+        assert json.loads((await answer)[0])["type"] == "text"
+
+        # Data intents still run an LLM research generation here: they are shed as generative work
+        for query in ["CPC là gì?", "Chi phí tháng này theo ngày"]:
+            generator.request_scheduler = RequestScheduler(max_active=0, shed_queue=0)
+            lines = await _collect(generator.generate_chat_stream([{"role": "user", "content": query}]))
+            assert [json.loads(line)["content"] for line in lines] == [RequestShed.user_message], query
+
+        # A shed request never starts speculative research
+        started = []
+        original_rows, original_mode = generator.stream_research_rows, generator.speculation_policy.mode
+        generator.stream_research_rows = lambda prompt: started.append(prompt) or original_rows(prompt)
+        generator.speculation_policy.mode = "on"
+        try:
+            lines = await _collect(generator.generate_chat_stream([{"role": "user", "content": "Tìm chương trình affiliate mới"}]))
+        finally:
+            generator.stream_research_rows, generator.speculation_policy.mode = original_rows, original_mode
+        assert [json.loads(line)["content"] for line in lines] == [RequestShed.user_message] and not started
+    finally:
+        generator.request_scheduler = original
+    print("✅ /api/chat/stream and its speculation are admitted and shed by the scheduler")
+
+
+if __name__ == "__main__":
+    test_classes()
+    asyncio.run(_test_data_jumps_research_queue())
+    asyncio.run(_test_fair_between_users())
+    asyncio.run(_test_shedding())
+    asyncio.run(_test_cancelled_waiter_frees_queue())
+    asyncio.run(_test_priority_reaches_gateway())
+    asyncio.run(_test_slo_report())
+    asyncio.run(_test_chat_stream_is_scheduled())
+    print("\nAll scheduler tests passed")
@@ -0,0 +1,102 @@
+"""
+Test suite for server-side conversation sessions (no API key needed)
+"""
+
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ["LLM_BACKEND"] = "fake"
+
+import session_store
+from session_store import SESSIONS_EVICTED, Session, SessionStore, estimate_tokens
+
+
+def test_history_is_compacted():
+    session = Session("compact")
+    for turn in range(20):
+        session.add_exchange(f"câu hỏi {turn} " + "x" * 200, f"trả lời {turn} " + "y" * 600)
+    history = session.history()
+    assert estimate_tokens(history) <= session_store.SESSION_HISTORY_TOKENS
+    assert estimate_tokens(session.summary) <= session_store.SESSION_SUMMARY_TOKENS
+    assert len(session.recent) <= session_store.SESSION_RECENT_MESSAGES
+    assert session.recent[-1][1].startswith("trả lời 19"), "the last answer is kept verbatim"
+    assert "câu hỏi 18" in history and "trả lời 0 " not in history, "old turns roll out of the summary"
+    assert all(len(line) <= len("assistant: ") + session_store.SUMMARY_LINE_CHARS for line in session.summary.splitlines())
+    print("✅ history keeps the last turns and a bounded rolling summary")
+
+
+def test_short_history_is_verbatim():
+    session = Session("short")
+    session.add_exchange("Chi phí tháng này", "Tổng chi phí là 12 triệu", {"filters": {"date_range": "tháng này"}})
+    assert session.history() == "user: Chi phí tháng này\nassistant: Tổng chi phí là 12 triệu\n"
+    assert session.previous_context == {"filters": {"date_range": "tháng này"}}
+    print("✅ short conversations are passed through unchanged")
+
+
+def test_lru_and_ttl_eviction():
+    store = SessionStore(max_sessions=2, ttl_seconds=60)
+    a, b = store.get_or_create("a"), store.get_or_create("b")
+    assert store.get("a") is a
+    store.get_or_create("c")
+    assert store.get("b") is None and store.get("a") is a, "least recently used session is evicted"
+    assert SESSIONS_EVICTED.labels("lru").value >= 1
+
+    store = SessionStore(max_sessions=10, ttl_seconds=0.01)
+    store.get_or_create("old")
+    time.sleep(0.02)
+    assert store.get("old") is None
+    fresh = store.get_or_create("old")
+    assert fresh.turns == 0
+    assert store.get_or_create().session_id != "old"
+    print("✅ sessions are evicted by LRU and inactivity TTL")
+
+
+async def _test_agent_turns_use_session():
+    from generator import generate_agent_stream
+
+    session = session_store.session_store.get_or_create("agent-session")
+    queries = ["Nghiên cứu ngách Crypto", "CPC là gì?", "Chi phí tháng này theo ngày"] * 3
+    for query in queries:
+        lines = [line async for line in generate_agent_stream([{"role": "user", "content": query}], session=session)]
+        assert json.loads(lines[-1])["event"] == "done"
+    assert session.turns == len(queries)
+    assert len(session.recent) <= session_store.SESSION_RECENT_MESSAGES
+    assert session.summary, "older turns were folded into the summary"
+    assert estimate_tokens(session.history()) <= session_store.SESSION_HISTORY_TOKENS
+    print("✅ agent turns read and record the server-side session")
+
+
+async def _test_drilldown_keeps_rows_in_session():
+    from agents import execute_data_analysis_crew
+    from data_tools import ROW_CACHE
+
+    session = Session("drilldown")
+    await execute_data_analysis_crew("Chi phí 30 ngày qua", {"time_range": "last 30 days"}, session=session)
+    first = session.rows
+    assert first is not None and first.rows
+
+    hits = ROW_CACHE.labels("hit").value
+    answer = await execute_data_analysis_crew(
+        "Phân tích theo chiến dịch", {"time_range": "last 30 days", "group_by": "campaign"}, session=session
+    )
+    assert ROW_CACHE.labels("hit").value == hits + 1
+    assert session.rows is first
+    assert answer["context"]["filters"]["timeRange"] == "last 30 days"
+
+    session.rows.rows = [None] * (session_store.SESSION_MAX_ROWS + 1)
+    session.keep_rows(session.rows)
+    assert session.rows is None, "oversized selections are not kept"
+    print("✅ data follow-ups in a session run on the previous rows")
+
+
+if __name__ == "__main__":
+    test_history_is_compacted()
+    test_short_history_is_verbatim()
+    test_lru_and_ttl_eviction()
+    asyncio.run(_test_agent_turns_use_session())
+    asyncio.run(_test_drilldown_keeps_rows_in_session())
+    print("\nAll session store tests passed")
@@ -0,0 +1,114 @@
+"""
+Test suite for single-flight request coalescing (no API key needed)
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from singleflight import SingleFlight, StreamFlight, SyncSingleFlight, flight_key, FLIGHT_CALLS
+
+
+def test_flight_key():
+    assert flight_key("gemini", "Crypto") == flight_key("gemini", "Crypto")
+    assert flight_key("gemini", "Crypto") != flight_key("gemini", "Forex")
+    assert flight_key({"a": 1, "b": 2}) == flight_key({"b": 2, "a": 1})
+    print("✅ flight keys")
+
+
+async def _test_async_coalescing():
+    flight = SingleFlight("test_async")
+    calls = 0
+
+    async def upstream():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return "programs"
+
+    results = await asyncio.gather(*(flight.do("crypto", upstream) for _ in range(10)))
+    assert results == ["programs"] * 10
+    assert calls == 1, f"expected one upstream call, got {calls}"
+    assert FLIGHT_CALLS.labels("test_async", "coalesced").value == 9
+    assert flight.inflight() == 0
+
+    await flight.do("crypto", upstream)
+    assert calls == 2, "finished calls are not cached"
+    print("✅ concurrent identical calls share one upstream call")
+
+
+async def _test_async_cancellation():
+    flight = SingleFlight("test_cancel")
+    started = asyncio.Event()
+
+    async def upstream():
+        started.set()
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    leader = asyncio.create_task(flight.do("k", upstream))
+    follower = asyncio.create_task(flight.do("k", upstream))
+    await started.wait()
+    leader.cancel()
+    assert await follower == "ok", "a cancelled caller must not fail the others"
+
+    lone = asyncio.create_task(flight.do("k2", upstream))
+    await asyncio.sleep(0.01)
+    lone.cancel()
+    await asyncio.gather(lone, return_exceptions=True)
+    assert flight.inflight() == 0, "work with no waiters left is cancelled"
+    print("✅ cancellation only stops work nobody waits for")
+
+
+async def _test_stream_fan_out():
+    flight = StreamFlight("test_stream")
+    calls = 0
+
+    async def upstream():
+        nonlocal calls
+        calls += 1
+        for chunk in ["[", '{"brand": "A"}', "]"]:
+            await asyncio.sleep(0.01)
+            yield chunk
+
+    async def consume(delay):
+        await asyncio.sleep(delay)
+        return [chunk async for chunk in flight.stream("crypto", upstream)]
+
+    results = await asyncio.gather(consume(0), consume(0.015))
+    assert results[0] == results[1] == ["[", '{"brand": "A"}', "]"], "late joiner gets a replay"
+    assert calls == 1
+    print("✅ streams fan out to every subscriber")
+
+
+def test_sync_coalescing():
+    flight = SyncSingleFlight("test_sync")
+    calls = 0
+    results = []
+
+    def compute():
+        nonlocal calls
+        calls += 1
+        time.sleep(0.05)
+        return '{"data": []}'
+
+    threads = [threading.Thread(target=lambda: results.append(flight.do("nov", compute))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(results) == 8 and calls == 1
+    print("✅ blocking computations collapse into one")
+
+
+if __name__ == "__main__":
+    test_flight_key()
+    asyncio.run(_test_async_coalescing())
+    asyncio.run(_test_async_cancellation())
+    asyncio.run(_test_stream_fan_out())
+    test_sync_coalescing()
+    print("\nAll single-flight tests passed")
@@ -0,0 +1,60 @@
+"""
+Test suite for speculative research generation (no API key needed)
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from speculation import SpeculativeStream, SpeculationPolicy
+
+
+async def fake_research(produced: list):
+    for i in range(3):
+        await asyncio.sleep(0.02)
+        produced.append(i)
+        yield f"row {i}"
+
+
+async def _test_commit_replays_buffered_output():
+    produced = []
+    speculation = SpeculativeStream(fake_research(produced))
+    await asyncio.sleep(0.05)  # "classification" in flight
+    assert produced, "generation should start before the intent is known"
+    lines = [line async for line in speculation.commit()]
+    assert lines == ["row 0", "row 1", "row 2"]
+    print("✅ Committed speculation yields buffered and live output.")
+
+
+async def _test_cancel_stops_work():
+    produced = []
+    speculation = SpeculativeStream(fake_research(produced))
+    await asyncio.sleep(0.03)
+    wasted = speculation.cancel()
+    await asyncio.sleep(0.06)
+    assert len(produced) < 3 and wasted > 0
+    print("✅ Cancelled speculation stops the upstream generation.")
+
+
+def test_policy_modes():
+    assert not SpeculationPolicy(mode="off").should_speculate()
+    assert SpeculationPolicy(mode="on").should_speculate()
+
+    auto = SpeculationPolicy(mode="auto", min_research_share=0.6, window=10)
+    assert auto.should_speculate()
+    for _ in range(10):
+        auto.record_intent(False)
+    assert not auto.should_speculate(), "explanation-heavy traffic should disable speculation"
+    auto.record_committed(0.8)
+    auto.record_wasted(0.2)
+    stats = auto.stats()
+    assert stats["speculations"] >= 2 and 0 < stats["wastedRate"] < 1
+    print(f"✅ Speculation policy modes work (stats: {stats}).")
+
+
+if __name__ == "__main__":
+    asyncio.run(_test_commit_replays_buffered_output())
+    asyncio.run(_test_cancel_stops_work())
+    test_policy_modes()
@@ -0,0 +1,69 @@
+"""
+Test suite for the stage dependency graph (no API key needed)
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stage_graph import StageGraph
+
+
+async def _test_independent_stages_overlap():
+    order = []
+
+    def data():
+        return {"rows": 3}
+
+    def chart(data):
+        time.sleep(0.05)  # CPU-bound stand-in, offloaded to a thread
+        order.append("chart")
+        return f"chart({data['rows']})"
+
+    async def narrative(data):
+        await asyncio.sleep(0.1)  # LLM stand-in
+        order.append("narrative")
+        return "narrative"
+
+    graph = StageGraph("test")
+    graph.add("data", data)
+    graph.add("chart", chart, deps=["data"], offload=True)
+    graph.add("narrative", narrative, deps=["data"])
+
+    started = time.perf_counter()
+    results = await graph.run()
+    elapsed = time.perf_counter() - started
+
+    assert results["chart"] == "chart(3)" and results["narrative"] == "narrative"
+    assert order == ["chart", "narrative"], "chart must be ready before the narrative"
+    assert elapsed < 0.14, f"stages should overlap, took {elapsed:.3f}s"
+    assert graph.critical_path() == ["data", "narrative"]
+    print(f"✅ Independent stages run concurrently ({graph.describe()}).")
+
+
+async def _test_failure_cancels_siblings():
+    async def slow(data):
+        await asyncio.sleep(1)
+
+    def boom(data):
+        raise RuntimeError("query failed")
+
+    graph = StageGraph("test_failure")
+    graph.add("data", lambda: 1)
+    graph.add("slow", slow, deps=["data"])
+    graph.add("boom", boom, deps=["data"])
+    try:
+        await asyncio.wait_for(graph.run(), timeout=0.5)
+    except RuntimeError as e:
+        assert "query failed" in str(e)
+        print("✅ A failing stage cancels the rest and raises.")
+    else:
+        raise AssertionError("expected RuntimeError")
+
+
+if __name__ == "__main__":
+    asyncio.run(_test_independent_stages_overlap())
+    asyncio.run(_test_failure_cancels_siblings())
@@ -0,0 +1,54 @@
+"""
+Test suite for the incremental JSON array parser (no API key needed)
+"""
+
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stream_parser import IncrementalArrayParser
+
+PROGRAMS = [
+    {"brand": "Binance", "program_url": "https://www.binance.com/vi/activity/affiliate", "commission_percent": 50, "traffic_3m": "12M+"},
+    {"brand": "Exness {Partner}", "program_url": "https://www.exness.com/partners/", "commission_percent": 0, "notes": "quote \" and ] inside"},
+    {"brand": "OKX", "tags": ["crypto", {"tier": [1, 2]}], "legitimacy_score": 8},
+]
+
+
+def chunked(text: str, size: int):
+    for i in range(0, len(text), size):
+        yield text[i:i + size]
+
+
+def test_rows_emitted_as_soon_as_complete():
+    text = "```json\n" + json.dumps(PROGRAMS, ensure_ascii=False, indent=2) + "\n```"
+    parser = IncrementalArrayParser()
+    emitted_at = []
+    consumed = 0
+    for chunk in chunked(text, 7):
+        consumed += len(chunk)
+        for row in parser.feed(chunk):
+            emitted_at.append((consumed, row))
+    assert [row for _, row in emitted_at] == PROGRAMS
+    # The first row must be available long before the stream ends
+    assert emitted_at[0][0] < len(text) / 2
+    assert parser.closed
+    print("✅ Rows are emitted incrementally, strings and nesting handled.")
+
+
+def test_wrapped_object_and_garbage():
+    parser = IncrementalArrayParser()
+    rows = parser.feed('{"type": "table", "content": [{"brand": "A"}, {"brand": "B"}]}')
+    assert rows == [{"brand": "A"}, {"brand": "B"}]
+
+    parser = IncrementalArrayParser()
+    assert parser.feed("Xin lỗi, tôi không thể trả lời.") == []
+    assert parser.rows_emitted == 0 and "Xin lỗi" in parser.buffer
+    print("✅ Wrapped responses parse and non-JSON leaves the buffer for fallback.")
+
+
+if __name__ == "__main__":
+    test_rows_emitted_as_soon_as_complete()
+    test_wrapped_object_and_garbage()
@@ -0,0 +1,173 @@
+"""
+Test suite for request tracing and the agent timings block (no API key needed)
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ["LLM_BACKEND"] = "fake"
+
+import tracing
+from tracing import current_request_id, request_id_from, span, trace_scope, traced
+from fake_llm import FakeLLM
+from llm_backend import FakeBackend
+from llm_client import set_backend
+
+
+def test_noop_outside_trace():
+    with span("orphan") as current:
+        assert current is None
+    assert current_request_id() is None
+    print("✅ spans are no-ops outside a trace")
+
+
+async def _test_propagation():
+    @traced("worker")
+    def blocking():
+        return current_request_id()
+
+    async def child():
+        with span("child"):
+            await asyncio.sleep(0.01)
+
+    with trace_scope("root", "req-1") as trace:
+        with span("parent"):
+            seen = await asyncio.to_thread(blocking)
+            await asyncio.gather(child(), child())
+    assert seen == "req-1"
+
+    by_name = {}
+    for s in trace.spans:
+        by_name.setdefault(s.name, []).append(s)
+    parent = by_name["parent"][0]
+    assert by_name["root"][0].parent_id is None
+    assert parent.parent_id == by_name["root"][0].span_id
+    assert by_name["worker"][0].parent_id == parent.span_id
+    assert [s.parent_id for s in by_name["child"]] == [parent.span_id] * 2
+    assert all(s.duration is not None for s in trace.spans)
+    assert current_request_id() is None
+    print("✅ spans nest across tasks and worker threads")
+
+
+async def _test_errors_and_export():
+    path = os.path.join(tempfile.mkdtemp(), "traces.jsonl")
+    tracing.TRACE_EXPORT_PATH = path
+
+    @traced("failing")
+    async def failing():
+        raise RuntimeError("boom")
+
+    try:
+        with trace_scope("root") as trace:
+            try:
+                await failing()
+            except RuntimeError:
+                pass
+    finally:
+        tracing.TRACE_EXPORT_PATH = ""
+
+    tracing.flush_traces()
+    with open(path) as f:
+        exported = [json.loads(line) for line in f]
+    assert len(exported) == 1
+    spans = exported[0]["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert {s["traceId"] for s in spans} == {trace.trace_id} and len(trace.trace_id) == 32
+    failed = next(s for s in spans if s["name"] == "failing")
+    assert failed["status"] == {"code": 2, "message": "RuntimeError: boom"}
+    assert failed["parentSpanId"] == next(s for s in spans if s["name"] == "root")["spanId"]
+    assert int(failed["endTimeUnixNano"]) >= int(failed["startTimeUnixNano"])
+    assert {"key": "request.id", "value": {"stringValue": trace.request_id}} in failed["attributes"]
+    print("✅ errors are recorded and traces export as OTLP/JSON")
+
+
+def test_background_export():
+    gate = threading.Event()
+    written = []
+
+    def slow_write(traces, path):
+        gate.wait(1)
+        written.append((threading.current_thread().name, len(traces)))
+
+    previous_write, previous_size = tracing._write, tracing._export_queue.maxsize
+    dropped = tracing.TRACES.labels("dropped").value
+    tracing._write = slow_write
+    tracing.TRACE_EXPORT_PATH = "unused.jsonl"
+    try:
+        started = time.perf_counter()
+        with trace_scope("first"):
+            pass
+        assert time.perf_counter() - started < 0.5, "ending a trace does not wait for the write"
+        while tracing._export_queue.qsize():
+            time.sleep(0.001)
+        tracing._export_queue.maxsize = 1
+        with trace_scope("second"):
+            pass
+        with trace_scope("third"):
+            pass
+        assert tracing.TRACES.labels("dropped").value == dropped + 1, "a full queue drops the trace"
+    finally:
+        gate.set()
+        tracing.flush_traces()
+        tracing._write, tracing._export_queue.maxsize = previous_write, previous_size
+        tracing.TRACE_EXPORT_PATH = ""
+    assert {name for name, _ in written} == {"trace-exporter"} and sum(n for _, n in written) == 2
+    print("✅ traces are written by the exporter thread")
+
+
+def test_span_limit():
+    previous = tracing.TRACE_MAX_SPANS
+    tracing.TRACE_MAX_SPANS = 5
+    try:
+        with trace_scope("root") as trace:
+            for _ in range(10):
+                with span("loop"):
+                    pass
+    finally:
+        tracing.TRACE_MAX_SPANS = previous
+    assert len(trace.spans) == 5
+    print("✅ spans beyond TRACE_MAX_SPANS are dropped")
+
+
+def test_client_request_ids():
+    assert request_id_from("req-42_A") == "req-42_A"
+    for value in (None, "", "../../etc/passwd", "a/b", "x" * 65, "id with spaces"):
+        generated = request_id_from(value)
+        assert generated != value and tracing.REQUEST_ID_PATTERN.fullmatch(generated), value
+    print("✅ malformed X-Request-Id headers are replaced by a new id")
+
+
+async def _test_agent_timings():
+    set_backend(FakeBackend(FakeLLM(latency="fixed:5", chunk_ms=0, seed=1)))
+    from generator import generate_agent_stream
+
+    messages = [{"role": "user", "content": "Biểu đồ chi phí 7 ngày qua"}]
+    events = [json.loads(line) async for line in generate_agent_stream(messages, "u1", "req-42", timings=True)]
+    context = next(e for e in events if e["event"] == "context")["context"]
+    timings = context["timings"]
+    assert timings["requestId"] == "req-42"
+    for name in ("agent.workflow", "agent.classify", "crew.data_analysis", "tool.query_ads_campaigns",
+                 "tool.calculate_metrics", "chart.build", "serialize"):
+        assert name in timings["byName"], (name, timings["byName"])
+    assert "filters" in context
+
+    events = [json.loads(line) async for line in generate_agent_stream(messages, "u1")]
+    context = next(e for e in events if e["event"] == "context")["context"]
+    assert "timings" not in context
+    print(f"✅ agent timings block ({len(timings['spans'])} spans, {timings['totalMs']}ms)")
+
+
+if __name__ == "__main__":
+    test_noop_outside_trace()
+    asyncio.run(_test_propagation())
+    asyncio.run(_test_errors_and_export())
+    test_background_export()
+    test_span_limit()
+    test_client_request_ids()
+    asyncio.run(_test_agent_timings())
+    print("\nAll tracing tests passed")
@@ -0,0 +1,326 @@
+"""
+Request Tracing
+
+Span-based tracing for /api/agent/chat turns. A trace is opened per request
+(carrying the request id) and every span started while it is active - in
+the request task, in tasks it creates and in `asyncio.to_thread` workers -
+is attached to it through context variables. Outside a trace `span()` is a
+no-op, so instrumented code costs almost nothing when tracing is unused.
+Spans entered in worker threads also attribute the thread to the request's
+sampling profile, if any (see profiling.py).
+
+Finished traces are appended to TRACE_EXPORT_PATH (if set) as one OTLP/JSON
+line per trace, the format read by the OpenTelemetry Collector's
+`otlpjsonfile` receiver. Encoding and file writes happen on an exporter
+thread fed by a bounded queue (TRACE_EXPORT_QUEUE_SIZE), so ending a request
+costs a non-blocking put; traces that find the queue full are dropped and
+counted. `Trace.timings()` gives the per-span breakdown that
+the agent endpoint returns in its context when asked to.
+
+Usage:
+    with trace_scope("agent.chat", request_id) as trace:
+        with span("agent.classify"):
+            ...
+        print(trace.timings())
+
+    @traced("tool.query_ads_campaigns")
+    def _run(self, query: str) -> str: ...
+"""
+
+import contextvars
+import functools
+import inspect
+import json
+import atexit
+import os
+import queue
+import random
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Optional
+
+from metrics import Counter
+from profiling import enter_thread, exit_thread
+
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "adecos-backend")
+# Spans beyond this per trace are dropped (keeps runaway loops from growing a trace)
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "512"))
+TRACE_EXPORT_QUEUE_SIZE = int(os.getenv("TRACE_EXPORT_QUEUE_SIZE", "1000"))
+
+TRACES = Counter("traces_total", "Traces finished by export result", ["result"])
+SPANS_DROPPED = Counter("trace_spans_dropped_total", "Spans dropped because a trace hit TRACE_MAX_SPANS")
+
+# OTLP enums
+_SPAN_KIND_INTERNAL = 1
+_SPAN_KIND_SERVER = 2
+_STATUS_OK = 1
+_STATUS_ERROR = 2
+
+_trace = contextvars.ContextVar("trace", default=None)
+_span = contextvars.ContextVar("span", default=None)
+_export_queue = queue.Queue(TRACE_EXPORT_QUEUE_SIZE)  # (path, trace) waiting for the exporter thread
+_exporter = None
+_exporter_lock = threading.Lock()
+
+# Client-supplied request ids end up in headers, logs and profile file names
+REQUEST_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+def request_id_from(value: Optional[str]) -> str:
+    """`value` (an X-Request-Id header) if it matches REQUEST_ID_PATTERN, else a new id."""
+    return value if value and REQUEST_ID_PATTERN.fullmatch(value) else new_request_id()
+
+
+class Span:
+    __slots__ = ("name", "span_id", "parent_id", "start_ns", "end_ns", "started", "duration", "attributes", "error")
+
+    def __init__(self, name: str, parent_id: Optional[str], attributes: dict):
+        self.name = name
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.started = time.perf_counter()
+        self.duration = None
+        self.attributes = attributes
+        self.error = None
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def finish(self) -> None:
+        self.duration = time.perf_counter() - self.started
+        self.end_ns = self.start_ns + int(self.duration * 1e9)
+
+
+class Trace:
+    """The spans recorded for one request."""
+
+    def __init__(self, name: str, request_id: str):
+        self.name = name
+        self.request_id = request_id
+        # A 32-hex-digit request id doubles as the OTLP trace id
+        self.trace_id = request_id if len(request_id) == 32 and _is_hex(request_id) else uuid.uuid4().hex
+        self.spans = []
+        self.started = time.perf_counter()
+
+    def add(self, span: Span) -> bool:
+        if len(self.spans) >= TRACE_MAX_SPANS:
+            SPANS_DROPPED.inc()
+            return False
+        self.spans.append(span)
+        return True
+
+    def timings(self) -> dict:
+        """Per-span offsets and durations (ms) plus totals per span name."""
+        spans = list(self.spans)
+        names = {s.span_id: s.name for s in spans}
+        by_name = {}
+        for s in spans:
+            if s.duration is not None:
+                by_name[s.name] = round(by_name.get(s.name, 0.0) + s.duration * 1000, 1)
+        return {
+            "requestId": self.request_id,
+            "totalMs": round((time.perf_counter() - self.started) * 1000, 1),
+            "byName": by_name,
+            "spans": [
+                {
+                    "name": s.name,
+                    "parent": names.get(s.parent_id),
+                    "startMs": round((s.started - self.started) * 1000, 1),
+                    "durationMs": round(s.duration * 1000, 1) if s.duration is not None else None,
+                    **({"error": s.error} if s.error else {}),
+                }
+                for s in sorted(spans, key=lambda s: s.started)
+            ],
+        }
+
+    def to_otlp(self) -> dict:
+        """ExportTraceServiceRequest in OTLP/JSON encoding."""
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": _attributes({"service.name": TRACE_SERVICE_NAME})},
+                "scopeSpans": [{
+                    "scope": {"name": "adecos.tracing"},
+                    "spans": [self._otlp_span(s) for s in self.spans if s.end_ns is not None],
+                }],
+            }]
+        }
+
+    def _otlp_span(self, s: Span) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": s.span_id,
+            "name": s.name,
+            "kind": _SPAN_KIND_INTERNAL if s.parent_id else _SPAN_KIND_SERVER,
+            "startTimeUnixNano": str(s.start_ns),
+            "endTimeUnixNano": str(s.end_ns),
+            "attributes": _attributes({"request.id": self.request_id, **s.attributes}),
+            "status": {"code": _STATUS_ERROR, "message": s.error} if s.error else {"code": _STATUS_OK},
+        }
+        if s.parent_id:
+            span["parentSpanId"] = s.parent_id
+        return span
+
+
+def _is_hex(value: str) -> bool:
+    try:
+        int(value, 16)
+        return True
+    except ValueError:
+        return False
+
+
+def _attributes(values: dict) -> list:
+    attributes = []
+    for key, value in values.items():
+        if isinstance(value, bool):
+            encoded = {"boolValue": value}
+        elif isinstance(value, int):
+            encoded = {"intValue": str(value)}
+        elif isinstance(value, float):
+            encoded = {"doubleValue": value}
+        else:
+            encoded = {"stringValue": str(value)}
+        attributes.append({"key": key, "value": encoded})
+    return attributes
+
+
+def _reset(var: contextvars.ContextVar, token) -> None:
+    # Async generators may be closed from another context; the value then simply stays
+    try:
+        var.reset(token)
+    except ValueError:
+        pass
+
+
+def current_trace() -> Optional[Trace]:
+    return _trace.get()
+
+
+def current_request_id() -> Optional[str]:
+    trace = _trace.get()
+    return trace.request_id if trace else None
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Record `name` as a child of the current span; yields the Span (None outside a trace)."""
+    trace = _trace.get()
+    if trace is None:
+        yield None
+        return
+    parent = _span.get()
+    current = Span(name, parent.span_id if parent else None, attributes)
+    if not trace.add(current):
+        yield None
+        return
+    token = _span.set(current)
+    thread = enter_thread()
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        exit_thread(thread)
+        current.finish()
+        _reset(_span, token)
+
+
+def traced(name: str):
+    """Decorator recording each call of a sync or async function as a span."""
+    def decorate(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+@contextmanager
+def trace_scope(name: str, request_id: Optional[str] = None, **attributes):
+    """Open a trace with a root span `name`; the trace is exported when the scope ends."""
+    trace = Trace(name, request_id or new_request_id())
+    trace_token = _trace.set(trace)
+    span_token = _span.set(None)
+    try:
+        with span(name, **attributes):
+            yield trace
+    finally:
+        _reset(_span, span_token)
+        _reset(_trace, trace_token)
+        export(trace)
+
+
+def export(trace: Trace) -> None:
+    """Queue a finished trace for the exporter thread; never blocks the caller."""
+    if not TRACE_EXPORT_PATH:
+        TRACES.labels("not_exported").inc()
+        return
+    _start_exporter()
+    try:
+        _export_queue.put_nowait((TRACE_EXPORT_PATH, trace))
+    except queue.Full:
+        TRACES.labels("dropped").inc()
+
+
+def flush_traces() -> None:
+    """Block until the exporter has written every trace queued so far."""
+    if _exporter is not None:
+        _export_queue.join()
+
+
+def _start_exporter() -> None:
+    global _exporter
+    if _exporter is not None:
+        return
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = threading.Thread(target=_export_loop, name="trace-exporter", daemon=True)
+            _exporter.start()
+            atexit.register(flush_traces)
+
+
+def _export_loop() -> None:
+    while True:
+        batch = [_export_queue.get()]
+        # Write whatever else is already waiting with the same open()
+        while len(batch) < 100:
+            try:
+                batch.append(_export_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            for path in dict.fromkeys(path for path, _ in batch):
+                _write([trace for p, trace in batch if p == path], path)
+        finally:
+            for _ in batch:
+                _export_queue.task_done()
+
+
+def _write(traces: list, path: str) -> None:
+    lines = "".join(json.dumps(trace.to_otlp(), ensure_ascii=False) + "\n" for trace in traces)
+    try:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(lines)
+        TRACES.labels("exported").inc(len(traces))
+    except Exception as e:  # keep the exporter thread alive
+        TRACES.labels("export_error").inc(len(traces))
+        print(f"Trace export to {path} failed: {e}")
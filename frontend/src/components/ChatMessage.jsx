@@ -42,7 +42,7 @@ const ChatMessage = ({ message, onSearch }) => {
             <div className="flex w-full justify-start my-4 px-4 md:px-0 fade-in-up">
                 <div className="bg-white/5 border border-white/10 text-luxury-white/60 px-6 py-4 rounded-3xl rounded-tl-sm backdrop-blur-md text-sm font-light italic tracking-wider animate-pulse flex items-center gap-2">
                     <div className="w-2 h-2 bg-white/40 rounded-full animate-bounce"></div>
-                    Adecos đang phân tích...
+                    {content || 'Adecos đang phân tích...'}
                 </div>
             </div>
         );
@@ -12,9 +12,14 @@ import ResultsTable from '../ResultsTable';
  * - chart: Dynamic chart visualization
  * - table: Tabular data display
  * - insight: Styled insight cards
+ *
+ * Sections streamed from /api/agent/chat carry `id` and `order`.
  */
 const CompositeMessage = ({ content, context }) => {
-    const { sections = [] } = content;
+    // Streamed sections may arrive in any order; `order` is their final position
+    const sections = [...(content.sections || [])].sort(
+        (a, b) => (a.order ?? 0) - (b.order ?? 0)
+    );
 
     // Markdown components for narrative sections
     const markdownComponents = {
@@ -126,10 +131,26 @@ const CompositeMessage = ({ content, context }) => {
         return value.toLocaleString();
     };
 
+    // Helper to format cache age
+    const formatCacheAge = (seconds = 0) => {
+        if (seconds < 60) return 'vừa xong';
+        if (seconds < 3600) return `${Math.floor(seconds / 60)} phút trước`;
+        if (seconds < 86400) return `${Math.floor(seconds / 3600)} giờ trước`;
+        return `${Math.floor(seconds / 86400)} ngày trước`;
+    };
+
     return (
         <div className="w-full fade-in-up">
             {/* Render all sections in order */}
-            {sections.map((section, index) => renderSection(section, index))}
+            {sections.map((section, index) => renderSection(section, section.id || index))}
+
+            {/* Cache freshness */}
+            {context?.cache?.hit && (
+                <div className="w-full px-4 md:px-6 text-xs text-luxury-gray text-center">
+                    Dữ liệu được lưu {formatCacheAge(context.cache.ageSeconds)}
+                    {context.cache.degraded ? ' • chế độ dự phòng' : context.cache.stale ? ' • đang cập nhật' : ''}
+                </div>
+            )}
 
             {/* Follow-up suggestions */}
             {context?.followupSuggestions && context.followupSuggestions.length > 0 && (
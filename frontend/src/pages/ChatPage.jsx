@@ -4,11 +4,23 @@ import ChatInterface from '../components/ChatInterface';
 import ChatMessage from '../components/ChatMessage';
 import { generateMockWorkflow, shouldTriggerWorkflow } from '../data/mockWorkflowData';
 
+// Loading label shown as soon as the routing decision arrives
+const ROUTE_LABELS = {
+    data_analysis: 'Đang truy vấn dữ liệu quảng cáo...',
+    comparison: 'Đang so sánh dữ liệu...',
+    data_query: 'Đang lấy danh sách...',
+    research: 'Đang tìm chương trình affiliate...',
+    explanation: 'Đang soạn giải thích...',
+    followup: 'Đang phân tích tiếp...'
+};
+
 function ChatPage() {
     const { messages, setMessages, getHistory } = useChatContext();
     const [isSearching, setIsSearching] = React.useState(false);
     const [hasSearched, setHasSearched] = React.useState(false);
     const messagesEndRef = useRef(null);
+    // In-flight agent request; aborted when a new message is sent or the page unmounts
+    const abortRef = useRef(null);
 
     const scrollToBottom = () => {
         messagesEndRef.current?.scrollIntoView({ behavior: "smooth" });
@@ -23,6 +35,8 @@ function ChatPage() {
         setHasSearched(messages.length > 0);
     }, [messages]);
 
+    useEffect(() => () => abortRef.current?.abort(), []);
+
     // Listen for follow-up suggestion clicks
     useEffect(() => {
         const handleSuggestionClick = (event) => {
@@ -52,6 +66,8 @@ function ChatPage() {
         // Add user message to UI
         setMessages(prev => [...prev, { role: 'user', type: 'text', content: query }]);
 
+        let controller = null;
+        let aiMessage = null;
         try {
             console.log('[ChatPage] Sending request to AI Agent API...');
 
@@ -83,11 +99,15 @@ function ChatPage() {
                 return;
             }
 
-            // Use new agent endpoint
+            // Use new agent endpoint; dropping the previous stream lets the backend stop its work
+            abortRef.current?.abort();
+            controller = new AbortController();
+            abortRef.current = controller;
             const response = await fetch('http://localhost:8000/api/agent/chat', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({ messages: newMessages }),
+                signal: controller.signal,
             });
 
             if (!response.ok) {
@@ -99,62 +119,108 @@ function ChatPage() {
             const reader = response.body.getReader();
             const decoder = new TextDecoder();
             let buffer = '';
+            aiMessage = { role: 'assistant', type: 'loading', content: '' };
+            let received = false;
 
             // Initialize AI Message in UI
-            setMessages(prev => [...prev, { role: 'assistant', type: 'loading', content: '' }]);
+            setMessages(prev => [...prev, aiMessage]);
+
+            const updateAiMessage = (next) => {
+                aiMessage = next;
+                setMessages(prev => {
+                    const newArr = [...prev];
+                    newArr[newArr.length - 1] = next;
+                    return newArr;
+                });
+            };
+
+            // Apply one NDJSON event (route, section, context, message, done)
+            const applyEvent = (event) => {
+                switch (event.event) {
+                    case 'route':
+                        updateAiMessage({ ...aiMessage, content: ROUTE_LABELS[event.intent] || '' });
+                        break;
+                    case 'section': {
+                        const sections = aiMessage.type === 'composite' ? aiMessage.content.sections : [];
+                        const incoming = { ...event.section, id: event.id, order: event.order };
+                        updateAiMessage({
+                            ...aiMessage,
+                            type: 'composite',
+                            content: {
+                                ...(aiMessage.type === 'composite' ? aiMessage.content : {}),
+                                sections: [...sections.filter(section => section.id !== event.id), incoming]
+                            }
+                        });
+                        received = true;
+                        break;
+                    }
+                    case 'context':
+                        updateAiMessage({ ...aiMessage, context: event.context });
+                        break;
+                    case 'message':
+                        updateAiMessage({ role: 'assistant', type: event.type, content: event.content, context: aiMessage.context || null });
+                        received = true;
+                        break;
+                    case 'done':
+                        if (event.summary && aiMessage.type === 'composite') {
+                            updateAiMessage({ ...aiMessage, content: { ...aiMessage.content, summary: event.summary } });
+                        }
+                        break;
+                    default:
+                        // Legacy single-document response
+                        if (event.type && event.content !== undefined) {
+                            updateAiMessage({ role: 'assistant', type: event.type, content: event.content, context: event.context || null });
+                            received = true;
+                        }
+                }
+            };
 
             while (true) {
                 const { value, done } = await reader.read();
                 if (done) break;
 
-                const chunk = decoder.decode(value, { stream: true });
-                buffer += chunk;
+                buffer += decoder.decode(value, { stream: true });
+                const lines = buffer.split('\n');
+                buffer = lines.pop();
+
+                for (const line of lines) {
+                    if (!line.trim()) continue;
+                    try {
+                        applyEvent(JSON.parse(line));
+                    } catch (e) {
+                        console.error('[ChatPage] Parse error:', e, line.substring(0, 200));
+                    }
+                }
             }
 
-            console.log('[ChatPage] Stream complete, buffer length:', buffer.length);
-            console.log('[ChatPage] Buffer preview:', buffer.substring(0, 200));
-
-            // Parse complete JSON after stream ends
-            try {
-                const parsed = JSON.parse(buffer);
-                console.log('[ChatPage] Parsed successfully, type:', parsed.type);
+            if (buffer.trim()) {
+                try {
+                    applyEvent(JSON.parse(buffer));
+                } catch (e) {
+                    console.error('[ChatPage] Parse error:', e, buffer.substring(0, 200));
+                }
+            }
 
-                if (parsed.type && parsed.content !== undefined) {
-                    const aiMessage = {
-                        role: 'assistant',
-                        type: parsed.type,
-                        content: parsed.content,
-                        context: parsed.context || null
-                    };
+            console.log('[ChatPage] Stream complete, final type:', aiMessage.type);
 
-                    console.log('[ChatPage] Updating messages with:', aiMessage.type);
-
-                    // Update UI
-                    setMessages(prev => {
-                        const newArr = [...prev];
-                        newArr[newArr.length - 1] = aiMessage;
-                        console.log('[ChatPage] Updated! New array length:', newArr.length);
-                        return newArr;
-                    });
-                } else {
-                    console.error('[ChatPage] Invalid format - missing type or content');
-                    throw new Error('Invalid response format');
-                }
-            } catch (e) {
-                console.error('[ChatPage] Parse error:', e);
-                console.error('[ChatPage] Full buffer:', buffer);
-                setMessages(prev => {
-                    const newArr = [...prev];
-                    newArr[newArr.length - 1] = {
-                        role: 'assistant',
-                        type: 'text',
-                        content: 'Đã nhận phản hồi nhưng không thể hiển thị. Vui lòng thử lại.'
-                    };
-                    return newArr;
+            if (!received) {
+                updateAiMessage({
+                    role: 'assistant',
+                    type: 'text',
+                    content: 'Đã nhận phản hồi nhưng không thể hiển thị. Vui lòng thử lại.'
                 });
             }
 
         } catch (error) {
+            if (error.name === 'AbortError') {
+                console.log('[ChatPage] Request aborted');
+                // Drop the placeholder if nothing arrived (it is no longer the last message)
+                if (aiMessage?.type === 'loading') {
+                    const placeholder = aiMessage;
+                    setMessages(prev => prev.filter(message => message !== placeholder));
+                }
+                return;
+            }
             console.error("[ChatPage] Streaming error", error);
             setMessages(prev => {
                 const newArr = [...prev];
@@ -167,7 +233,10 @@ function ChatPage() {
             });
         } finally {
             console.log('[ChatPage] Query complete');
-            setIsSearching(false);
+            // A superseded request must not clear the loading state of its replacement
+            if (!controller || abortRef.current === controller) {
+                setIsSearching(false);
+            }
         }
     };
 
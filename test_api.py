@@ -19,10 +19,11 @@ print(f"Response length: {len(buffer_str)}")
 print(f"First 200 chars: {buffer_str[:200]}")
 
 try:
-    data = json.loads(buffer_str)
-    print(f"Type: {data['type']}")
-    if data['type'] == 'table':
-        print(f"Number of programs: {len(data['content'])}")
+    lines = [json.loads(line) for line in buffer_str.splitlines() if line.strip()]
+    print(f"Types: {[line['type'] for line in lines]}")
+    if lines[-1]['type'] == 'table_end':
+        print(f"Number of programs: {lines[-1]['count']}")
+        print(f"Time to first row: {lines[-1]['context'].get('timeToFirstRowMs')} ms")
     print("✅ Table request SUCCESS")
 except Exception as e:
     print(f"❌ Parse error: {e}")